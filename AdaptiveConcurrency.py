@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# AdaptiveConcurrency limits the number of transfers that run at the same
+# time, and adjusts that limit to the observed throughput (AIMD, as TCP does)
+#
+# Workers call acquire() before and release() after a transfer, and report
+# each transfer with record(size, seconds, ok). Large transfers report the
+# bytes they move with progress(size) as well, so that the throughput is
+# measured while they run, not only when they complete. Every ADJUST_INTERVAL
+# seconds the throughput of the past interval is evaluated:
+#   - if a transfer failed, the limit is halved (multiplicative decrease)
+#   - if the throughput dropped below the best throughput since the last
+#     decrease, or the latency of small transfers has risen well above the
+#     lowest latency seen, the server or the network is saturated, and the
+#     limit is decreased as well
+#   - otherwise, if the limit has been reached during the interval, it is
+#     increased by one (additive increase)
+# The limit stays within [minimum, maximum], the maximum being the number of
+# workers (and sessions) that the caller has made available. DEFAULT_MAXIMUM
+# is the maximum for sync runs that do not set one, well above the default
+# number of workers, so that adaptive mode can raise the concurrency too.
+#
+
+import time
+import threading
+from SyncMetrics import metrics
+
+# maximum number of concurrent transfers of adaptive sync runs (by default)
+DEFAULT_MAXIMUM = 16
+# seconds between two adjustments of the limit
+ADJUST_INTERVAL = 2.0
+# factor applied to the limit on a congestion signal
+DECREASE_FACTOR = 0.5
+# a throughput drop larger than this fraction (of the best throughput since
+# the last decrease) is a congestion signal
+THROUGHPUT_DROP = 0.2
+# a latency of more than this times the lowest latency is a congestion signal
+LATENCY_FACTOR = 3.0
+# transfers up to this size (bytes) are used to measure the latency
+SMALL_TRANSFER = 1024 * 1024
+
+
+class AdaptiveConcurrency():
+    def __init__(self, initial, maximum, minimum=1, clock=time.monotonic):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.clock = clock
+        self.active = 0
+        self.condition = threading.Condition()
+        # measurements of the current interval
+        self.window_start = clock()
+        self.window_bytes = 0
+        self.window_errors = 0
+        self.window_latencies = []
+        # true if the limit has been reached during the interval
+        self.window_saturated = False
+        self.peak_throughput = None
+        self.best_latency = None
+        metrics.set('concurrency', self.limit)
+
+
+    # waits until a transfer may start
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+            if self.active >= self.limit:
+                self.window_saturated = True
+
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+
+    # reports a transfer of size bytes that took seconds, ok is false if it
+    # failed, credited is the part of size that was reported with progress()
+    def record(self, size, seconds, ok, credited=0):
+        with self.condition:
+            if ok:
+                self.window_bytes += max(0, size - credited)
+                if size <= SMALL_TRANSFER:
+                    self.window_latencies.append(seconds)
+            else:
+                self.window_errors += 1
+            self.check()
+
+
+    # reports size bytes moved by a transfer that is still running
+    def progress(self, size):
+        with self.condition:
+            self.window_bytes += size
+            self.check()
+
+
+    # PRIVATE METHODS
+
+    # adjusts the limit if the interval has passed (called with the condition held)
+    def check(self):
+        now = self.clock()
+        if now - self.window_start >= ADJUST_INTERVAL:
+            self.adjust(now)
+
+
+    # (called with the condition held)
+    def adjust(self, now):
+        throughput = self.window_bytes / (now - self.window_start)
+        latency = None
+        if len(self.window_latencies) > 0:
+            latency = sum(self.window_latencies) / len(self.window_latencies)
+        congested = self.window_errors > 0
+        if (self.peak_throughput is not None and
+                throughput < self.peak_throughput * (1 - THROUGHPUT_DROP)):
+            congested = True
+        if (latency is not None and self.best_latency is not None and
+                latency > self.best_latency * LATENCY_FACTOR):
+            congested = True
+        if latency is not None and (self.best_latency is None or latency < self.best_latency):
+            self.best_latency = latency
+        limit = self.limit
+        if congested:
+            limit = max(self.minimum, int(self.limit * DECREASE_FACTOR))
+            metrics.count('concurrency_decreases')
+        elif self.window_saturated:
+            # only probe for more if the current limit is actually used
+            limit = min(self.maximum, self.limit + 1)
+        if limit > self.limit:
+            self.condition.notify(limit - self.limit)
+        if limit < self.limit:
+            # a lower limit lowers the throughput, start measuring anew
+            self.peak_throughput = None
+        elif self.peak_throughput is None or throughput > self.peak_throughput:
+            self.peak_throughput = throughput
+        self.limit = limit
+        metrics.set('concurrency', self.limit)
+        self.window_start = now
+        self.window_bytes = 0
+        self.window_errors = 0
+        self.window_latencies = []
+        self.window_saturated = self.active >= self.limit
@@ -4,10 +4,16 @@
 # Application manages the application window 
 # 
 
+import os
+import time
 import gi
 from gi.repository import Gtk, GdkPixbuf, Gdk, Gio, GLib
 from MainBox import MainBox
 
+# if set, the time to first paint is printed and the application quits
+# (see benchmarks/bench_first_paint.py)
+FIRST_PAINT_ENV = 'MYRODS_SYNC_FIRST_PAINT'
+
 
 MENU_XML = """
 <?xml version="1.0" encoding="UTF-8"?>
@@ -20,6 +26,13 @@ MENU_XML = """
         <attribute name="label" translatable="yes">Disconnect</attribute>
       </item>
     </submenu>
+    <submenu>
+      <attribute name="label" translatable="yes">Jobs</attribute>
+      <item>
+        <attribute name="action">win.queue</attribute>
+        <attribute name="label" translatable="yes">Show queue</attribute>
+      </item>
+    </submenu>
   </menu>
 </interface>
 """
@@ -41,6 +54,9 @@ class Application(Gtk.ApplicationWindow):
         a_disconnect = Gio.SimpleAction.new("disconnect", None)
         a_disconnect.connect("activate", self.on_disconnect)
         self.add_action(a_disconnect)
+        a_queue = Gio.SimpleAction.new("queue", None)
+        a_queue.connect("activate", self.on_queue)
+        self.add_action(a_queue)
 
         # build menu bar
         builder = Gtk.Builder.new_from_string(MENU_XML, -1)
@@ -59,6 +75,28 @@ class Application(Gtk.ApplicationWindow):
         box.add( self.mainbox )
         self.add(box)
 
+        # measure the time from program start until the window is painted
+        self.start_time = data.get('start_time')
+        self.first_paint_budget = data.get('first_paint_budget')
+        if self.start_time is not None:
+            self.paint_handler = self.connect_after('draw', self.on_first_draw)
+
+
+    def on_first_draw(self, widget, cr):
+        self.disconnect(self.paint_handler)
+        elapsed = time.monotonic() - self.start_time
+        if os.environ.get(FIRST_PAINT_ENV):
+            print('first paint: {:.1f} ms'.format(elapsed * 1000))
+            GLib.idle_add(self.destroy)
+        if self.first_paint_budget is not None and elapsed > self.first_paint_budget:
+            print('Warning: window painted after {:.2f} s, budget is {:.2f} s'.format(
+                elapsed, self.first_paint_budget))
+        return False
+
 
     def on_disconnect(self, action, value):
         self.mainbox.on_disconnect()
+
+
+    def on_queue(self, action, value):
+        self.mainbox.show_queue()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# BandwidthLimiter caps the data rate of all transfers of a sync run
+# (a token bucket), the cap may depend on the time of day
+#
+# The cap applies to one run, i.e. to one job: jobs that run at the same time
+# each have their own cap.
+#
+# A schedule is a comma separated list of rates in MB/s, each optionally
+# preceded by the time range in which it applies, e.g.
+#     50                        at most 50 MB/s
+#     08:00-18:00=20,100        20 MB/s during office hours, 100 MB/s otherwise
+#     08:00-18:00=20            20 MB/s during office hours, unlimited otherwise
+# A time range may wrap around midnight (22:00-06:00). The first matching
+# range applies, a rate without range applies when no range matches. A rate
+# of 0 means unlimited.
+#
+# Transfers call consume(size) before sending or after receiving size bytes.
+# The bucket holds at most BURST_SECONDS worth of tokens. A consumer that
+# takes more tokens than available waits until the debt has been paid off at
+# the current rate, so the average rate never exceeds the cap.
+#
+
+import re
+import time
+import threading
+from SyncMetrics import metrics
+
+MB = 1024 * 1024
+# seconds of transfer at the full rate that may be sent in a burst
+BURST_SECONDS = 1.0
+# the schedule is checked again after this many seconds
+SCHEDULE_CHECK = 60.0
+
+RANGE_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(.+)$')
+
+
+class BandwidthLimiter():
+    def __init__(self, schedule, clock=time.monotonic, localtime=time.localtime):
+        # list of (start minute, end minute, bytes/s), end minute None for the default
+        self.rules = parse_schedule(schedule)
+        self.clock = clock
+        self.localtime = localtime
+        self.lock = threading.Lock()
+        self.rate = None
+        self.rate_checked = None
+        self.tokens = 0.0
+        self.updated = clock()
+
+
+    # the current cap in bytes/s, None if unlimited
+    def current_rate(self):
+        now = self.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.rules:
+            if end is None or in_range(minute, start, end):
+                return rate
+        return None
+
+
+    # takes size bytes worth of tokens, waits if the bucket runs into debt
+    def consume(self, size):
+        with self.lock:
+            now = self.clock()
+            if self.rate_checked is None or now - self.rate_checked >= SCHEDULE_CHECK:
+                self.set_rate(self.current_rate())
+                self.rate_checked = now
+            if self.rate is None:
+                return
+            self.tokens = min(self.rate * BURST_SECONDS,
+                    self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= size
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            metrics.count('throttled_seconds', wait)
+            time.sleep(wait)
+
+
+    # PRIVATE METHODS
+
+    def set_rate(self, rate):
+        if rate != self.rate:
+            # start with a full bucket at the new rate
+            self.tokens = rate * BURST_SECONDS if rate is not None else 0.0
+            self.updated = self.clock()
+        self.rate = rate
+
+
+# returns the rules of a schedule, raises ValueError if it is invalid
+def parse_schedule(schedule):
+    rules = []
+    default = []
+    for part in schedule.split(','):
+        part = part.strip()
+        match = RANGE_PATTERN.match(part)
+        if match is None:
+            default.append((0, None, parse_rate(part)))
+            continue
+        start_hour, start_minute, end_hour, end_minute, rate = match.groups()
+        start = int(start_hour) * 60 + int(start_minute)
+        end = int(end_hour) * 60 + int(end_minute)
+        if start > 24 * 60 or end > 24 * 60:
+            raise ValueError('invalid time range ' + part)
+        rules.append((start, end, parse_rate(rate)))
+    if len(default) > 1:
+        raise ValueError('more than one rate without time range')
+    return rules + default
+
+
+# converts a rate in MB/s to bytes/s, None for unlimited
+def parse_rate(text):
+    rate = float(text)
+    if rate < 0:
+        raise ValueError('negative rate ' + text)
+    if rate == 0:
+        return None
+    return rate * MB
+
+
+def in_range(minute, start, end):
+    if start <= end:
+        return start <= minute < end
+    # wraps around midnight
+    return minute >= start or minute < end
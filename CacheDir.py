@@ -0,0 +1,22 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# CacheDir locates the per-user directory in which the application keeps 
+# cached data. It follows the XDG base directory specification:
+# $XDG_CACHE_HOME/myrods-sync  (default ~/.cache/myrods-sync)
+#
+
+import os
+
+CACHE_SUBDIR = 'myrods-sync'
+
+
+# returns the path of a file in the cache directory, 
+# missing directories are created on the fly
+def cache_path(*names):
+    base = os.environ.get('XDG_CACHE_HOME')
+    if base is None or base == '':
+        base = os.path.expanduser('~/.cache')
+    path = os.path.join(base, CACHE_SUBDIR, *names)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    return path
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Checksum computes checksums of local files in the format used by iRODS
+#   sha2:<base64 of SHA-256 digest>   or   <hex of MD5 digest>
+# so that they can be compared with the DATA_CHECKSUM of a data object
+#
+# hash_files computes the checksums of many files in a pool of processes.
+#
+
+import os
+import base64
+import hashlib
+from SyncMetrics import metrics
+
+SHA256_PREFIX = 'sha2:'
+BUFFER_SIZE = 4 * 1024 * 1024
+MIN_BUFFER_SIZE = 64 * 1024
+# maximum number of files that a pool process hashes per task
+HASH_BATCH = 64
+
+
+# returns the checksum of (a part of) a local file, in the same scheme as the 
+# given iRODS checksum (SHA-256 if reference is None)
+def local_checksum(path, reference=None, offset=0, length=None):
+    md5 = reference is not None and not reference.startswith(SHA256_PREFIX)
+    digest = hashlib.md5() if md5 else hashlib.sha256()
+    with metrics.timer('hash'), open(path, 'rb', buffering = 0) as f:
+        size = length if length is not None else os.fstat(f.fileno()).st_size
+        # a small file does not need (the zero filling of) a large buffer
+        view = memoryview(bytearray(min(BUFFER_SIZE, max(size, MIN_BUFFER_SIZE))))
+        if hasattr(os, 'posix_fadvise'):
+            # let the kernel read ahead aggressively
+            os.posix_fadvise(f.fileno(), offset, length or 0,
+                    os.POSIX_FADV_SEQUENTIAL)
+        f.seek(offset)
+        todo = length
+        while todo is None or todo > 0:
+            want = len(view) if todo is None else min(len(view), todo)
+            count = f.readinto(view[:want])
+            if not count:
+                break
+            digest.update(view[:count])
+            if todo is not None:
+                todo -= count
+            metrics.count('bytes_hashed', count)
+    return irods_checksum(digest)
+
+
+# formats a hashlib digest the way iRODS does
+def irods_checksum(digest):
+    if digest.name == 'md5':
+        return digest.hexdigest()
+    return SHA256_PREFIX + base64.b64encode(digest.digest()).decode('ascii')
+
+
+# submits files to a ProcessPoolExecutor for hashing, jobs is a list of
+# (path, reference), see local_checksum. Returns an iterator of (checksum, 
+# error) in the order of the jobs. The jobs are submitted right away, so the
+# caller can do other work while the files are hashed.
+def hash_files(pool, jobs, processes):
+    # small files are hashed in batches, to reduce the overhead per file
+    batch = max(1, min(HASH_BATCH, len(jobs) // (processes * 4)))
+    return pool.map(hash_file, jobs, chunksize = batch)
+
+
+# (runs in a pool process)
+def hash_file(job):
+    path, reference = job
+    try:
+        return local_checksum(path, reference), None
+    except OSError as e:
+        return None, str(e)
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# ChunkedTransfer moves a large file as a number of byte ranges (chunks) 
+# that are transferred concurrently, each stream using its own iRODS session
+#
+#   upload   : the data object is opened once for writing, the other streams 
+#              open the same replica (using its replica token) and write their 
+#              chunks at seeked offsets. Closing the first handle finalizes it.
+#   download : a partial file next to the local file is preallocated, each
+#              stream reads its chunks from the data object and writes them
+#              at their offset. Once all chunks are verified, the partial file
+#              replaces the local file, so an interrupted download never
+#              leaves a truncated or half written file in its place.
+# Finally the checksum of the local file is compared with the checksum of
+# the data object (computed by the server if missing).
+#
+# A transfer can be restricted to the chunks that are still missing, to 
+# resume an interrupted transfer. The checksum of each transferred chunk is
+# reported, so it can be recorded in a checkpoint journal.
+#
+# With a BandwidthLimiter, each buffer is throttled before it is transferred.
+# With an AdaptiveConcurrency, each buffer is reported to it as progress.
+#
+
+import os
+import queue
+import hashlib
+import threading
+from Checksum import local_checksum, irods_checksum
+from SyncMetrics import metrics
+
+# files of at least this size (bytes) are transferred in chunks
+DEFAULT_THRESHOLD = 256 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_STREAMS = 4
+BUFFER_SIZE = 4 * 1024 * 1024
+# suffix of the file that receives a chunked download (see partial_path)
+PARTIAL_SUFFIX = '.myrods-partial'
+
+
+class ChunkedTransferError(Exception):
+    pass
+
+
+class ChunkedTransfer():
+    # connection provides sessions for the streams, see MyRodsConnection.acquire
+    def __init__(self, connection, threshold=DEFAULT_THRESHOLD,
+            chunk_size=DEFAULT_CHUNK_SIZE, streams=DEFAULT_STREAMS, limiter=None,
+            concurrency=None):
+        self.connection = connection
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.threshold = threshold
+        self.chunk_size = max(BUFFER_SIZE, chunk_size)
+        self.streams = max(1, streams)
+
+
+    def applies_to(self, size):
+        return size >= self.threshold and size > self.chunk_size
+
+
+    # returns a list of (offset, length) of the chunks of a file
+    def chunks(self, size):
+        return [ (offset, min(self.chunk_size, size - offset))
+                 for offset in range(0, size, self.chunk_size) ]
+
+
+    # uploads a local file, session is used to create the data object
+    # done(offset, length, checksum) is called for each chunk that has been 
+    # written. if resume is set, the existing content is not truncated.
+    def upload(self, session, local_path, remote_path, size, chunks=None, 
+            done=None, resume=False):
+        # (imported here, the job queue reads the constants of this module
+        # without loading the iRODS client)
+        import irods.keywords as kw
+        if chunks is None:
+            chunks = self.chunks(size)
+        if resume:
+            main = session.data_objects.open(remote_path, 'r+', create = False)
+        else:
+            main = session.data_objects.open(remote_path, 'w', 
+                    **{kw.FORCE_FLAG_KW: ''})
+        try:
+            token, hierarchy = main.raw.replica_access_info()
+            options = { kw.RESC_HIER_STR_KW: hierarchy, 
+                        kw.REPLICA_TOKEN_KW: token }
+            with open(local_path, 'rb', buffering = 0) as f:
+                def write_chunk(stream_session, offset, length):
+                    obj = stream_session.data_objects.open(remote_path, 'a',
+                            create = False, finalize_on_close = False, **options)
+                    digest = hashlib.sha256()
+                    try:
+                        obj.seek(offset)
+                        for position, count in buffers(offset, length):
+                            self.throttle(count)
+                            data = os.pread(f.fileno(), count, position)
+                            digest.update(data)
+                            with metrics.call('write'):
+                                obj.write(data)
+                    finally:
+                        obj.close()
+                    return irods_checksum(digest)
+                self.run_streams(chunks, write_chunk, done)
+        finally:
+            # finalizes the replica (size, checksum, status)
+            main.close()
+        self.verify(session, local_path, remote_path)
+
+
+    # downloads a data object into a preallocated partial file, that replaces
+    # the local file when complete (existing content of the partial file is
+    # kept, for resuming)
+    def download(self, session, remote_path, local_path, size, chunks=None, 
+            done=None):
+        if chunks is None:
+            chunks = self.chunks(size)
+        partial = partial_path(local_path)
+        mode = os.O_WRONLY | os.O_CREAT
+        fd = os.open(partial, mode, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, size)
+            def read_chunk(stream_session, offset, length):
+                digest = hashlib.sha256()
+                with stream_session.data_objects.open(remote_path, 'r') as obj:
+                    obj.seek(offset)
+                    for position, count in buffers(offset, length):
+                        self.throttle(count)
+                        with metrics.call('read'):
+                            data = obj.read(count)
+                        if len(data) != count:
+                            raise ChunkedTransferError('unexpected end of ' + remote_path)
+                        digest.update(data)
+                        os.pwrite(fd, data, position)
+                return irods_checksum(digest)
+            self.run_streams(chunks, read_chunk, done)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.verify(session, partial, remote_path)
+        os.replace(partial, local_path)
+
+
+    # returns the (SHA-256) checksum of a byte range of a data object
+    def remote_chunk_checksum(self, session, remote_path, offset, length):
+        digest = hashlib.sha256()
+        with session.data_objects.open(remote_path, 'r') as obj:
+            obj.seek(offset)
+            for position, count in buffers(offset, length):
+                data = obj.read(count)
+                if len(data) != count:
+                    # the server holds less data than expected
+                    return None
+                digest.update(data)
+        return irods_checksum(digest)
+
+
+    # PRIVATE METHODS
+
+    # called for each buffer before it is transferred
+    def throttle(self, size):
+        if self.limiter is not None:
+            self.limiter.consume(size)
+        if self.concurrency is not None:
+            self.concurrency.progress(size)
+
+
+    # transfers the chunks using a number of threads with their own session
+    def run_streams(self, chunks, transfer_chunk, done):
+        todo = queue.Queue()
+        for chunk in chunks:
+            todo.put(chunk)
+        errors = []
+        lock = threading.Lock()
+
+        def stream():
+            session = self.connection.acquire()
+            if session is None:
+                errors.append('no iRODS connection available')
+                return
+            try:
+                while len(errors) == 0:
+                    try:
+                        offset, length = todo.get_nowait()
+                    except queue.Empty:
+                        break
+                    checksum = transfer_chunk(session, offset, length)
+                    if done is not None:
+                        with lock:
+                            done(offset, length, checksum)
+            except Exception as e:
+                errors.append(str(e))
+                self.connection.discard(session)
+                return
+            self.connection.release(session)
+
+        threads = [ threading.Thread(target = stream, daemon = True)
+                    for i in range(min(self.streams, len(chunks))) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            raise ChunkedTransferError(errors[0])
+
+
+    def verify(self, session, local_path, remote_path):
+        with metrics.timer('verify'):
+            with metrics.call('chksum'):
+                remote = session.data_objects.get(remote_path).chksum()
+            local = local_checksum(local_path, remote)
+        if local != remote:
+            raise ChunkedTransferError('checksum mismatch for ' + remote_path)
+
+
+# returns the path of the file that receives a chunked download
+def partial_path(local_path):
+    return local_path + PARTIAL_SUFFIX
+
+
+# generator, splits a byte range in (position, count) parts of BUFFER_SIZE
+def buffers(offset, length):
+    end = offset + length
+    for position in range(offset, end, BUFFER_SIZE):
+        yield position, min(BUFFER_SIZE, end - position)
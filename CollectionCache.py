@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# CollectionCache keeps a persistent (on disk) copy of the collection paths
+# of an iRODS zone, as seen by a user
+#
+# The cache remembers when it was last synchronized with the catalog. Within
+# the time-to-live (ttl) of the cache, an incremental refresh (collections 
+# modified since the last sync) suffices. After the ttl has expired, or after 
+# the cache has been invalidated, the complete list should be reloaded.
+#
+
+import os
+import json
+import time
+from CacheDir import cache_path
+
+# default time-to-live in seconds
+DEFAULT_TTL = 24 * 3600
+
+# allowance for clock differences between workstation and iRODS server
+SYNC_MARGIN = 300
+
+CACHE_VERSION = 1
+
+
+class CollectionCache():
+
+    def __init__(self, zone, username, ttl=None):
+        self.zone = zone
+        self.username = username
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.cache_file = cache_path('collections', username + '#' + zone + '.json')
+        self.paths = []
+        self.synced = 0
+        self.load()
+
+
+    def get_paths(self):
+        return self.paths
+
+
+    def is_empty(self):
+        return len(self.paths) == 0
+
+
+    # true if an incremental refresh is sufficient
+    def is_fresh(self):
+        return self.synced > 0 and time.time() < self.synced + self.ttl
+
+
+    # returns the time of the last sync, adjusted to be on the safe side
+    def get_refresh_time(self):
+        return max(0, self.synced - SYNC_MARGIN)
+
+
+    # replaces the content of the cache
+    # synced is the time at which the catalog was queried
+    def update(self, paths, synced):
+        self.paths = sorted(paths)
+        self.synced = synced
+        self.save()
+
+
+    # forces a full reload upon next use of the cache
+    def invalidate(self):
+        self.synced = 0
+        self.save()
+
+
+    # PRIVATE METHODS
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'rt') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if data.get('version') != CACHE_VERSION:
+            return False
+        self.paths = data['paths']
+        self.synced = data['synced']
+        return True
+
+
+    def save(self):
+        data = {
+            'version' : CACHE_VERSION,
+            'zone'    : self.zone,
+            'user'    : self.username,
+            'synced'  : self.synced,
+            'paths'   : self.paths
+            }
+        # write to a temporary file first, so a crash never leaves a corrupt cache
+        temp_file = self.cache_file + '.tmp'
+        try:
+            with open(temp_file, 'wt') as f:
+                json.dump(data, f)
+            os.replace(temp_file, self.cache_file)
+            return True
+        except IOError:
+            return False
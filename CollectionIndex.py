@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# CollectionIndex is an in-memory search index over collection paths, for
+# type-ahead search in a tree of (hundreds of thousands of) collections
+#
+# The names of the collections are kept lowercased in a single string, one
+# name per line, next to the list of their paths. A query is a substring
+# search in that string (str.find, which runs in C at memory speed), the line
+# of a hit is found by bisection of the line offsets. Compared to a trigram
+# index this takes a fraction of the memory and of the time to build, while
+# a query on 500k paths still returns within milliseconds.
+#
+# Paths that are added are appended to the index at the next search. Paths
+# that are removed are left out of the results, the index is rebuilt once
+# more than half of its paths have been removed.
+#
+# A query matches a collection if it occurs (case insensitive) in the name of
+# the collection. A query that holds a '/' matches a collection if its last
+# part occurs in the name and the whole query occurs in the path.
+#
+
+import re
+import bisect
+
+# default maximum number of paths returned by a search
+MAX_RESULTS = 200
+
+# all but the last part of each path in a newline separated text
+DIRECTORY = re.compile(r'[^\n]*/')
+NEWLINE = re.compile(r'\n')
+
+
+class CollectionIndex():
+    def __init__(self):
+        self.clear()
+
+
+    def clear(self):
+        self.paths = []
+        # '\n' + name for each path, in the order of paths (lowercased)
+        self.names = ''
+        # offset in names of the newline that precedes each name
+        self.starts = []
+        # paths that have not been indexed yet
+        self.pending = []
+        self.removed = set()
+
+
+    def add(self, path):
+        self.pending.append(path)
+        self.removed.discard(path)
+
+
+    def update(self, paths):
+        self.pending.extend(paths)
+        if len(self.removed) > 0:
+            self.removed.difference_update(paths)
+
+
+    def remove(self, paths):
+        self.removed.update(paths)
+        if len(self.removed) > (len(self.paths) + len(self.pending)) / 2:
+            self.rebuild()
+
+
+    # returns the paths of at most limit collections that match the query
+    def search(self, query, limit=MAX_RESULTS):
+        query = query.strip().rstrip('/').lower()
+        if query == '' or '\n' in query:
+            return []
+        self.flush()
+        name = query.rsplit('/', 1)[-1]
+        results = []
+        seen = set()
+        position = self.names.find(name)
+        while position >= 0 and len(results) < limit:
+            line = bisect.bisect_right(self.starts, position) - 1
+            path = self.paths[line]
+            if (path not in self.removed and path not in seen
+                    and (name == query or query in path.lower())):
+                seen.add(path)
+                results.append(path)
+            # continue with the next name
+            if line + 1 == len(self.starts):
+                break
+            position = self.names.find(name, self.starts[line + 1])
+        return results
+
+
+    # PRIVATE METHODS
+
+    # indexes the pending paths
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        names = DIRECTORY.sub('', '\n' + '\n'.join(self.pending)).lower()
+        offset = len(self.names)
+        self.starts.extend([ offset + match.start()
+                             for match in NEWLINE.finditer(names) ])
+        self.names += names
+        self.paths.extend(self.pending)
+        self.pending = []
+
+
+    def rebuild(self):
+        paths = [ path for path in self.paths + self.pending
+                  if path not in self.removed ]
+        self.clear()
+        self.pending = paths
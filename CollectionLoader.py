@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# CollectionLoader is a worker thread that runs catalog queries on behalf of
+# the GUI, using its own iRODS session
+#
+# The session is borrowed via open_session and handed back via close_session
+# when the thread ends. A session that fails a job is cleaned up, the next job
+# borrows a new one.
+#
+# A job is a generator function that is called with the session of the worker
+# and that yields lists of results. The results are handed to the main loop
+# via GLib.idle_add, in batches of at most BATCH_SIZE items per main loop tick:
+#    deliver(results)  is called (on the main thread) for each batch
+#    done(ok)          is called (on the main thread) when the job has ended
+# Neither callback is called anymore once the job has been cancelled.
+#
+
+import threading
+import queue
+import gi
+from gi.repository import GLib
+
+# max number of results handed to the main loop per tick
+BATCH_SIZE = 250
+
+
+class CollectionLoader(threading.Thread):
+    def __init__(self, open_session, close_session=None):
+        super().__init__(daemon = True)
+        # open_session is a callable that returns an authenticated session,
+        # close_session(session) returns it (by default it is cleaned up)
+        self.open_session = open_session
+        self.close_session = close_session
+        self.jobs = queue.Queue()
+        # jobs submitted before the latest cancel are dropped
+        self.generation = 0
+        self.stopped = False
+
+
+    def submit(self, job, deliver, done):
+        self.jobs.put((self.generation, job, deliver, done))
+
+
+    # drops all pending jobs and aborts the running job
+    # (must be called on the main thread)
+    def cancel(self):
+        self.generation += 1
+
+
+    # cancels all jobs and ends the thread
+    def stop(self):
+        self.cancel()
+        self.stopped = True
+        self.jobs.put(None)
+
+
+    def run(self):
+        session = None
+        while not self.stopped:
+            item = self.jobs.get()
+            if item is None:
+                break
+            generation, job, deliver, done = item
+            if generation != self.generation:
+                continue
+            if session is None:
+                session = self.open_session()
+            ok = session is not None
+            if ok:
+                try:
+                    for results in job(session):
+                        if generation != self.generation:
+                            break
+                        for i in range(0, len(results), BATCH_SIZE):
+                            GLib.idle_add(self.on_deliver, generation, deliver,
+                                    results[i:i + BATCH_SIZE])
+                except:
+                    ok = False
+                    # the session may have been dropped
+                    session.cleanup()
+                    session = None
+            GLib.idle_add(self.on_done, generation, done, ok)
+        if session is not None:
+            if self.close_session is not None:
+                self.close_session(session)
+            else:
+                session.cleanup()
+
+
+    # PRIVATE METHODS (called on the main thread)
+
+    def on_deliver(self, generation, deliver, results):
+        if generation == self.generation:
+            deliver(results)
+        # remove idle callback
+        return False
+
+
+    def on_done(self, generation, done, ok):
+        if generation == self.generation:
+            done(ok)
+        return False
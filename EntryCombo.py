@@ -10,6 +10,8 @@
 #
 # method get_text() returns the selected 'data', or the text entered
 #        (returns empty string while data has not been selected/entered)
+# method set_entries() replaces the entries, keeping the current selection
+#        if it is still available
 
 import gi
 from gi.repository import Gtk
@@ -38,6 +40,22 @@ class EntryCombo(Gtk.ComboBox):
                 if entry[1] == active:
                     self.set_active(i)
     
+    def set_entries(self, entries):
+        selected = None
+        it = self.get_active_iter()
+        if it is not None:
+            selected = self.get_model()[it][0]
+        store = self.get_model()
+        store.clear()
+        for key in entries:
+            store.append( [entries[key], key] )
+        for i, entry in enumerate(store):
+            if entry[0] == selected:
+                self.set_active(i)
+                return
+        if not self.get_has_entry() and len(store) > 0:
+            self.set_active(0)
+
     def get_text(self):
         it = self.get_active_iter()
         if it is None:
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# FolderWatcher reports the files that change in a local folder tree
+#
+# The watcher subscribes to inotify events (Linux, via ctypes) on all folders
+# of the tree. Bursts of events are coalesced: changes are reported once no
+# new event has arrived for DEBOUNCE seconds, or at the latest MAX_DELAY
+# seconds after the first change. If inotify is unavailable or the watch limit
+# (fs.inotify.max_user_watches) is exceeded, the watcher falls back to a
+# periodic stat scan of the tree.
+#
+# method changes() is a generator that yields sets of changed file paths,
+# relative to the root folder and using '/' as separator. Changes are reported
+# from the moment start() was called (or else changes() is first iterated),
+# so a watcher started before an initial sync also reports the files that
+# change during that sync.
+#
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+DEBOUNCE = 2.0
+MAX_DELAY = 10.0
+# interval (seconds) between stat scans when inotify is not used
+SCAN_INTERVAL = 30.0
+
+# inotify constants, see <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class WatchLimitExceeded(Exception):
+    pass
+
+
+class FolderWatcher():
+    def __init__(self, root, debounce=DEBOUNCE, scan_interval=SCAN_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.debounce = debounce
+        self.scan_interval = scan_interval
+        self.fd = None
+        # watch descriptor -> relative path of watched folder
+        self.watches = {}
+        self.snapshot = None
+        self.started = False
+
+
+    # true if changes are detected with inotify (rather than by scanning)
+    def uses_inotify(self):
+        return self.fd is not None
+
+
+    # installs the watches (or takes the snapshot to compare scans with)
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        if not self.start_inotify():
+            self.snapshot = self.scan()
+
+
+    def changes(self):
+        self.start()
+        if self.uses_inotify():
+            while self.fd is not None:
+                changed = self.collect_events()
+                if changed is None:
+                    # fall back to scanning
+                    break
+                if len(changed) > 0:
+                    yield changed
+            # events may have been lost, report all files as possibly changed
+            self.snapshot = self.scan()
+            yield set(self.snapshot)
+        while True:
+            time.sleep(self.scan_interval)
+            changed = self.scan_changes()
+            if len(changed) > 0:
+                yield changed
+
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+    # PRIVATE METHODS
+
+    def start_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+            self.add_watch_call = libc.inotify_add_watch
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if fd < 0:
+            return False
+        self.fd = fd
+        try:
+            self.watch_tree('')
+        except WatchLimitExceeded:
+            self.close()
+            return False
+        return True
+
+
+    # adds watches to a folder and its subfolders,
+    # returns the paths of the files found in these folders
+    def watch_tree(self, reldir):
+        files = set()
+        todo = [reldir]
+        while len(todo) > 0:
+            reldir = todo.pop()
+            path = self.abspath(reldir)
+            wd = self.add_watch_call(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOSPC:
+                    raise WatchLimitExceeded(path)
+                # folder vanished or is unreadable
+                continue
+            self.watches[wd] = reldir
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                relpath = join(reldir, entry.name)
+                if entry.is_dir(follow_symlinks = False):
+                    todo.append(relpath)
+                else:
+                    files.add(relpath)
+        return files
+
+
+    # waits for events, returns the set of changed files after a quiet period
+    # returns None if the watcher must fall back to scanning
+    def collect_events(self):
+        changed = set()
+        first = None
+        while True:
+            if first is None:
+                timeout = None
+            else:
+                timeout = min(self.debounce, first + MAX_DELAY - time.time())
+            if timeout is not None and timeout <= 0:
+                return changed
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if len(ready) == 0:
+                # quiet period has passed
+                return changed
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                continue
+            if first is None:
+                first = time.time()
+            try:
+                if not self.parse_events(data, changed):
+                    self.close()
+                    return None
+            except WatchLimitExceeded:
+                self.close()
+                return None
+
+
+    # adds changed files to the set, returns False if events were lost
+    def parse_events(self, data, changed):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return False
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or name == '':
+                continue
+            relpath = join(self.watches[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files may have been written before the watch was added
+                    changed.update(self.watch_tree(relpath))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed.add(relpath)
+        return True
+
+
+    # returns a dict { relpath : (size, mtime_ns) } of all files in the tree
+    def scan(self):
+        snapshot = {}
+        todo = ['']
+        while len(todo) > 0:
+            reldir = todo.pop()
+            try:
+                entries = list(os.scandir(self.abspath(reldir)))
+            except OSError:
+                continue
+            for entry in entries:
+                relpath = join(reldir, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks = False):
+                        todo.append(relpath)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        snapshot[relpath] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+        return snapshot
+
+
+    def scan_changes(self):
+        snapshot = self.scan()
+        changed = set([ relpath for relpath, state in snapshot.items()
+                        if self.snapshot.get(relpath) != state ])
+        self.snapshot = snapshot
+        return changed
+
+
+    def abspath(self, relpath):
+        if relpath == '':
+            return self.root
+        return os.path.join(self.root, *relpath.split('/'))
+
+
+def join(reldir, name):
+    return name if reldir == '' else reldir + '/' + name
@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Formatting of sizes and durations for humans, shared by the sync output
+# and the GUI. Kept free of other imports so the GUI can use it without
+# loading the sync engine.
+#
+
+
+# returns a size in bytes as e.g. '1.5 MB'
+def format_size(size):
+    for unit in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024 or unit == 'TB':
+            break
+        size = size / 1024.0
+    if unit == 'bytes':
+        return '{} {}'.format(size, unit)
+    return '{:.1f} {}'.format(size, unit)
+
+
+# returns a duration in seconds as e.g. '3 min 20 s'
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return '{} s'.format(seconds)
+    if seconds < 3600:
+        return '{} min {} s'.format(seconds // 60, seconds % 60)
+    return '{} h {} min'.format(seconds // 3600, (seconds % 3600) // 60)
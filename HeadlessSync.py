@@ -0,0 +1,417 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# HeadlessSync runs a single sync job from the command line, without a
+# graphical user interface (e.g. from cron on a compute or ingest node)
+#
+# The stored iRODS environment and token are used. A zone profile from the
+# list of known zones (see Iselect) can be selected to configure the
+# environment first. Progress is printed on stdout, and a machine readable
+# report of the run can be written as JSON. Optionally the run is instrumented
+# (see SyncMetrics), its metrics are written as JSON and/or for Prometheus.
+#
+# With --verify the sync pair is compared by checksum instead, see SyncVerifier.
+#
+# Instead of running it, a job can be submitted to the JobQueue. Queued jobs
+# are run by run_queue() (or by the GUI), respecting the global limits of
+# the JobScheduler.
+#
+# run(), submit(), run_queue() and list_queue() return one of the EXIT_* codes
+#
+# The modules that need the iRODS client are imported when a sync job runs,
+# so that e.g. submitting a job does not pay for loading them.
+#
+
+import os
+import json
+import sys
+import time
+from subprocess import Popen, STDOUT
+from TransferScheduler import DEFAULT_WORKERS, EVENT_DONE, EVENT_FAILED
+from JobQueue import JobQueue, SyncJob, DEFAULT_PRIORITY
+from JobScheduler import JobScheduler, MAX_JOBS, MAX_CONNECTIONS
+from CacheDir import cache_path
+from SyncMetrics import metrics
+from BandwidthLimiter import parse_schedule
+from AdaptiveConcurrency import DEFAULT_MAXIMUM
+
+EXIT_OK = 0
+EXIT_USAGE = 1
+EXIT_NO_CONNECTION = 2
+EXIT_TRANSFER_FAILED = 3
+EXIT_ERROR = 4
+EXIT_MISMATCH = 5
+
+# maximum number of failed files listed in the report
+MAX_REPORTED_FAILURES = 1000
+
+
+class HeadlessSync():
+    def __init__(self, data):
+        self.data = data
+        # 'upload' or 'download'
+        self.direction = 'upload'
+        self.workers = data.get('sync_workers', DEFAULT_WORKERS)
+        # true if the number of workers is set by option -c
+        self.workers_set = False
+        self.adaptive = data.get('sync_adaptive', False)
+        self.bandwidth_limit = data.get('bandwidth_limit')
+        self.zone = None
+        self.report_file = None
+        self.metrics_file = None
+        self.prometheus_file = None
+        self.plan_only = False
+        self.verify = False
+        self.full_check = False
+        self.watch = False
+        self.quiet = False
+        self.bundle = False
+        # None selects the default of ChunkedTransfer
+        self.threshold = None
+        self.chunk_size = None
+        self.streams = None
+        self.priority = DEFAULT_PRIORITY
+        self.max_jobs = data.get('max_jobs', MAX_JOBS)
+        self.max_connections = data.get('max_connections', MAX_CONNECTIONS)
+        # options passed on to a job that is submitted to the queue
+        self.job_options = []
+        self.report = {}
+        self.failures = []
+        self.transferred = 0
+        self.transferred_bytes = 0
+
+
+    # args are the source and target of the sync job
+    def run(self, opts, args):
+        if not self.parse_options(opts) or len(args) != 2:
+            print('Error: Invalid program arguments specified. Use -h for help.')
+            return EXIT_USAGE
+        if self.direction == 'upload':
+            local, remote = args
+        else:
+            remote, local = args
+        if self.direction == 'upload' and not os.path.isdir(local):
+            print('Error: Local folder ' + local + ' does not exist')
+            return EXIT_USAGE
+        started = time.time()
+        self.report = {
+            'program'   : self.data['program_name'] + ' ' + self.data['program_version'],
+            'direction' : self.direction,
+            'local'     : os.path.abspath(local),
+            'zone'      : self.zone,
+            'workers'   : self.workers,
+            'started'   : format_time(started)
+            }
+        try:
+            code = self.sync(local, remote)
+        except KeyboardInterrupt:
+            self.report['error'] = 'interrupted'
+            code = EXIT_ERROR
+        except Exception as e:
+            print('Error: ' + str(e))
+            self.report['error'] = str(e)
+            code = EXIT_ERROR
+        finished = time.time()
+        self.report.update({
+            'finished'  : format_time(finished),
+            'seconds'   : round(finished - started, 3),
+            'exit_code' : code
+            })
+        if metrics.enabled:
+            self.report['metrics'] = metrics.summary()
+        self.write_report()
+        self.write_metrics(code)
+        return code
+
+
+    # adds the sync job to the job queue
+    def submit(self, opts, args):
+        if not self.parse_options(opts) or len(args) != 2:
+            print('Error: Invalid program arguments specified. Use -h for help.')
+            return EXIT_USAGE
+        if self.direction == 'upload':
+            local, remote = args
+        else:
+            remote, local = args
+        job = SyncJob(self.direction, os.path.abspath(local), remote, self.workers,
+                self.priority, options = self.job_options)
+        job_id = JobQueue().submit(job)
+        print('submitted job {}: {}'.format(job_id, job.describe()))
+        return EXIT_OK
+
+
+    # runs the queued jobs until none is queued and the jobs started by this
+    # process have finished, returns EXIT_TRANSFER_FAILED if any of these failed
+    def run_queue(self, opts):
+        if not self.parse_options(opts):
+            print('Error: Invalid program arguments specified. Use -h for help.')
+            return EXIT_USAGE
+        queue = JobQueue()
+        started = []
+        def start(job, workers):
+            print('starting job {}: {}'.format(job.id, job.describe()))
+            started.append(job.id)
+            log = open(cache_path('jobs', 'job-{}.log'.format(job.id)), 'ab')
+            program = self.data['program_directory'] + '/myrods-sync.py'
+            process = Popen(job.command(program, workers, sys.executable),
+                    stdout = log, stderr = STDOUT, shell = True,
+                    start_new_session = True)
+            log.close()
+            return process
+        scheduler = JobScheduler(queue, start, self.max_jobs, self.max_connections)
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            return EXIT_ERROR
+        failed = [ job for job in queue.jobs()
+                   if job.id in started and job.exit_code != 0 ]
+        for job in failed:
+            print('job {} failed with exit code {}'.format(job.id, job.exit_code))
+        return EXIT_OK if len(failed) == 0 else EXIT_TRANSFER_FAILED
+
+
+    def list_queue(self):
+        for job in JobQueue().jobs():
+            print('{:4d} {:>4} {:<9} {}'.format(job.id, job.priority, job.state,
+                    job.describe()))
+        return EXIT_OK
+
+
+    # PRIVATE METHODS
+
+    def parse_options(self, opts):
+        try:
+            for opt, arg in opts:
+                if opt in ('-d', '--direction'):
+                    if arg not in ('upload', 'download'):
+                        return False
+                    self.direction = arg
+                if opt in ('-c', '--concurrency'):
+                    self.workers = int(arg)
+                    self.workers_set = True
+                if opt in ('-z', '--zone'):
+                    self.zone = arg
+                if opt in ('-r', '--report'):
+                    self.report_file = arg
+                if opt in ('-p', '--priority'):
+                    self.priority = int(arg)
+                if opt == '--max-jobs':
+                    self.max_jobs = int(arg)
+                if opt == '--max-connections':
+                    self.max_connections = int(arg)
+                if opt == '--metrics':
+                    self.metrics_file = arg
+                if opt == '--prometheus':
+                    self.prometheus_file = arg
+                if opt in ('-a', '--adaptive'):
+                    self.adaptive = True
+                if opt == '--bwlimit':
+                    self.bandwidth_limit = arg
+                if opt in ('-z', '--zone', '-F', '-w', '-q', '-b', '--threshold',
+                        '--chunk-size', '--streams', '--metrics', '--prometheus',
+                        '-a', '--adaptive', '--bwlimit', '--verify'):
+                    self.job_options.extend([opt, arg] if arg != '' else [opt])
+                if opt == '-n':
+                    self.plan_only = True
+                if opt == '--verify':
+                    self.verify = True
+                if opt == '-F':
+                    self.full_check = True
+                if opt == '-w':
+                    self.watch = True
+                if opt == '-q':
+                    self.quiet = True
+                if opt == '-b':
+                    self.bundle = True
+                if opt == '--threshold':
+                    self.threshold = int(float(arg) * 1024 * 1024)
+                if opt == '--chunk-size':
+                    self.chunk_size = int(float(arg) * 1024 * 1024)
+                if opt == '--streams':
+                    self.streams = int(arg)
+        except ValueError:
+            return False
+        if self.workers < 1 or self.max_jobs < 1 or self.max_connections < 1:
+            return False
+        if self.adaptive and not self.workers_set:
+            # the number of workers is the maximum of the adaptive concurrency
+            self.workers = max(self.workers, DEFAULT_MAXIMUM)
+        if self.watch and (self.direction != 'upload' or self.verify):
+            return False
+        if self.bandwidth_limit is not None:
+            try:
+                parse_schedule(self.bandwidth_limit)
+            except ValueError:
+                return False
+        if self.metrics_file is not None or self.prometheus_file is not None:
+            metrics.enable()
+        return True
+
+
+    def sync(self, local, remote):
+        from MyRodsConnection import MyRodsConnection
+        from Iselect import Iselect
+        env = None
+        if self.zone is not None:
+            select = Iselect(self.data['zonelist_location'])
+            env = select.get_irods_environment(self.zone)
+            if env is None and select.refresh():
+                # zone not in the cached list, but the list has changed
+                env = select.get_irods_environment(self.zone)
+            if env is None:
+                print('Error: Unknown zone ' + self.zone)
+                return EXIT_USAGE
+        irods = MyRodsConnection(self.workers)
+        with metrics.timer('connect'):
+            session = irods.connect(env = env)
+        if session is None:
+            print('Error: Could not connect to iRODS, please login first')
+            self.report['error'] = 'not connected'
+            return EXIT_NO_CONNECTION
+        try:
+            return self.sync_session(irods, local, remote)
+        finally:
+            irods.cleanup()
+
+
+    def sync_session(self, irods, local, remote):
+        from SyncEngine import SyncEngine, UPLOAD, DOWNLOAD, NEW, CHANGED, \
+                UNCHANGED, print_plan, print_event
+        from SyncManifest import SyncManifest
+        from SyncBundler import SyncBundler
+        from ChunkedTransfer import ChunkedTransfer, DEFAULT_THRESHOLD, \
+                DEFAULT_CHUNK_SIZE, DEFAULT_STREAMS
+        from ThroughputHistory import ThroughputHistory
+        from AdaptiveConcurrency import AdaptiveConcurrency
+        from BandwidthLimiter import BandwidthLimiter
+        direction = UPLOAD if self.direction == 'upload' else DOWNLOAD
+        self.printer = print_event(direction)
+        self.size = lambda item: item.size(direction)
+        session = irods.session
+        if not remote.startswith('/'):
+            # relative to the home collection of the user
+            remote = '/' + session.zone + '/home/' + session.username + '/' + remote
+        remote = remote.rstrip('/')
+        self.report.update({ 'remote': remote, 'host': irods.host(),
+                             'zone': session.zone })
+        manifest = SyncManifest(os.path.abspath(local), remote)
+        limiter = None
+        if self.bandwidth_limit is not None:
+            limiter = BandwidthLimiter(self.bandwidth_limit)
+        concurrency = None
+        if self.adaptive:
+            concurrency = AdaptiveConcurrency(min(DEFAULT_WORKERS, self.workers),
+                    self.workers)
+        chunked = ChunkedTransfer(irods,
+                self.threshold if self.threshold is not None else DEFAULT_THRESHOLD,
+                self.chunk_size if self.chunk_size is not None else DEFAULT_CHUNK_SIZE,
+                self.streams if self.streams is not None else DEFAULT_STREAMS,
+                limiter, concurrency)
+        bundler = SyncBundler() if self.bundle else None
+        engine = SyncEngine(irods, local, remote, direction,
+                self.report_event, self.workers, manifest, self.full_check,
+                chunked, bundler, concurrency, limiter)
+        history = ThroughputHistory(irods.host())
+        try:
+            if self.verify:
+                return self.verify_pair(engine)
+            if self.watch:
+                engine.start_watching()
+            with metrics.timer('plan'):
+                plan = engine.plan()
+            print_plan(plan, history if self.plan_only else None)
+            self.report['plan'] = {
+                'new'       : plan.count(NEW),
+                'changed'   : plan.count(CHANGED),
+                'unchanged' : plan.count(UNCHANGED),
+                'bytes'     : plan.transfer_size()
+                }
+            if self.plan_only:
+                self.report['plan']['estimated_seconds'] = \
+                        plan.summary(history)['estimated_seconds']
+                return EXIT_OK
+            started = time.time()
+            with metrics.timer('execute'):
+                ok = engine.execute(plan)
+            seconds = time.time() - started
+            if ok:
+                history.record(direction, len(plan.transfers()),
+                        plan.transfer_size(), seconds)
+            print('finished in {:.1f} s'.format(seconds))
+            if self.watch:
+                print('watching for changes...')
+                try:
+                    engine.watch()
+                except KeyboardInterrupt:
+                    pass
+        finally:
+            manifest.close()
+        return EXIT_OK if len(self.failures) == 0 else EXIT_TRANSFER_FAILED
+
+
+    def verify_pair(self, engine):
+        from SyncVerifier import SyncVerifier, MISMATCH, MISSING, UNVERIFIED, \
+                summary, print_verification
+        with metrics.timer('verify'):
+            items = SyncVerifier(engine, full_check = self.full_check).verify()
+        print_verification(items, self.quiet)
+        self.report['verify'] = summary(items)
+        differences = [ item for item in items if item.status in 
+                        (MISMATCH, MISSING, UNVERIFIED) ]
+        self.report['differences'] = [ { 'path': item.relpath, 
+                'status': item.status, 'error': item.error }
+                for item in differences[:MAX_REPORTED_FAILURES] ]
+        return EXIT_OK if len(differences) == 0 else EXIT_MISMATCH
+
+
+    def report_event(self, event, item):
+        if not self.quiet:
+            self.printer(event, item)
+        if event == EVENT_DONE:
+            self.transferred += 1
+            self.transferred_bytes += self.size(item)
+        if event == EVENT_FAILED:
+            self.failures.append(item)
+
+
+    def write_report(self):
+        if self.report_file is None:
+            return
+        self.report.update({
+            'transferred'       : self.transferred,
+            'transferred_bytes' : self.transferred_bytes,
+            'failed'            : len(self.failures),
+            'failures'          : [ { 'path': item.relpath, 'error': str(item.error) }
+                                    for item in self.failures[:MAX_REPORTED_FAILURES] ]
+            })
+        text = json.dumps(self.report, indent = 2)
+        if self.report_file == '-':
+            print(text)
+            return
+        try:
+            with open(self.report_file, 'wt') as f:
+                f.write(text + '\n')
+        except IOError as e:
+            print('Error: Could not write report: ' + str(e))
+
+
+    def write_metrics(self, code):
+        labels = { 'direction': self.direction }
+        if 'host' in self.report:
+            labels['host'] = self.report['host']
+        if 'zone' in self.report and self.report['zone'] is not None:
+            labels['zone'] = self.report['zone']
+        metrics.set('exit_code', code)
+        for path, write in ((self.metrics_file, metrics.write_json),
+                (self.prometheus_file,
+                 lambda path: metrics.write_prometheus(path, labels))):
+            if path is None:
+                continue
+            try:
+                write(path)
+            except IOError as e:
+                print('Error: Could not write metrics: ' + str(e))
+
+
+def format_time(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(seconds))
@@ -7,23 +7,87 @@
 # class IrodsChooserStore:
 # builds an in-memory store of iRODS collection information 
 # used as input for the treeview dialog
+#
+# The store is loaded lazily, one level at a time. Rows of which the children
+# are not yet known hold a placeholder child so that the treeview shows an
+# expander. Only the level below the rows that are visible is prefetched.
+# If a session factory is provided, all queries run in a CollectionLoader
+# thread, and their results are added to the store while the dialog is shown.
+# If a CollectionCache is provided, the store is populated from the cache and
+# reconciled with the catalog in the background.
+#
+# A search entry filters the tree as the user types. The store keeps a
+# CollectionIndex of the paths of its rows (built at the first search), the
+# rows of the matches and of their parents are shown in a filtered view of
+# the store. Leaving the search reveals the selected match in the complete
+# tree, the rows are already in the store so no query is needed.
 
+import time
+import datetime
 import gi
 from gi.repository import Gtk
+from CollectionLoader import CollectionLoader
+from CollectionIndex import CollectionIndex
+from irods.column import In, Like
+from irods.models import Collection
+
+# columns of the in-memory store
+COL_NAME = 0
+COL_PATH = 1
+COL_LOADED = 2
+# true if the row is shown while searching
+COL_VISIBLE = 3
+
+# label of the dummy child row of a row that has not been loaded yet
+PLACEHOLDER = 'loading...'
+
+# max number of parent collections in a single query condition
+QUERY_CHUNK_SIZE = 50
+
+# max number of matching collections shown while searching
+MAX_MATCHES = 200
 
 
 class IrodsChooserDialog(Gtk.Dialog):
-    def __init__(self, store):
+    def __init__(self, data_store):
         super().__init__()
         self.props.title = 'Select a collection to synchronize'
 
         # initialize the treeview with the provided store data
-        self.h_store = store
-        treeview = Gtk.TreeView(model = store)
+        self.data_store = data_store
+        self.h_store = data_store.get_store()
+        treeview = Gtk.TreeView(model = self.h_store)
         self.h_treeview = treeview
         renderer = Gtk.CellRendererText()
-        self.column = Gtk.TreeViewColumn('Collection', renderer,text=0)
+        self.column = Gtk.TreeViewColumn('Collection', renderer,text=COL_NAME)
         treeview.append_column(self.column)
+        # children of a row are loaded when the user expands the row
+        treeview.connect('test-expand-row', self.on_test_expand_row)
+        treeview.connect('row-activated', self.on_row_activated)
+
+        # type-ahead search, shows the matches in a filtered view of the store
+        self.h_filter = data_store.get_filter()
+        self.search_entry = Gtk.SearchEntry(
+                placeholder_text = 'Search collections')
+        self.search_entry.connect('search-changed', self.on_search_changed)
+        self.search_entry.connect('activate', self.on_search_activate)
+        self.search_entry.connect('stop-search', self.on_stop_search)
+        scroll = Gtk.ScrolledWindow(vexpand = True)
+        scroll.set_min_content_height(300)
+        scroll.add(treeview)
+
+        # status line shows progress of loading collections
+        status = Gtk.Box(spacing = 5)
+        self.spinner = Gtk.Spinner()
+        self.status_label = Gtk.Label()
+        self.match_label = Gtk.Label()
+        self.stop_button = Gtk.Button(label = 'Stop')
+        self.stop_button.connect('clicked', self.on_stop_clicked)
+        status.pack_start(self.spinner, False, False, 0)
+        status.pack_start(self.status_label, False, False, 0)
+        status.pack_start(self.match_label, False, False, 0)
+        status.pack_end(self.stop_button, False, False, 0)
+        data_store.set_progress_callback(self.on_load_progress)
 
         # and show result
         self.add_button('Create', 500)
@@ -31,60 +95,239 @@ class IrodsChooserDialog(Gtk.Dialog):
              Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
              Gtk.STOCK_OK, Gtk.ResponseType.OK)
         box = self.get_content_area()
-        box.add(treeview)
+        box.pack_start(self.search_entry, False, False, 0)
+        box.pack_start(scroll, True, True, 0)
+        box.add(status)
         self.show_all()
+        self.on_load_progress(data_store.count(), data_store.is_loading())
 
     # returns the iRODS collection path selected by the user (or None)
+    # the path is relative to the path prefix of the store
     def get_selection(self):
         treeselection = self.h_treeview.get_selection()
         model, treeiter = treeselection.get_selected()
-        if treeiter is not None:
-            path = model.get_path(treeiter)
-            pathname = ''
-            node = []
-            for level in range(len(path)):
-                # retrieve name of path component and add this to pathname
-                node.append(path[level])
-                node_iter = self.h_store.get_iter(node)
-                name = self.h_store.get_value(node_iter,0)
-                pathname = pathname + '/' + name
-            return pathname
-        return None
+        if treeiter is None:
+            return None
+        path = model.get_value(treeiter, COL_PATH)
+        if path == '':
+            # placeholder row
+            return None
+        return path[len(self.data_store.get_path_prefix()):]
 
     def add_child(self, name):
+        # the new row is added to the complete tree
+        self.show_tree()
         treeselection = self.h_treeview.get_selection()
         model, treeiter = treeselection.get_selected()
         if treeiter is None:
             return False
-        child = self.h_store.append(treeiter, [name])
+        child = self.data_store.add_collection(treeiter, name)
         path = model.get_path(child)
         self.h_treeview.expand_to_path(path)
         self.h_treeview.set_cursor(path)
 
+    def on_test_expand_row(self, treeview, treeiter, path):
+        # while searching, only the matches are shown, nothing to load
+        if treeview.get_model() is self.h_store:
+            self.data_store.expand(treeiter)
+        # allow the row to expand
+        return False
+
+    def on_row_activated(self, treeview, path, column):
+        self.show_tree()
+
+    def on_search_changed(self, entry):
+        query = entry.get_text().strip()
+        if query == '':
+            self.show_tree()
+            return
+        matches = self.data_store.search(query, MAX_MATCHES + 1)
+        if self.h_treeview.get_model() is not self.h_filter:
+            self.h_treeview.set_model(self.h_filter)
+        self.h_treeview.expand_all()
+        if len(matches) > 0:
+            path = self.h_filter.convert_child_path_to_path(
+                    self.h_store.get_path(self.data_store.get_row(matches[0])))
+            if path is not None:
+                self.h_treeview.set_cursor(path)
+        if len(matches) > MAX_MATCHES:
+            self.match_label.set_text('- first {} matches'.format(MAX_MATCHES))
+        else:
+            self.match_label.set_text('- {} matches'.format(len(matches)))
+
+    # Enter in the search entry shows the selected match in the complete tree
+    def on_search_activate(self, entry):
+        self.show_tree()
+
+    def on_stop_search(self, entry):
+        entry.set_text('')
+
+    # leaves the search, reveals the selected collection in the complete tree
+    def show_tree(self):
+        if self.h_treeview.get_model() is self.h_store:
+            return
+        model, treeiter = self.h_treeview.get_selection().get_selected()
+        treeiter = None if treeiter is None else \
+                model.convert_iter_to_child_iter(treeiter)
+        self.h_treeview.set_model(self.h_store)
+        self.match_label.set_text('')
+        # (emits search-changed, which finds the complete tree shown)
+        self.search_entry.set_text('')
+        if treeiter is None:
+            return
+        path = self.h_store.get_path(treeiter)
+        if path.up() and path.get_depth() > 0:
+            self.h_treeview.expand_to_path(path)
+        path = self.h_store.get_path(treeiter)
+        self.h_treeview.set_cursor(path)
+        self.h_treeview.scroll_to_cell(path, None, True, 0.5, 0)
+
+    def on_stop_clicked(self, widget):
+        self.data_store.cancel_loading()
+
+    def on_load_progress(self, count, busy):
+        if busy:
+            self.spinner.start()
+            self.status_label.set_text('loading... ' + str(count) + ' collections')
+        else:
+            self.spinner.stop()
+            self.status_label.set_text(str(count) + ' collections')
+        self.stop_button.set_sensitive(busy)
+
     def do_get_preferred_width(self):
         return 350,400
 
 
 class IrodsChooserStore():
-    def __init__(self, irods_session):
-        self.h_store = Gtk.TreeStore(str)
+    def __init__(self, irods_session, open_session=None, cache=None,
+            close_session=None):
+        self.h_store = Gtk.TreeStore(str, str, bool, bool)
+        self.h_filter = None
         self.irods = irods_session
+        self.cache = cache
+        self.root = '/' + self.irods.zone + '/home'
+        # rows added to the store { path : treeiter }
+        self.rows = { self.root: None }
+        # search index over the paths of the rows, built when first needed
+        self.index = None
+        # paths of the rows that are shown while searching
+        self.visible = set()
+        # paths of rows of which the children are being loaded
+        self.requested = set()
+        # paths seen so far during a complete reload 
+        self.seen = None
+        self.pending = 0
+        self.progress_callback = None
+        # queries run in a worker thread if we can get a session for it
+        self.loader = None
+        if open_session is not None:
+            self.loader = CollectionLoader(open_session, close_session)
+            self.loader.start()
 
     # returns a handle to the in-memory store (for provisioning a treeview)
     def get_store(self):
         return self.h_store
 
-    # loads iRODS collection names hierarchy into the in-memory store 
+    # returns a view of the store that only shows the rows of the collections
+    # found by the latest search, and their parents
+    def get_filter(self):
+        if self.h_filter is None:
+            self.h_filter = self.h_store.filter_new()
+            self.h_filter.set_visible_column(COL_VISIBLE)
+        return self.h_filter
+
+    # returns the row of a collection (None if it is not in the store)
+    def get_row(self, coll_path):
+        return self.rows.get(coll_path)
+
+    # finds the collections (in the store) of which the name contains the
+    # query and shows their rows in the filter, returns their paths
+    def search(self, query, limit=MAX_MATCHES):
+        if self.index is None:
+            self.index = CollectionIndex()
+            self.index.update(self.rows_paths())
+        matches = self.index.search(query, limit)
+        self.set_visible(matches)
+        return matches
+
+    # number of collections in the store
+    def count(self):
+        return len(self.rows) - 1
+
+    def is_loading(self):
+        return self.pending > 0
+
+    # callback(count, busy) is called whenever loading progresses
+    def set_progress_callback(self, callback):
+        self.progress_callback = callback
+
+    # loads the top level of the iRODS collection hierarchy into the store 
     def load_iRODS_collections(self):
         # we start at /zone/home
-        self.root = '/' + self.irods.zone + '/home'
-        self.load_an_iRODS_subcollection(None, self.root)
+        self.reset()
+        if self.cache is None or self.cache.is_empty():
+            # also prefetch the level below the (visible) top level rows
+            self.request_level([self.root], prefetch = True)
+            if self.cache is not None:
+                # meanwhile fill the cache
+                self.reload_all()
+            return
+        # show cached tree, and reconcile it with the catalog 
+        self.insert_paths(self.cache.get_paths())
+        self.mark_all_loaded()
+        if self.cache.is_fresh():
+            self.refresh_since(self.cache.get_refresh_time())
+        else:
+            self.reload_all()
+
+    # loads the complete iRODS collection hierarchy into the store using a
+    # single (paged) query, for when the full tree is needed 
+    def load_all_iRODS_collections(self):
+        self.reset()
+        self.reload_all()
+        return self.rows
+
+    # forces a complete reload of the collections upon next use of the cache
+    def invalidate_cache(self):
+        if self.cache is not None:
+            self.cache.update(self.rows_paths(), 0)
 
-    def load_an_iRODS_subcollection(self, parent_obj, parent_path):  
-        for coll_path, coll_name in self.subcollections(parent_path):
-            child_obj = self.h_store.append(parent_obj, [coll_name])
-            # also load subtree of child
-            self.load_an_iRODS_subcollection(child_obj, coll_path) 
+    # makes sure the children of a row are known before the row is expanded
+    # and prefetches the level below these (now visible) children
+    def expand(self, treeiter):
+        if not self.h_store.get_value(treeiter, COL_LOADED):
+            self.request_level([self.h_store.get_value(treeiter, COL_PATH)], 
+                    prefetch = True)
+        else:
+            self.request_level(self.unloaded_children(treeiter))
+
+    # adds a newly created (hence empty) collection below a row
+    def add_collection(self, parent_obj, coll_name):
+        coll_path = self.h_store.get_value(parent_obj, COL_PATH) + '/' + coll_name
+        if coll_path in self.rows:
+            return self.rows[coll_path]
+        child_obj = self.h_store.append(parent_obj, [coll_name, coll_path, True, False])
+        self.add_to_index(coll_path, child_obj)
+        if self.seen is not None:
+            self.seen.add(coll_path)
+        return child_obj
+
+    # stops loading, the collections loaded so far remain in the store
+    def cancel_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+        self.requested.clear()
+        self.seen = None
+        self.pending = 0
+        self.report_progress()
+
+    # ends the worker thread (if any)
+    def stop_loading(self):
+        if self.loader is not None:
+            self.loader.stop()
+            self.loader = None
+        self.requested.clear()
+        self.pending = 0
    
     def get_path_prefix(self):
         # returns <zone_name>/home can be used as prefix to irods pathnames
@@ -94,17 +337,230 @@ class IrodsChooserStore():
     # (only for debug purposes)
     # ability to manually populate store with arbitrary label, returns handle to loaded label
     def add_name(self, parent_obj, name):
-        return self.h_store.append(parent_obj, [name])
+        return self.h_store.append(parent_obj, [name, '', True, False])
+
+
+    # generator, yields the paths of all collections below /zone/home
+    # the query results are fetched page by page
+    def all_collection_paths(self):
+        for batch in self.collection_path_batches():
+            for coll_path in batch:
+                yield coll_path
+
+    # generator, yields one list of collection paths per page of query results
+    # if since (epoch seconds) is specified only collections modified since
+    # then are included
+    def collection_path_batches(self, session=None, since=None):
+        if session is None:
+            session = self.irods
+        try:
+            query = session.query(Collection.name).filter(
+                    Like(Collection.name, self.root + '/%'))
+            if since is not None:
+                query = query.filter(Collection.modify_time >= 
+                        datetime.datetime.utcfromtimestamp(since))
+            # (LIKE treats '_' and '%' in the root as wildcards)
+            prefix = self.root + '/'
+            for result_set in query.get_batches():
+                yield [ row[Collection.name] for row in result_set
+                        if row[Collection.name].startswith(prefix) ]
+        except:
+            # zone is inaccessible, just pretend there are no collections
+            return
+
+    # generator, yields lists of (path, parent path) of the subcollections
+    # of a list of collections, using one query per QUERY_CHUNK_SIZE collections
+    def subcollection_batches(self, session, paths):
+        for i in range(0, len(paths), QUERY_CHUNK_SIZE):
+            chunk = paths[i:i + QUERY_CHUNK_SIZE]
+            try:
+                query = session.query(Collection.name, Collection.parent_name
+                        ).filter(In(Collection.parent_name, chunk))
+                for result_set in query.get_batches():
+                    yield [ (row[Collection.name], row[Collection.parent_name])
+                            for row in result_set ]
+            except:
+                # collections do not exist or are inaccessible
+                # just pretend no children
+                continue
 
 
-    # generator
-    def subcollections(self, path):
+    # PRIVATE METHODS
+
+    def reset(self):
+        self.cancel_loading()
+        self.root = '/' + self.irods.zone + '/home'
+        self.h_store.clear()
+        self.rows = { self.root: None }
+        self.index = None
+        self.visible = set()
+
+    # runs a job in the worker thread, or right away if there is no worker
+    def run_job(self, job, deliver, done):
+        self.pending += 1
+        self.report_progress()
+        if self.loader is not None:
+            self.loader.submit(job, deliver, done)
+            return
+        ok = True
         try:
-            coll = self.irods.collections.get(path)
+            for results in job(self.irods):
+                deliver(results)
         except:
-            # collection does not exist or is inaccessible
-            # just pretend no children
-            raise StopIteration
-        for subcoll in coll.subcollections:
-            yield subcoll.path, subcoll.name
+            ok = False
+        done(ok)
+
+    # requests the children of a list of collections
+    # if prefetch is set, the level below these children is requested next
+    def request_level(self, paths, prefetch=False):
+        paths = [ path for path in paths if path not in self.requested ]
+        if len(paths) == 0:
+            return
+        self.requested.update(paths)
+        self.run_job(
+            lambda session: self.subcollection_batches(session, paths),
+            self.insert_children,
+            lambda ok: self.on_level_loaded(paths, prefetch, ok))
+
+    def insert_children(self, results):
+        for coll_path, parent_path in results:
+            if coll_path in self.rows or parent_path not in self.rows:
+                continue
+            self.add_to_index(coll_path,
+                    self.add_row(self.rows[parent_path], coll_path))
+        self.report_progress()
+
+    def on_level_loaded(self, paths, prefetch, ok):
+        self.pending -= 1
+        self.requested.difference_update(paths)
+        if ok:
+            unloaded = []
+            for path in paths:
+                parent_obj = self.rows.get(path)
+                self.remove_placeholder(parent_obj)
+                if parent_obj is not None:
+                    self.h_store.set_value(parent_obj, COL_LOADED, True)
+                if prefetch:
+                    unloaded.extend(self.unloaded_children(parent_obj))
+            self.request_level(unloaded)
+        self.report_progress()
+
+    # requests all collections, rows of collections that no longer exist
+    # are removed once the complete list has been received
+    def reload_all(self):
+        started = time.time()
+        self.seen = set()
+        self.run_job(self.collection_path_batches, self.insert_paths,
+                lambda ok: self.on_all_loaded(ok, started))
+
+    # requests the collections that have been modified since a point in time
+    def refresh_since(self, since):
+        started = time.time()
+        self.run_job(
+            lambda session: self.collection_path_batches(session, since), 
+            self.insert_paths,
+            lambda ok: self.on_all_loaded(ok, started))
+
+    # adds collections as rows, creates missing parent rows on the fly
+    def insert_paths(self, results):
+        for coll_path in results:
+            self.insert_path(coll_path)
+        if self.seen is not None:
+            self.seen.update(results)
+        self.report_progress()
+
+    def insert_path(self, coll_path):
+        if coll_path in self.rows:
+            return self.rows[coll_path]
+        parent_path, coll_name = coll_path.rsplit('/', 1)
+        if parent_path in self.rows:
+            parent_obj = self.rows[parent_path]
+        else:
+            parent_obj = self.insert_path(parent_path)
+        child_obj = self.h_store.append(parent_obj, [coll_name, coll_path, False, False])
+        self.add_to_index(coll_path, child_obj)
+        return child_obj
+
+    def on_all_loaded(self, ok, started):
+        self.pending -= 1
+        if ok:
+            if self.seen is not None:
+                self.remove_unseen()
+            self.mark_all_loaded()
+            if self.cache is not None:
+                self.cache.update(self.rows_paths(), started)
+        self.seen = None
+        self.report_progress()
+
+    # all children of all rows are known now
+    def mark_all_loaded(self):
+        for row_obj in self.rows.values():
+            if row_obj is not None:
+                self.remove_placeholder(row_obj)
+                self.h_store.set_value(row_obj, COL_LOADED, True)
+
+    # removes the rows of collections that were absent in a complete reload
+    def remove_unseen(self):
+        unseen = [ path for path in self.rows 
+                   if path != self.root and path not in self.seen ]
+        removed = set()
+        for path in sorted(unseen):
+            # removing a row also removes the rows below it
+            if path.rsplit('/', 1)[0] not in removed:
+                self.h_store.remove(self.rows[path])
+            removed.add(path)
+        for path in unseen:
+            del self.rows[path]
+        self.visible.difference_update(unseen)
+        if self.index is not None:
+            self.index.remove(unseen)
+
+    def rows_paths(self):
+        return [ path for path in self.rows if path != self.root ]
+
+    def report_progress(self):
+        if self.progress_callback is not None:
+            self.progress_callback(self.count(), self.is_loading())
+
+    def unloaded_children(self, parent_obj):
+        unloaded = []
+        child = self.h_store.iter_children(parent_obj)
+        while child is not None:
+            if not self.h_store.get_value(child, COL_LOADED):
+                unloaded.append(self.h_store.get_value(child, COL_PATH))
+            child = self.h_store.iter_next(child)
+        return unloaded
+
+    # appends a not yet loaded collection, with a placeholder as its child
+    def add_row(self, parent_obj, coll_path):
+        coll_name = coll_path.rsplit('/', 1)[-1]
+        child_obj = self.h_store.append(parent_obj, [coll_name, coll_path, False, False])
+        self.h_store.append(child_obj, [PLACEHOLDER, '', True, False])
+        return child_obj
+
+    # registers the row of a collection
+    def add_to_index(self, coll_path, row_obj):
+        self.rows[coll_path] = row_obj
+        if self.index is not None:
+            self.index.add(coll_path)
+
+    # shows the rows of the given collections and of their parents in the
+    # filter, hides the rows that were shown before
+    def set_visible(self, coll_paths):
+        visible = set()
+        for coll_path in coll_paths:
+            while coll_path in self.rows and coll_path != self.root \
+                    and coll_path not in visible:
+                visible.add(coll_path)
+                coll_path = coll_path.rsplit('/', 1)[0]
+        for coll_path in self.visible - visible:
+            if coll_path in self.rows:
+                self.h_store.set_value(self.rows[coll_path], COL_VISIBLE, False)
+        for coll_path in visible - self.visible:
+            self.h_store.set_value(self.rows[coll_path], COL_VISIBLE, True)
+        self.visible = visible
 
+    def remove_placeholder(self, parent_obj):
+        child = self.h_store.iter_children(parent_obj)
+        if child is not None and self.h_store.get_value(child, COL_PATH) == '':
+            self.h_store.remove(child)
@@ -8,6 +8,7 @@
 #
 # method get_results() return the tuple  (service, username, password)
 # where service is the data field of the dict services, or any text entered in this widget
+# method set_services() replaces the services, e.g. after a refresh of the list
 
 import gi
 from gi.repository import Gtk
@@ -69,6 +70,10 @@ class IrodsLoginDialog(Gtk.Dialog):
             state = True
         self.set_response_sensitive(Gtk.ResponseType.OK, state)
 
+    def set_services(self, services):
+        self.combo_service.set_entries(services)
+        self.on_changed(self.combo_service)
+
     def get_results(self):
         return self.combo_service.get_text(), self.entry_user.get_text(), self.entry_password.get_text()
 
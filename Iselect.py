@@ -4,7 +4,7 @@
 # Iselect manages a dict of iRODS zone configurations
 #
 # input file IRODSZONESFILE
-# format must be: 
+# format must be:
 #   { "zone1": { "description" : "This is zone 1",
 #                "config" : { ... }
 #              },
@@ -12,11 +12,22 @@
 #   }
 # where the "config" json object will be used as outputfile content
 #
+# A zone list that is obtained from a URL is cached in the cache directory,
+# together with its ETag and Last-Modified header. The constructor never
+# accesses the network, it uses the cached list (if any). Method refresh()
+# revalidates the cached list with a conditional request (with a timeout),
+# refresh_in_background() does so in a separate thread. Listeners that have
+# been added with add_listener() are called (in that thread) when a changed
+# list has been received.
+#
 
 import os
 import json
 import re
+import threading
 import urllib.request
+import urllib.error
+from CacheDir import cache_path
 
 
 # the default locations for zone config information
@@ -25,53 +36,117 @@ import urllib.request
 IRODS_ZONES_FILE1 = '/etc/irods_zones.json'
 IRODS_ZONES_FILE2 = 'https://yoda.uu.nl/facts/irods_zones.json'
 
+# seconds to wait for the server of a zone list URL
+URL_TIMEOUT = 5
+
+URI_PATTERN = re.compile(
+    r'^(?:http|ftp)s?://' # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
+    r'localhost|' #localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
+    r'(?::\d+)?' # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
 
 class Iselect():
 
-    def __init__(self, location=None):
+    def __init__(self, location=None, cache_file=None, timeout=URL_TIMEOUT):
         self.zones = None
-        if location != None:
-            self.zones = self.configure(location)
-        if self.zones == None:
-            self.zones = self.configure(IRODS_ZONES_FILE1)
+        # URL of the zone list that is cached, if any
+        self.url = None
+        self.etag = None
+        self.last_modified = None
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.listeners = []
+        for candidate in (location, IRODS_ZONES_FILE1, IRODS_ZONES_FILE2):
+            if candidate != None:
+                self.zones = self.configure(candidate)
+            if self.zones != None:
+                break
         if self.zones == None:
-            self.zones = self.configure(IRODS_ZONES_FILE2)
+            self.zones = {}
 
     def get_zones(self):
-        return { z + ' - ' + self.zones[z]['description'] : z  for z in self.zones}
+        zones = self.zones
+        return { z + ' - ' + zones[z]['description'] : z  for z in zones}
 
 
     def get_irods_environment(self, key):
-        if not key in self.zones:
+        zones = self.zones
+        if not key in zones:
             return None
-        return self.zones[key]['config']
+        return zones[key]['config']
+
+
+    # listener() is called when the zone list has changed
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+
+    # revalidates a zone list obtained from a URL
+    # returns true if a changed list has been received
+    def refresh(self):
+        if self.url is None:
+            return False
+        zones = self.read_url(self.url)
+        if zones is None:
+            return False
+        self.zones = zones
+        for listener in list(self.listeners):
+            listener()
+        return True
+
+
+    def refresh_in_background(self):
+        if self.url is None:
+            return
+        threading.Thread(target = self.refresh, daemon = True).start()
 
 
     def configure(self, location):
         if self.is_uri(location):
-            return self.read_url(location)
+            zones = self.read_cache(location)
+            if self.url == None or zones != None:
+                self.url = location
+            return zones
         else:
             return self.read_file(os.path.expanduser(location))
 
 
     def is_uri(self, text):
-        regex = re.compile(
-            r'^(?:http|ftp)s?://' # http:// or https://
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
-            r'localhost|' #localhost...
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
-            r'(?::\d+)?' # optional port
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-        return re.match(regex, text) is not None
+        return URI_PATTERN.match(text) is not None
 
 
+    # returns the zone list if it has changed since it was cached,
+    # None if it is unchanged or could not be obtained
     def read_url(self, url):
+        request = urllib.request.Request(url)
+        if self.etag is not None:
+            request.add_header('If-None-Match', self.etag)
+        if self.last_modified is not None:
+            request.add_header('If-Modified-Since', self.last_modified)
         try:
-            with urllib.request.urlopen(url) as f:
-                data = f.read().decode('utf-8')
-            return json.loads(data)
-        except IOError:
+            with urllib.request.urlopen(request, timeout = self.timeout) as f:
+                data = json.loads(f.read().decode('utf-8'))
+                etag = f.headers.get('ETag')
+                last_modified = f.headers.get('Last-Modified')
+        except urllib.error.HTTPError:
+            # 304: cached list is still valid
             return None
+        except (IOError, ValueError):
+            return None
+        if not isinstance(data, dict):
+            return None
+        self.etag = etag
+        self.last_modified = last_modified
+        self.write_cache(url, data)
+        return data
 
 
     def read_file(self, path):
@@ -79,6 +154,34 @@ class Iselect():
             with open(path, 'rt') as f:
                 data = json.load(f)
             return data
-        except IOError:
+        except (IOError, ValueError):
+            return None
+
+
+    # PRIVATE METHODS
+
+    def cache_location(self):
+        if self.cache_file is None:
+            self.cache_file = cache_path('irods_zones.json')
+        return self.cache_file
+
+
+    def read_cache(self, url):
+        cached = self.read_file(self.cache_location())
+        if not isinstance(cached, dict) or cached.get('url') != url:
             return None
+        self.etag = cached.get('etag')
+        self.last_modified = cached.get('last_modified')
+        return cached.get('zones')
 
+
+    def write_cache(self, url, zones):
+        cached = { 'url': url, 'etag': self.etag,
+                   'last_modified': self.last_modified, 'zones': zones }
+        temp = self.cache_location() + '.tmp'
+        try:
+            with open(temp, 'wt') as f:
+                json.dump(cached, f)
+            os.replace(temp, self.cache_location())
+        except IOError:
+            pass
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# JobQueue is a persistent queue of sync jobs, shared by all instances of the
+# application (GUI and headless) of a user
+#
+# The queue is a JSON file in the cache directory. Each access locks the
+# queue (flock on a separate lock file), reads it, optionally modifies it and
+# writes it back atomically, so that multiple processes can submit and claim
+# jobs safely. Jobs remain in the queue after they have finished, until they
+# are purged.
+#
+# A job is claimed by a scheduler process (its owner) when it starts to run,
+# the owner then records the process id of the job process. The job process
+# runs in a session of its own and survives its owner, so a running job is
+# only interrupted if its job process (or, before that has been recorded,
+# its owner) no longer exists. Then it is queued again the next time the
+# queue is read.
+#
+
+import os
+import json
+import time
+import fcntl
+import shlex
+from contextlib import contextmanager
+from CacheDir import cache_path
+from ChunkedTransfer import DEFAULT_STREAMS
+
+# job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+DEFAULT_PRIORITY = 0
+
+
+class SyncJob():
+    def __init__(self, direction, local, remote, workers=1, priority=DEFAULT_PRIORITY,
+            engine='native', options=None):
+        self.id = None
+        # 'upload' or 'download'
+        self.direction = direction
+        self.local = local
+        self.remote = remote
+        self.workers = workers
+        # jobs with a higher priority run first
+        self.priority = priority
+        self.engine = engine
+        # additional options for the headless sync, e.g. ['-b']
+        self.options = options if options is not None else []
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.exit_code = None
+        # pid of the scheduler process that runs the job
+        self.owner = None
+        # pid of the process that runs the job, None until it has started
+        self.pid = None
+        # number of connections used by the running job (see connections_for)
+        self.connections = 0
+
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+    @staticmethod
+    def from_dict(values):
+        job = SyncJob(values['direction'], values['local'], values['remote'])
+        job.__dict__.update(values)
+        return job
+
+
+    # returns the shell command that runs the job with the given number of
+    # workers, program is the path of myrods-sync.py
+    def command(self, program, workers, python='python3'):
+        if self.engine == 'irsync':
+            local = shlex.quote(self.local)
+            remote = shlex.quote('i:' + self.remote)
+            args = 'irsync -r -v ' + (local + ' ' + remote if self.direction == 'upload'
+                                      else remote + ' ' + local)
+        else:
+            source, target = ((self.local, self.remote) if self.direction == 'upload'
+                              else (self.remote, self.local))
+            args = ' '.join([ shlex.quote(arg) for arg in [python, '-u', program,
+                    '--headless', '-c', str(workers), '-d', self.direction]
+                    + self.options + ['--', source, target] ])
+        # keep the exit code of the sync as exit code of the command
+        return args + ';rc=$?;echo "DONE!";exit $rc'
+
+
+    # true if the job keeps watching for changes, i.e. never finishes
+    def watches(self):
+        return '-w' in self.options
+
+
+    # returns the value of an option of the job, or default if not given
+    def option(self, name, default=None):
+        if name in self.options[:-1]:
+            return self.options[self.options.index(name) + 1]
+        return default
+
+
+    # returns the number of iRODS connections that the job uses at most with
+    # the given number of workers: the main session, plus per worker its own
+    # session and those of the streams of a chunked transfer
+    def connections_for(self, workers):
+        if self.engine == 'irsync':
+            return workers
+        streams = int(self.option('--streams', DEFAULT_STREAMS))
+        return 1 + workers * (1 + streams)
+
+
+    # returns the largest number of workers (at most the number asked for)
+    # with which the job uses no more than the given number of connections
+    def workers_within(self, connections):
+        workers = self.workers
+        while workers > 0 and self.connections_for(workers) > connections:
+            workers -= 1
+        return workers
+
+
+    def describe(self):
+        arrow = ' -> ' if self.direction == 'upload' else ' <- '
+        return self.local + arrow + self.remote
+
+
+class JobQueue():
+    def __init__(self, queue_file=None):
+        if queue_file is None:
+            queue_file = cache_path('jobs.json')
+        self.queue_file = queue_file
+        self.lock_file = queue_file + '.lock'
+
+
+    # adds a job to the queue, returns its id
+    def submit(self, job):
+        with self.locked() as jobs:
+            job.id = max([0] + [ other.id for other in jobs ]) + 1
+            job.state = QUEUED
+            job.submitted = time.time()
+            jobs.append(job)
+        return job.id
+
+
+    # returns all jobs, in the order in which they will run
+    def jobs(self):
+        with self.locked(False) as jobs:
+            return sorted(jobs, key = job_order)
+
+
+    def get(self, job_id):
+        for job in self.jobs():
+            if job.id == job_id:
+                return job
+        return None
+
+
+    # marks the job as running if it is (still) queued, returns the claimed
+    # job or None if the job is no longer available
+    def claim(self, job_id, connections):
+        with self.locked() as jobs:
+            for job in jobs:
+                if job.id == job_id and job.state == QUEUED:
+                    job.state = RUNNING
+                    job.owner = os.getpid()
+                    job.pid = None
+                    job.connections = connections
+                    job.started = time.time()
+                    job.exit_code = None
+                    return job
+        return None
+
+
+    def finish(self, job_id, exit_code):
+        with self.locked() as jobs:
+            for job in jobs:
+                if job.id == job_id:
+                    job.state = DONE if exit_code == 0 else FAILED
+                    job.exit_code = exit_code
+                    job.finished = time.time()
+                    job.connections = 0
+                    job.pid = None
+
+
+    # cancels a job that has not started yet, returns true if cancelled
+    def cancel(self, job_id):
+        with self.locked() as jobs:
+            for job in jobs:
+                if job.id == job_id and job.state == QUEUED:
+                    job.state = CANCELLED
+                    job.finished = time.time()
+                    return True
+        return False
+
+
+    def set_priority(self, job_id, priority):
+        with self.locked() as jobs:
+            for job in jobs:
+                if job.id == job_id:
+                    job.priority = priority
+
+
+    # removes the jobs that are no longer queued or running
+    def purge(self):
+        with self.locked() as jobs:
+            jobs[:] = [ job for job in jobs if job.state in (QUEUED, RUNNING) ]
+
+
+    # PRIVATE METHODS
+
+    # yields the list of jobs, changes to the list are saved if write is true
+    @contextmanager
+    def locked(self, write=True):
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                jobs = self.load()
+                requeued = self.requeue_orphans(jobs)
+                yield jobs
+                if write or requeued:
+                    self.save(jobs)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def load(self):
+        try:
+            with open(self.queue_file, 'rt') as f:
+                return [ SyncJob.from_dict(values) for values in json.load(f) ]
+        except (IOError, ValueError, KeyError):
+            return []
+
+
+    def save(self, jobs):
+        temp = self.queue_file + '.tmp'
+        with open(temp, 'wt') as f:
+            json.dump([ job.to_dict() for job in jobs ], f, indent = 1)
+        os.replace(temp, self.queue_file)
+
+
+    # records the process that runs a claimed job
+    def set_pid(self, job_id, pid):
+        with self.locked() as jobs:
+            for job in jobs:
+                if job.id == job_id:
+                    job.pid = pid
+
+
+    # queues running jobs of which the job process (or the owner, if the job
+    # process has not been recorded yet) has gone
+    def requeue_orphans(self, jobs):
+        requeued = False
+        for job in jobs:
+            if job.state != RUNNING:
+                continue
+            if not process_exists(job.pid if job.pid is not None else job.owner):
+                job.state = QUEUED
+                job.owner = None
+                job.pid = None
+                job.connections = 0
+                requeued = True
+        return requeued
+
+
+def job_order(job):
+    return (job.state != RUNNING, job.state != QUEUED, -job.priority, job.submitted)
+
+
+def process_exists(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
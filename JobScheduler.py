@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# JobScheduler starts the jobs of a JobQueue, highest priority first, while
+# respecting global limits on the number of concurrently running jobs and on
+# the total number of iRODS connections used by these jobs
+#
+# The limits apply to the running jobs of all processes that share the
+# queue. A job asks for a number of workers, each of which may use several
+# connections (see SyncJob.connections_for). It is started with fewer
+# workers if not all of their connections are available. A job that does not
+# fit with a single worker waits for the running jobs, unless no connections
+# are in use, then it runs with one worker.
+# Jobs that keep watching for changes (-w) never finish, they do not count
+# towards the number of running jobs, but their connections do count.
+#
+# The scheduler does not run jobs itself:
+#     start(job, workers)     is called to start a job, it returns a handle
+#                             with method poll() as returned by subprocess.Popen
+# method schedule() must be called periodically to start queued jobs and to
+# record the exit code of finished jobs.
+#
+
+import time
+from JobQueue import QUEUED, RUNNING
+
+MAX_JOBS = 2
+MAX_CONNECTIONS = 32
+POLL_INTERVAL = 1.0
+
+
+class JobScheduler():
+    def __init__(self, queue, start, max_jobs=MAX_JOBS,
+            max_connections=MAX_CONNECTIONS):
+        self.queue = queue
+        self.start = start
+        self.max_jobs = max_jobs
+        self.max_connections = max_connections
+        # job id -> handle of the jobs started by this scheduler
+        self.handles = {}
+
+
+    # records finished jobs and starts queued jobs if limits permit,
+    # returns the number of jobs that this scheduler is running
+    def schedule(self):
+        for job_id, handle in list(self.handles.items()):
+            exit_code = handle.poll()
+            if exit_code is not None:
+                del self.handles[job_id]
+                self.queue.finish(job_id, exit_code)
+        jobs = self.queue.jobs()
+        running = [ job for job in jobs if job.state == RUNNING ]
+        jobs_free = self.max_jobs - len([ job for job in running
+                                          if not job.watches() ])
+        connections_free = self.max_connections - sum([ job.connections
+                                                        for job in running ])
+        for job in jobs:
+            if job.state != QUEUED:
+                continue
+            if jobs_free <= 0 and not job.watches():
+                continue
+            workers = job.workers_within(connections_free)
+            if workers < 1:
+                if connections_free < self.max_connections:
+                    # wait until running jobs release their connections
+                    break
+                workers = 1
+            connections = job.connections_for(workers)
+            job = self.queue.claim(job.id, connections)
+            if job is None:
+                # claimed by another process meanwhile
+                continue
+            try:
+                self.handles[job.id] = self.start(job, workers)
+            except Exception as e:
+                print('Error: Could not start job {}: {}'.format(job.id, e))
+                self.queue.finish(job.id, -1)
+                continue
+            self.queue.set_pid(job.id, self.handles[job.id].pid)
+            if not job.watches():
+                jobs_free -= 1
+            connections_free -= connections
+        return len(self.handles)
+
+
+    # schedules jobs until the queue holds no queued jobs and the jobs started
+    # by this scheduler have finished (jobs run by other processes are theirs)
+    def run(self):
+        while True:
+            self.schedule()
+            if not self.handles and not any([ job.state == QUEUED
+                                              for job in self.queue.jobs() ]):
+                return
+            time.sleep(POLL_INTERVAL)
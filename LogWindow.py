@@ -1,19 +1,43 @@
 #!/bin/python
 # (c) 2021 Ton Smeele - Utrecht University
 #
-# manages a window that shows (and updates) data read from a textfile 
-# 
+# manages a window that shows (and updates) the output of a shell command
+#
+# The output (stdout and stderr) is read via a GLib IO watch as soon as it
+# becomes available. Output received in between two frames is added to the
+# text buffer in a single insert. The window keeps only the last max_lines
+# lines (also of the output that waits for the next frame), the complete
+# output is written to a log file in the cache directory. Each callback reads
+# at most MAX_READS blocks, so that a fast command cannot starve the redraws.
+#
+# The output is also parsed into a SyncProgress, shown with a progress bar
+# and a line of statistics. These are refreshed every UPDATE_INTERVAL ms.
+#
 
-from subprocess import Popen, PIPE
-import fcntl
+from subprocess import Popen, PIPE, STDOUT
+import codecs
+import time
 import gi
 from gi.repository import Gtk, GLib
 import os
+import errno
+import signal
+from CacheDir import cache_path
+from SyncProgress import SyncProgress
+
+DEFAULT_MAX_LINES = 10000
+READ_SIZE = 65536
+# maximum number of reads per IO callback
+MAX_READS = 16
+# number of log files kept in the cache directory
+KEEP_LOGS = 20
+UPDATE_INTERVAL = 500
 
 class LogWindow(Gtk.Window):
-    def __init__(self, shell_command, title):
+    def __init__(self, shell_command, title, max_lines=DEFAULT_MAX_LINES):
         super().__init__()
         self.shell_command = shell_command
+        self.max_lines = max_lines
         if title is not None:
             self.props.title = title
         self.setup()
@@ -23,30 +47,174 @@ class LogWindow(Gtk.Window):
         self.set_destroy_with_parent(True)
 
         textview = Gtk.TextView()
+        textview.set_editable(False)
         self.textview = textview
 
+        self.progress = SyncProgress()
+        self.progress_bar = Gtk.ProgressBar()
+        self.progress_bar.set_show_text(True)
+        self.progress_bar.set_text('starting...')
+        self.stats_label = Gtk.Label(label='')
+        self.stats_label.set_xalign(0)
+
         scroll = Gtk.ScrolledWindow()
+        scroll.set_vexpand(True)
         scroll.add(textview)
-        self.add(scroll)
+        self.log_path = self.new_log_path()
+        self.log_label = Gtk.Label(label='Full log: ' + self.log_path)
+        self.log_label.set_xalign(0)
+        self.log_label.set_selectable(True)
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        box.add(self.progress_bar)
+        box.add(self.stats_label)
+        box.add(scroll)
+        box.add(self.log_label)
+        self.add(box)
         self.show_all()
-    
-        # execute the shell command and collect its output via pipe 
-        sub_process = Popen(self.shell_command, stdout= PIPE, shell= True)
+
+        self.pending = []
+        # number of newlines in pending
+        self.pending_lines = 0
+        self.dropped_lines = 0
+        self.tick_id = None
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.log_file = open(self.log_path, 'wb')
+
+        # execute the shell command and collect its output via pipe
+        # the command runs in its own process group, so that it can be
+        # terminated (including its children) when the window is closed
+        sub_process = Popen(self.shell_command, stdout= PIPE, stderr= STDOUT,
+                shell= True, start_new_session= True)
         self.sub_process = sub_process
-        self.timeout_id = GLib.timeout_add(100,self.update_terminal, None)
-        self.activity_mode = False
+        self.fd = sub_process.stdout.fileno()
+        os.set_blocking(self.fd, False)
+        # (below the priority of redraws, so that frames are drawn in between)
+        self.watch_id = GLib.io_add_watch(self.fd, GLib.PRIORITY_DEFAULT_IDLE,
+                GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_output)
+        self.update_id = GLib.timeout_add(UPDATE_INTERVAL, self.update_progress)
+        self.connect('destroy', self.on_destroy)
 
-    def non_block_read(self, output):
-        fd = output.fileno()
-        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-        try:
-            return output.read().decode("utf-8")
-        except:
-            return ''
+    # called by the main loop when output is available or the pipe is closed
+    def on_output(self, fd, condition):
+        for i in range(MAX_READS):
+            try:
+                data = os.read(fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # all available output has been read
+                    return True
+                data = b''
+            if len(data) == 0:
+                # end of output
+                self.add_output(self.decoder.decode(b'', final=True))
+                self.progress.finish()
+                self.watch_id = None
+                self.close_output()
+                return False
+            self.log_file.write(data)
+            text = self.decoder.decode(data)
+            self.progress.feed(text)
+            self.add_output(text)
+        # more output may be available, the watch is called again
+        return True
+
+    # queues text to be shown with the next frame
+    def add_output(self, text):
+        if text == '':
+            return
+        self.pending.append(text)
+        self.pending_lines += text.count('\n')
+        if self.pending_lines > 2 * self.max_lines:
+            # output arrives faster than frames, keep only what will be shown
+            lines = ''.join(self.pending).split('\n')
+            self.dropped_lines += len(lines) - self.max_lines
+            self.pending = ['\n'.join(lines[-self.max_lines:])]
+            self.pending_lines = self.max_lines - 1
+        if self.tick_id is None:
+            self.tick_id = self.textview.add_tick_callback(self.on_tick)
+
+    # called once per frame, adds all queued output to the text buffer
+    def on_tick(self, widget, frame_clock):
+        self.tick_id = None
+        text = ''.join(self.pending)
+        self.pending = []
+        self.pending_lines = 0
+        # no need to insert lines that would be dropped right away
+        lines = text.split('\n')
+        if len(lines) > self.max_lines:
+            self.dropped_lines += len(lines) - self.max_lines
+            text = '\n'.join(lines[-self.max_lines:])
+        buffer = self.textview.get_buffer()
+        buffer.insert(buffer.get_end_iter(), text)
+        self.trim(buffer)
+        self.textview.scroll_to_mark(buffer.get_insert(), 0.0, False, 0.0, 1.0)
+        return False
+
+    # refreshes the progress bar and statistics (called by a timer)
+    def update_progress(self):
+        fraction = self.progress.fraction()
+        if self.progress.finished:
+            self.progress_bar.set_fraction(1.0)
+            self.progress_bar.set_text('finished')
+        elif fraction is None:
+            self.progress_bar.pulse()
+            self.progress_bar.set_text('{} files'.format(self.progress.files_done))
+        else:
+            self.progress_bar.set_fraction(fraction)
+            self.progress_bar.set_text('{:.0f} %'.format(fraction * 100))
+        self.stats_label.set_text(self.progress.summary())
+        if self.progress.finished:
+            self.update_id = None
+            return False
+        return True
 
-    def update_terminal(self, user_data):
-        self.textview.get_buffer().insert_at_cursor(
-            self.non_block_read(self.sub_process.stdout))
-        return self.sub_process.poll() is None
+    # drops the oldest lines from the buffer to stay within max_lines
+    def trim(self, buffer):
+        excess = buffer.get_line_count() - self.max_lines
+        if excess > 0:
+            self.dropped_lines += excess
+            buffer.delete(buffer.get_start_iter(),
+                    buffer.get_iter_at_line(excess))
+        if self.dropped_lines > 0:
+            self.log_label.set_text('Showing the last {} lines, full log: {}'
+                    .format(self.max_lines, self.log_path))
+        buffer.place_cursor(buffer.get_end_iter())
 
+    def close_output(self):
+        if self.watch_id is not None:
+            GLib.source_remove(self.watch_id)
+            self.watch_id = None
+        if not self.log_file.closed:
+            self.log_file.close()
+        self.sub_process.stdout.close()
+        self.sub_process.poll()
+
+    def on_destroy(self, widget):
+        if self.update_id is not None:
+            GLib.source_remove(self.update_id)
+            self.update_id = None
+        if self.tick_id is not None:
+            self.textview.remove_tick_callback(self.tick_id)
+            self.tick_id = None
+        if self.sub_process.poll() is None:
+            try:
+                os.killpg(self.sub_process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self.close_output()
+
+    # returns the path of a new log file, old sync log files are removed
+    def new_log_path(self):
+        folder = os.path.dirname(cache_path('logs', 'sync.log'))
+        try:
+            logs = sorted([ name for name in os.listdir(folder)
+                            if name.startswith('sync-')
+                            and name.endswith('.log') ])
+            for name in logs[:max(0, len(logs) - KEEP_LOGS + 1)]:
+                os.remove(os.path.join(folder, name))
+        except OSError:
+            pass
+        now = time.time()
+        name = '{}.{:03d}-{}.log'.format(time.strftime('sync-%Y%m%d-%H%M%S',
+                time.localtime(now)), int(now * 1000) % 1000, os.getpid())
+        return os.path.join(folder, name)
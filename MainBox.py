@@ -3,16 +3,21 @@
 #
 # MainBox manages the content of the application window 
 # 
+# Dialogs, windows and the sync engine are imported when they are first 
+# used, so that they do not delay the startup of the application.
+#
 
 import gi
-from gi.repository import Gtk, GdkPixbuf, Gdk, Gio
+from gi.repository import Gtk, GdkPixbuf, Gdk, Gio, GLib
 import json
-from IrodsChooserDialog import IrodsChooserDialog, IrodsChooserStore
-from LogWindow import LogWindow
-from IrodsLoginDialog import IrodsLoginDialog
+import os
+import sys
+import threading
 from MyRodsConnection import MyRodsConnection
 from Iselect import Iselect
-from EntryDialog import EntryDialog
+from JobQueue import JobQueue, SyncJob
+from JobScheduler import JobScheduler, MAX_JOBS, MAX_CONNECTIONS, POLL_INTERVAL
+from AdaptiveConcurrency import DEFAULT_MAXIMUM
 
 EMPTY_SELECTION = '-> Click to select '
 
@@ -34,14 +39,33 @@ class MainBox(Gtk.Box):
 
         # we attempt to reconnect to iRODS using 
         # a pre-configured environment + token  (if available)
-        self.irods = MyRodsConnection()
-        self.irods.connect() 
+        # this happens in the background, so that a slow or unreachable
+        # server does not delay the window
+        self.irods = MyRodsConnection(self.data.get('connection_pool_size', 0))
+        self.connecting = True
 
         # load irods zones list, used to select a known data grid
+        # a list obtained from a URL is cached, the cached list is used while 
+        # it is revalidated in the background
         self.select = Iselect(self.data['zonelist_location']) 
+        self.login_dialog = None
+        self.select.add_listener(
+                lambda: GLib.idle_add(self.on_zones_refreshed))
+        self.select.refresh_in_background()
+
+        # sync runs are queued as jobs, the scheduler starts them in a log
+        # window when the global limits on jobs and connections permit
+        self.jobs = JobQueue()
+        self.scheduler = JobScheduler(self.jobs, self.start_job,
+                self.data.get('max_jobs', MAX_JOBS), 
+                self.data.get('max_connections', MAX_CONNECTIONS))
+        self.queue_window = None
+        self.scheduler.schedule()
+        GLib.timeout_add(int(POLL_INTERVAL * 1000), self.on_schedule_timer)
 
         # initialize all widgets
         self.setup()
+        threading.Thread(target = self.reconnect, daemon = True).start()
 
     def setup(self):
         # top section: show logo and instructions
@@ -75,6 +99,7 @@ class MainBox(Gtk.Box):
         self.remote_folder = self.widget_clicklabel('Yoda/iRODS folder')
         self.remote_folder.completed = False
         self.remote_folder.connect("clicked", self.on_irods_folder_clicked)
+        self.remote_folder.set_sensitive(False)
 
         self.run_now = Gtk.Button(label = 'Run!', border_width = 20)
         self.run_now.set_sensitive(False)
@@ -91,6 +116,11 @@ class MainBox(Gtk.Box):
         grid.attach(self.remote_folder, 2, 1, 1, 1)
         grid.attach(self.run_now, 3, 1, 1, 1)
 
+        # row 2: option to keep uploading changes (native engine only)
+        self.keep_watching = Gtk.CheckButton(label = 'keep uploading changes')
+        self.keep_watching.set_sensitive(self.data.get('sync_engine') != 'irsync')
+        grid.attach(self.keep_watching, 0, 2, 1, 1)
+
         # add the grid to the main box
         self.add(grid)
 
@@ -117,6 +147,22 @@ class MainBox(Gtk.Box):
         return button
 
 
+    # reconnects with the stored token (runs in a background thread)
+    def reconnect(self):
+        session = self.irods.connect()
+        if session is not None and not self.irods.healthy(session):
+            # token not accepted or server unreachable
+            self.irods.cleanup()
+        GLib.idle_add(self.on_reconnected)
+
+
+    def on_reconnected(self):
+        self.connecting = False
+        self.remote_folder.set_sensitive(True)
+        self.update_remote_host_label()
+        return False
+
+
     def on_local_folder_clicked(self, widget):
         dialog = Gtk.FileChooserDialog(
             title = 'Select a directory to synchronize',
@@ -146,14 +192,17 @@ class MainBox(Gtk.Box):
 
 
     def authenticated_after_optional_dialog(self):    
-        need_configuration_from_user = (self.irods.session == None)
+        need_configuration_from_user = (self.irods.check_session() == None)
         title = 'login'
         while need_configuration_from_user:
             # need to ask user to (select an irods environment and) 
             # provide credentials
+            from IrodsLoginDialog import IrodsLoginDialog
             choices = self.select.get_zones()
             dialog = IrodsLoginDialog(self.parent, title, choices)
+            self.login_dialog = dialog
             response = dialog.run()
+            self.login_dialog = None
             
             if response == Gtk.ResponseType.OK:
                 (service,username,password) = dialog.get_results()
@@ -175,11 +224,24 @@ class MainBox(Gtk.Box):
         return self.irods.session != None
 
 
+    # updates the login dialog (if shown) after a refresh of the zones list
+    def on_zones_refreshed(self):
+        if self.login_dialog is not None:
+            self.login_dialog.set_services(self.select.get_zones())
+        return False
+
+
     def select_collection_dialog(self, widget):
-        dataStore = IrodsChooserStore(self.irods.session)
+        from IrodsChooserDialog import IrodsChooserDialog, IrodsChooserStore
+        from CollectionCache import CollectionCache
+        from EntryDialog import EntryDialog
+        # collections are loaded in the background while the dialog is shown
+        cache = CollectionCache(self.irods.session.zone, 
+                self.irods.session.username, self.data.get('collection_cache_ttl'))
+        dataStore = IrodsChooserStore(self.irods.session, self.irods.acquire,
+                cache, self.irods.release)
+        dialog = IrodsChooserDialog(dataStore)
         dataStore.load_iRODS_collections()
-     
-        dialog = IrodsChooserDialog(dataStore.get_store())
         dialog_done = False
         while not dialog_done:
             response = dialog.run()
@@ -200,6 +262,7 @@ class MainBox(Gtk.Box):
                         try:
                             self.irods.session.collections.create(parentcoll + '/' + subcoll)
                             dialog.add_child(subcoll)
+                            dataStore.invalidate_cache()
                         except:
                             # TODO: inform the user that create failed
                             pass
@@ -215,12 +278,15 @@ class MainBox(Gtk.Box):
                     self.remote_folder.completed = True
                     self.update_run_now()
 
+        dataStore.stop_loading()
         dialog.destroy()
 
 
 
     def on_disconnect(self):
-        self.irods.session = self.irods.session.cleanup()
+        if self.connecting:
+            return
+        self.irods.cleanup()
         self.reset_remote_folder()
         self.update_remote_host_label()
 
@@ -230,12 +296,85 @@ class MainBox(Gtk.Box):
         if self.local_folder.completed and self.remote_folder.completed:
             # print('local folder is :' + widget.h_local_folder.get_label())
             # print('remote folder is:' + widget.h_remote_folder.get_label())
-            cmd = self.build_run_command(
-                self.local_folder.get_label(),
-                self.remote_folder.path_prefix + self.remote_folder.get_label(),
-                self.sync_type.get_active()
-                )
-            log = LogWindow(cmd, 'Synchronization log')
+            local = self.local_folder.get_label()
+            remote = self.remote_folder.path_prefix + self.remote_folder.get_label()
+            sync = self.sync_type.get_active()
+            watch = sync == 0 and self.keep_watching.get_active()
+            if self.data.get('sync_engine') != 'irsync':
+                # let the user confirm the plan first
+                from PlanDialog import PlanDialog
+                dialog = PlanDialog(self.parent, 
+                        lambda: self.make_plan(local, remote, sync), watch)
+                response = dialog.run()
+                dialog.destroy()
+                if response != Gtk.ResponseType.OK:
+                    return
+            options = []
+            if watch:
+                options.append('-w')
+            workers = self.data.get('sync_workers', 1)
+            if self.data.get('sync_adaptive'):
+                # the job may grow to the maximum of the adaptive concurrency,
+                # the scheduler reserves the connections for that maximum
+                workers = max(workers, DEFAULT_MAXIMUM)
+            job = SyncJob('upload' if sync == 0 else 'download', local, remote,
+                    workers = workers,
+                    engine = self.data.get('sync_engine'), options = options)
+            self.jobs.submit(job)
+            self.scheduler.schedule()
+            if job.id not in self.scheduler.handles:
+                # job has to wait for other jobs
+                self.show_queue()
+
+
+    # starts a job (called by the scheduler), returns its process
+    def start_job(self, job, workers):
+        from LogWindow import LogWindow, DEFAULT_MAX_LINES
+        program = self.data['program_directory'] + '/myrods-sync.py'
+        log = LogWindow(job.command(program, workers, sys.executable), 
+                'Synchronization log - ' + job.describe(),
+                self.data.get('log_max_lines', DEFAULT_MAX_LINES))
+        return log.sub_process
+
+
+    def on_schedule_timer(self):
+        self.scheduler.schedule()
+        return True
+
+
+    def show_queue(self):
+        if self.queue_window is not None:
+            self.queue_window.present()
+            return
+        from QueueWindow import QueueWindow
+        self.queue_window = QueueWindow(self.jobs, self.scheduler)
+        self.queue_window.set_transient_for(self.parent)
+        self.queue_window.connect('destroy', self.on_queue_window_destroy)
+
+
+    def on_queue_window_destroy(self, widget):
+        self.queue_window = None
+
+
+    # returns the summary of a sync plan (called in a background thread)
+    # the plan is a preview: the job plans again and records the manifest, the
+    # preview uses a session of its own and leaves the manifest untouched
+    def make_plan(self, local, remote, sync):
+        from SyncEngine import SyncEngine
+        from SyncManifest import SyncManifest
+        from ThroughputHistory import ThroughputHistory
+        session = self.irods.acquire()
+        if session is None:
+            raise Exception('No connection to the iRODS server')
+        manifest = SyncManifest(os.path.abspath(local), remote.rstrip('/'))
+        try:
+            engine = SyncEngine(self.irods, local, remote, sync,
+                    manifest = manifest, session = session)
+            plan = engine.plan(record = False)
+        finally:
+            manifest.close()
+            self.irods.release(session)
+        return plan.summary(ThroughputHistory(self.irods.host()))
 
 
     def reset_remote_folder(self):
@@ -245,7 +384,9 @@ class MainBox(Gtk.Box):
 
 
     def update_remote_host_label(self):
-        if self.irods.session != None:
+        if self.connecting:
+            self.label_remote.set_markup('<b>Connecting…</b>')
+        elif self.irods.session != None:
             irods_host = self.irods.host()
             self.label_remote.set_markup('<b>Server at ' + irods_host + '</b>')
         else:
@@ -255,14 +396,5 @@ class MainBox(Gtk.Box):
         self.run_now.set_sensitive(
                 self.local_folder.completed and self.remote_folder.completed)
 
-     
-    def build_run_command(self, local, remote, sync):
-        done = ';echo "-- END OF LOG --"'
-        cmd = 'irsync -r -v '
-        qq = "'"
-        if sync == 0:
-            cmd = cmd + qq + local + qq + ' ' + qq + 'i:' + remote + qq
-        if sync == 1:
-            cmd = cmd + qq + 'i:' + remote + qq + ' ' + qq + local + qq
-        return cmd + ';echo "DONE!"'
+
 
@@ -17,26 +17,60 @@
 #               NB: if username differs from the irods_environment.json then
 #                   the file is updated to reflect the specified username
 #
+#  Additional sessions (e.g. for worker threads) are borrowed from a pool: 
+#  acquire() returns an idle or new session, release() returns it to the pool
+#  and discard() cleans up a session that is no longer usable.
+#
+#  All sessions share one SSL context. With a pool_size, that many sessions
+#  are authenticated in advance (in the background) after connect, and a 
+#  keepalive thread periodically checks the main session and the idle 
+#  sessions with a cheap query. Broken idle sessions are replaced. The main
+#  session may be in use by its owner, so the keepalive thread only flags it
+#  as broken; the next check_session() by the owner reconnects it with the
+#  stored token. Checks and reconnects of the main session are serialized by
+#  a lock. A session that has been idle for a while is checked before 
+#  acquire() hands it out.
+#
+#  The iRODS client is imported on the first connect, so that creating a
+#  MyRodsConnection is cheap (MainBox connects in the background).
 # 
 import os
 import json
 import ssl
-import irods
-from irods import password_obfuscation
-from irods.models import Resource
-from irods.session import iRODSSession
+import time
+import threading
+from SyncMetrics import metrics
 
 IRODS_ENV_FILE = '~/.irods/irods_environment.json'
 IRODS_TOKEN_FILE = '~/.irods/.irodsA'
 DEBUG = False
+# number of sessions kept ready in the pool
+POOL_SIZE = 0
+# maximum number of idle sessions in the pool
+MAX_IDLE = 16
+# a session idle for longer than this (seconds) is checked before reuse
+HEALTH_CHECK_AGE = 60
+# interval (seconds) between checks of the main and idle sessions
+KEEPALIVE_INTERVAL = 240
 
 class MyRodsConnection():
 
-    def __init__(self):
+    def __init__(self, pool_size=POOL_SIZE):
         self.session = None
+        self.session_checked = 0
+        # set by the keepalive thread if the main session failed its check
+        self.session_broken = False
+        self.session_lock = threading.Lock()
         self.irods_env = None
         self.password = None
         self.token = None
+        self.pool_size = pool_size
+        # idle additional sessions, as (session, time of last use)
+        self.pool = []
+        self.pool_lock = threading.Lock()
+        self.ssl_context = None
+        self.keepalive = None
+        self.stop_keepalive = threading.Event()
         # select and register location of irods environment file    
         if 'IRODS_ENVIRONMENT_FILE' in os.environ:
             self.irods_env_file = os.environ['IRODS_ENVIRONMENT_FILE']
@@ -49,6 +83,12 @@ class MyRodsConnection():
 
 
     def cleanup(self):
+        self.stop_keepalive.set()
+        self.keepalive = None
+        with self.pool_lock:
+            pool, self.pool = self.pool, []
+        for session, used in pool:
+            self.discard(session)
         if self.session is not None:
             self.session.cleanup()
             self.session = None
@@ -75,6 +115,7 @@ class MyRodsConnection():
         self.session = self._connect(None)
         if self.session != None:
             if DEBUG: print('MyRods: reconnect successful')
+            self.start_keepalive()
             return self.session
         if password == None:
             if DEBUG: print('MyRods: reconnect failed and no pwd available')
@@ -93,14 +134,102 @@ class MyRodsConnection():
             # we save the received token so that subsequent icommands can re-use it 
             self.save_irods_token(self.token)
 
+        self.start_keepalive()
         return self.session
 
 
+    # opens an additional session with the stored token, e.g. for use by a 
+    # worker thread. the caller is responsible to cleanup the session.
+    # returns None if the session could not be authenticated
+    def open_session(self):
+        if self.session is None:
+            return None
+        metrics.count('sessions_opened')
+        return self._connect(None)
+
+
+    # returns the main session, reconnects if it has been dropped
+    # returns None if no authenticated session is available
+    # (called by the owner of the main session, not by background threads)
+    def check_session(self):
+        with self.session_lock:
+            if self.session is None:
+                return None
+            if (self.session_broken or
+                    time.time() - self.session_checked > HEALTH_CHECK_AGE):
+                if not self.session_broken and self.healthy(self.session):
+                    self.session_checked = time.time()
+                elif self.reconnect() is None:
+                    # the stored token is no longer accepted (or the server is gone)
+                    self.cleanup()
+            return self.session
+
+
+    # replaces the main session by a new one, authenticated with the stored token
+    def reconnect(self):
+        if DEBUG: print('MyRods: session dropped, reconnecting')
+        session = self._connect(None)
+        if session is None:
+            return None
+        old, self.session = self.session, session
+        self.session_checked = time.time()
+        self.session_broken = False
+        if old is not None:
+            self.discard(old)
+        return session
+
+
+    # borrows a session from the pool, opens a new one if none is idle
+    # returns None if no authenticated session could be opened
+    def acquire(self):
+        while True:
+            with self.pool_lock:
+                if len(self.pool) == 0:
+                    break
+                session, used = self.pool.pop()
+            if time.time() - used < HEALTH_CHECK_AGE or self.healthy(session):
+                metrics.count('sessions_reused')
+                return session
+            self.discard(session)
+        return self.open_session()
+
+
+    def release(self, session):
+        with self.pool_lock:
+            if len(self.pool) < max(MAX_IDLE, self.pool_size):
+                self.pool.append((session, time.time()))
+                return
+        self.discard(session)
+
+
+    def discard(self, session):
+        try:
+            session.cleanup()
+        except:
+            pass
+
+
+    # true if the session can still run a query
+    def healthy(self, session):
+        from irods.models import Resource
+        try:
+            with metrics.call('health_check'):
+                session.query(Resource.id).first()
+        except:
+            metrics.count('health_checks_failed')
+            return False
+        return True
+
+
     def _connect(self, password):
-        ssl_context = ssl.create_default_context(
-                purpose=ssl.Purpose.SERVER_AUTH,
-                cafile=None, capath=None, cadata = None)
-        ssl_settings = {'ssl_context' : ssl_context }
+        from irods.models import Resource
+        from irods.session import iRODSSession
+        session = None
+        if self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context(
+                    purpose=ssl.Purpose.SERVER_AUTH,
+                    cafile=None, capath=None, cadata = None)
+        ssl_settings = {'ssl_context' : self.ssl_context }
         try:
             if password != None:
                 # connect with password specified
@@ -129,7 +258,8 @@ class MyRodsConnection():
             if DEBUG: print('MyRods: testing access')
             query = session.query(Resource)
         except:
-            self.cleanup()   # cleanup unauthenticated connection
+            if session is not None:
+                session.cleanup()   # cleanup unauthenticated connection
             return None
         return session
 
@@ -138,6 +268,68 @@ class MyRodsConnection():
 
     # PRIVATE METHODS
 
+    # starts the thread that fills the pool and keeps the sessions alive
+    def start_keepalive(self):
+        self.session_checked = time.time()
+        if self.pool_size <= 0 or self.keepalive is not None:
+            return
+        self.stop_keepalive = threading.Event()
+        self.keepalive = threading.Thread(target = self.run_keepalive,
+                args = (self.stop_keepalive,), daemon = True)
+        self.keepalive.start()
+
+
+    def run_keepalive(self, stop):
+        while not stop.is_set():
+            self.fill_pool(stop)
+            if stop.wait(KEEPALIVE_INTERVAL):
+                break
+            self.check_main_session()
+            self.check_idle_sessions()
+
+
+    # opens sessions until pool_size sessions are idle
+    def fill_pool(self, stop):
+        while not stop.is_set():
+            with self.pool_lock:
+                if len(self.pool) >= self.pool_size:
+                    return
+            session = self.open_session()
+            if session is None:
+                return
+            # a query makes the session connect and authenticate
+            if not self.healthy(session):
+                self.discard(session)
+                return
+            if stop.is_set():
+                self.discard(session)
+                return
+            self.release(session)
+
+
+    # keeps the main session alive, flags it if it is broken
+    # (called by the keepalive thread, the session is left to its owner)
+    def check_main_session(self):
+        with self.session_lock:
+            session = self.session
+            if session is None or self.session_broken:
+                return
+            if self.healthy(session):
+                self.session_checked = time.time()
+            else:
+                self.session_broken = True
+
+
+    def check_idle_sessions(self):
+        with self.pool_lock:
+            pool, self.pool = self.pool, []
+        for session, used in pool:
+            if self.healthy(session):
+                self.release(session)
+            else:
+                self.discard(session)
+
+
     def update_irods_environment_file(self, username, env):
         stored = self.get_irods_environment()
         if env == None:
@@ -183,14 +375,16 @@ class MyRodsConnection():
         try:
             with open (os.path.expanduser(IRODS_TOKEN_FILE), 'r') as f:
                 data = f.read()
-            return irods.password_obfuscation.decode(data)
+            from irods import password_obfuscation
+            return password_obfuscation.decode(data)
         except IOError:
             return None
 
 
     def save_irods_token(self, token):
         if DEBUG: print('MyRods: saving token')
-        data = irods.password_obfuscation.encode(token)
+        from irods import password_obfuscation
+        data = password_obfuscation.encode(token)
         try:
             with open (os.path.expanduser(IRODS_TOKEN_FILE), 'w') as f:
                 f.write(data)
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# A Gtk dialog box that shows the plan of a synchronization before it starts
+#
+# The plan is computed in a background thread by calling make_plan(), which
+# must return a plan summary (see SyncPlan.summary). Meanwhile a spinner is
+# shown. The user confirms the synchronization with the Run button, which is
+# only available if there are files to transfer or if watch is true (the sync
+# keeps uploading changes made later on).
+#
+
+import threading
+import gi
+from gi.repository import Gtk, GLib
+from Formatting import format_size, format_duration
+
+
+class PlanDialog(Gtk.Dialog):
+    def __init__(self, parent, make_plan, watch=False):
+        Gtk.Dialog.__init__(self, 'Synchronization plan', parent, 0,
+            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+            'Run', Gtk.ResponseType.OK))
+        self.closed = False
+        self.watch = watch
+        self.connect('destroy', self.on_destroy)
+        self.set_response_sensitive(Gtk.ResponseType.OK, False)
+
+        box = self.get_content_area()
+        status = Gtk.Box(spacing = 5)
+        self.spinner = Gtk.Spinner()
+        self.spinner.start()
+        self.status_label = Gtk.Label()
+        self.status_label.set_text('Comparing folders...')
+        status.add(self.spinner)
+        status.add(self.status_label)
+        box.add(status)
+        self.summary_label = Gtk.Label()
+        self.summary_label.set_halign(Gtk.Align.START)
+        box.add(self.summary_label)
+        self.show_all()
+
+        thread = threading.Thread(target = self.compute, args = (make_plan,),
+                daemon = True)
+        thread.start()
+
+
+    # PRIVATE METHODS
+
+    def compute(self, make_plan):
+        try:
+            summary = make_plan()
+            error = None
+        except Exception as e:
+            summary = None
+            error = str(e)
+        GLib.idle_add(self.show_summary, summary, error)
+
+
+    def show_summary(self, summary, error):
+        if self.closed:
+            return False
+        self.spinner.stop()
+        if summary is None:
+            self.status_label.set_text('Could not compare folders: ' + error)
+            return False
+        upload = summary['direction'] == 'upload'
+        self.status_label.set_markup('<b>{}</b>: {} new, {} changed, {} unchanged files'.format(
+            'Upload' if upload else 'Download',
+            summary['new'], summary['changed'], summary['unchanged']))
+        lines = [
+            'Data to {}: {} in {} files'.format('send' if upload else 'receive',
+                format_size(summary['bytes']), summary['files'])
+            ]
+        if summary['estimated_seconds'] is not None:
+            lines.append('Estimated duration: ' + 
+                    format_duration(summary['estimated_seconds']))
+        if len(summary['largest']) > 0:
+            lines.append('Largest files:')
+            for relpath, size in summary['largest']:
+                lines.append('    {}  {}'.format(format_size(size), relpath))
+        self.summary_label.set_text('\n'.join(lines))
+        self.set_response_sensitive(Gtk.ResponseType.OK,
+                self.watch or summary['files'] > 0)
+        return False
+
+
+    def on_destroy(self, widget):
+        self.closed = True
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# QueueWindow shows the jobs of the JobQueue and lets the user cancel queued
+# jobs, change their priority and remove finished jobs from the queue
+#
+# The view is refreshed every REFRESH_INTERVAL ms, as jobs may also be
+# submitted or started by other processes.
+#
+
+import time
+import gi
+from gi.repository import Gtk, GLib
+from JobQueue import QUEUED
+
+REFRESH_INTERVAL = 2000
+
+# list store columns
+COL_ID = 0
+COL_PRIORITY = 1
+COL_STATE = 2
+COL_WORKERS = 3
+COL_SUBMITTED = 4
+COL_JOB = 5
+
+
+class QueueWindow(Gtk.Window):
+    def __init__(self, queue, scheduler=None):
+        super().__init__()
+        self.queue = queue
+        # the scheduler is triggered after changes to the queue
+        self.scheduler = scheduler
+        self.props.title = 'Sync jobs'
+        self.setup()
+
+    def setup(self):
+        self.set_default_size(700, 300)
+        self.set_destroy_with_parent(True)
+
+        self.store = Gtk.ListStore(int, int, str, int, str, str)
+        self.view = Gtk.TreeView(model = self.store)
+        for title, column in (('#', COL_ID), ('priority', COL_PRIORITY),
+                ('state', COL_STATE), ('connections', COL_WORKERS),
+                ('submitted', COL_SUBMITTED), ('job', COL_JOB)):
+            self.view.append_column(Gtk.TreeViewColumn(title,
+                    Gtk.CellRendererText(), text = column))
+        self.view.get_selection().connect('changed', self.on_selection_changed)
+        scroll = Gtk.ScrolledWindow()
+        scroll.set_vexpand(True)
+        scroll.add(self.view)
+
+        buttons = Gtk.Box(spacing = 5)
+        self.raise_button = self.add_button(buttons, 'Raise priority',
+                self.on_priority_clicked, 1)
+        self.lower_button = self.add_button(buttons, 'Lower priority',
+                self.on_priority_clicked, -1)
+        self.cancel_button = self.add_button(buttons, 'Cancel job',
+                self.on_cancel_clicked)
+        self.add_button(buttons, 'Remove finished', self.on_purge_clicked)
+
+        box = Gtk.Box(orientation = Gtk.Orientation.VERTICAL, spacing = 5)
+        box.add(scroll)
+        box.add(buttons)
+        self.add(box)
+        self.refresh()
+        self.on_selection_changed(self.view.get_selection())
+        self.show_all()
+        self.timeout_id = GLib.timeout_add(REFRESH_INTERVAL, self.refresh)
+        self.connect('destroy', self.on_destroy)
+
+    def add_button(self, box, label, handler, *args):
+        button = Gtk.Button(label = label)
+        button.connect('clicked', handler, *args)
+        box.add(button)
+        return button
+
+    def refresh(self):
+        selected = self.selected_job()
+        self.store.clear()
+        for job in self.queue.jobs():
+            connections = job.connections
+            if connections == 0:
+                connections = job.connections_for(job.workers)
+            self.store.append([job.id, job.priority, job.state, connections,
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(job.submitted)),
+                    job.describe()])
+        if selected is not None:
+            for row in self.store:
+                if row[COL_ID] == selected:
+                    self.view.get_selection().select_iter(row.iter)
+        return True
+
+    # returns the id of the selected job, or None
+    def selected_job(self):
+        model, iter = self.view.get_selection().get_selected()
+        if iter is None:
+            return None
+        return model[iter][COL_ID]
+
+    def on_selection_changed(self, selection):
+        model, iter = selection.get_selected()
+        queued = iter is not None and model[iter][COL_STATE] == QUEUED
+        self.raise_button.set_sensitive(queued)
+        self.lower_button.set_sensitive(queued)
+        self.cancel_button.set_sensitive(queued)
+
+    def on_priority_clicked(self, widget, change):
+        model, iter = self.view.get_selection().get_selected()
+        if iter is None:
+            return
+        self.queue.set_priority(model[iter][COL_ID], model[iter][COL_PRIORITY] + change)
+        self.refresh()
+
+    def on_cancel_clicked(self, widget):
+        job_id = self.selected_job()
+        if job_id is not None:
+            self.queue.cancel(job_id)
+            self.changed()
+
+    def on_purge_clicked(self, widget):
+        self.queue.purge()
+        self.changed()
+
+    def changed(self):
+        if self.scheduler is not None:
+            self.scheduler.schedule()
+        self.refresh()
+
+    def on_destroy(self, widget):
+        GLib.source_remove(self.timeout_id)
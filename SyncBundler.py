@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# SyncBundler packs many small files into tar bundles, so that an upload of
+# a folder with many tiny files needs one data object per bundle instead of
+# one per file
+#
+# Bundles are stored in the collection BUNDLE_COLLECTION below the remote root
+# of the sync pair. Each bundle <name>.tar is uploaded with an index object
+# <name>.json:
+#   { "bundles": { "<name>.tar": [ [relpath, offset, size, mtime], ... ] } }
+# where offset is the position of the member data within the tar file. The
+# index is written after the bundle, so a bundle without index is ignored.
+# Using the indexes, the members of all bundles can be listed, and a single
+# member can be read from its bundle without extracting the bundle.
+#
+# Reading the indexes takes a round trip per index object. After an upload,
+# compact_bundles() therefore merges all indexes into one index of the
+# members that are still current, and removes the bundles of which all
+# members have been superseded (e.g. uploaded again as individual files).
+#
+
+import os
+import json
+import time
+import tarfile
+import tempfile
+import itertools
+import threading
+from irods.models import Collection, DataObject
+from SyncMetrics import metrics
+
+# files smaller than this (bytes) are bundled
+SMALL_FILE_SIZE = 64 * 1024
+# target size of a bundle (bytes)
+BUNDLE_SIZE = 64 * 1024 * 1024
+BUNDLE_COLLECTION = '.myrods-bundles'
+BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class Bundle():
+    def __init__(self, name):
+        self.name = name
+        # the members are SyncItems
+        self.members = []
+        self.size = 0
+        self.error = None
+        # (for reporting)
+        self.relpath = BUNDLE_COLLECTION + '/' + name + '.tar'
+
+
+class SyncBundler():
+    def __init__(self, small_file_size=SMALL_FILE_SIZE, bundle_size=BUNDLE_SIZE):
+        self.small_file_size = small_file_size
+        self.bundle_size = bundle_size
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+
+    def applies_to(self, size):
+        return size < self.small_file_size
+
+
+    # groups items (SyncItems of small local files) into bundles
+    def make_bundles(self, items):
+        bundles = []
+        bundle = None
+        for item in items:
+            if bundle is None or bundle.size + item.local.size > self.bundle_size:
+                bundle = Bundle(self.new_name())
+                bundles.append(bundle)
+            bundle.members.append(item)
+            bundle.size += item.local.size
+        return bundles
+
+
+    # packs the members of a bundle into a tar file and uploads it with its index
+    # local_root is the folder that holds the members
+    def upload(self, session, bundle, local_root, remote_root):
+        collection = remote_root + '/' + BUNDLE_COLLECTION
+        members = []
+        with tempfile.NamedTemporaryFile(suffix = '.tar') as temp:
+            with tarfile.open(fileobj = temp, mode = 'w') as tar:
+                for item in bundle.members:
+                    path = os.path.join(local_root, *item.relpath.split('/'))
+                    info = tar.gettarinfo(path, arcname = item.relpath)
+                    # member data follows its header
+                    header = info.tobuf(tar.format, tar.encoding, tar.errors)
+                    offset = tar.offset + len(header)
+                    with open(path, 'rb') as f:
+                        tar.addfile(info, f)
+                    members.append([item.relpath, offset, info.size,
+                                    int(info.mtime)])
+            temp.flush()
+            try:
+                session.collections.create(collection)
+            except:
+                # collection exists already
+                pass
+            with metrics.call('put'):
+                session.data_objects.put(temp.name, collection + '/' + bundle.name + '.tar')
+        write_index(session, collection + '/' + bundle.name + '.json',
+                { bundle.name + '.tar': members })
+
+
+    # PRIVATE METHODS
+
+    def new_name(self):
+        with self.lock:
+            number = next(self.counter)
+        return 'bundle-{:x}-{}'.format(int(time.time() * 1000), number)
+
+
+# reads the indexes below a remote root, returns (bundles, indexes) where
+# bundles is a dict { bundle path : [ [relpath, offset, size, mtime], ... ] }
+# and indexes is a list of the paths of the index objects that were read
+def read_indexes(session, remote_root):
+    collection = remote_root + '/' + BUNDLE_COLLECTION
+    bundles = {}
+    indexes = []
+    query = session.query(DataObject.name).filter(Collection.name == collection)
+    for result_set in query.get_batches():
+        for row in result_set:
+            name = row[DataObject.name]
+            if not name.endswith('.json'):
+                continue
+            path = collection + '/' + name
+            try:
+                with metrics.call('open'):
+                    with session.data_objects.open(path, 'r') as f:
+                        index = json.loads(f.read().decode('utf-8'))
+            except:
+                # unreadable index (or just removed by a compaction), ignore it
+                continue
+            indexes.append(path)
+            for bundle_name, members in index['bundles'].items():
+                bundles.setdefault(collection + '/' + bundle_name, []).extend(members)
+    return bundles, indexes
+
+
+# returns a dict { relpath : (bundle path, offset, size, mtime) } with the
+# members of bundles as returned by read_indexes, the most recent copy of a
+# member wins
+def bundled_files(bundles):
+    members = {}
+    for bundle_path, bundle_members in bundles.items():
+        for relpath, offset, size, mtime in bundle_members:
+            if relpath in members and members[relpath][3] > mtime:
+                continue
+            members[relpath] = (bundle_path, offset, size, mtime)
+    return members
+
+
+# replaces the indexes that have been read by a single index of the live
+# members and removes the bundles without live members, unless there is just
+# one index without superseded members. live is a set of (bundle path,
+# relpath) of the members that are the current copy of their file.
+def compact_bundles(session, remote_root, bundles, indexes, live):
+    kept = {}
+    superseded = 0
+    for bundle_path, members in bundles.items():
+        current = [ member for member in members
+                    if (bundle_path, member[0]) in live ]
+        superseded += len(members) - len(current)
+        if len(current) > 0:
+            kept[bundle_path.rsplit('/', 1)[1]] = current
+    if len(indexes) <= 1 and superseded == 0:
+        return
+    collection = remote_root + '/' + BUNDLE_COLLECTION
+    if len(kept) > 0:
+        name = 'index-{:x}-{}.json'.format(int(time.time() * 1000), os.getpid())
+        write_index(session, collection + '/' + name, kept)
+    # the new index is in place, the members are no longer listed twice
+    for path in indexes:
+        remove(session, path)
+    for bundle_path in bundles:
+        if bundle_path.rsplit('/', 1)[1] not in kept:
+            remove(session, bundle_path)
+
+
+def write_index(session, path, bundles):
+    with session.data_objects.open(path, 'w') as f:
+        f.write(json.dumps({ 'bundles': bundles }).encode('utf-8'))
+
+
+def remove(session, path):
+    try:
+        with metrics.call('unlink'):
+            session.data_objects.unlink(path, force = True)
+    except:
+        # removed meanwhile by another run
+        pass
+
+
+# copies a bundle member into a local file
+def read_member(session, bundle_path, offset, size, local_path):
+    with session.data_objects.open(bundle_path, 'r') as obj, \
+            open(local_path, 'wb') as f:
+        obj.seek(offset)
+        todo = size
+        while todo > 0:
+            data = obj.read(min(BUFFER_SIZE, todo))
+            if len(data) == 0:
+                raise IOError('unexpected end of ' + bundle_path)
+            f.write(data)
+            todo -= len(data)
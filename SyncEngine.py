@@ -0,0 +1,671 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# SyncEngine synchronizes a local folder with an iRODS collection, using an
+# (authenticated) session of the Python iRODS client
+#
+# A sync run has two stages:
+#   1. plan    : the local tree is scanned with os.scandir, the remote tree is
+#                listed with a few bulk queries. Comparing both results in a
+#                plan in which each file is either new, changed or unchanged.
+#   2. execute : new and changed files are transferred by a TransferScheduler,
+#                using a number of concurrent workers with their own session.
+#                Large files are transferred in chunks over multiple streams
+#                if a ChunkedTransfer is provided. Small files are uploaded in
+#                tar bundles if a SyncBundler is provided. Members of bundles
+#                are listed as remote files and can be downloaded individually.
+#                With an AdaptiveConcurrency, the number of concurrent transfers
+#                follows the observed throughput (up to the number of workers).
+#                With a BandwidthLimiter, the data rate is capped.
+# A file is considered changed if its size differs or if the source copy has
+# been modified after the destination copy.
+#
+# If a SyncManifest is provided, the state of each file is recorded after it
+# has been transferred or found unchanged. An upload of which all local files
+# and folders match the manifest is planned without listing the remote tree.
+# The manifest also journals the completed chunks of large files, so that an
+# interrupted chunked transfer resumes with the chunks that are still missing.
+#
+# In watch mode, an initial sync is followed by uploads of the files that a
+# FolderWatcher reports as changed, planned without listing the remote tree.
+#
+# The engine reports its progress via a callback  report(event, item)
+# where event is one of the EVENT_* values and item a SyncItem. For files that
+# are transferred in chunks, EVENT_CHUNK is reported for each chunk as well.
+#
+# print_plan and print_event print the plan and the progress on stdout,
+# as used by the command line mode (see HeadlessSync).
+#
+
+import os
+import calendar
+from irods.column import Like
+from irods.models import Collection, DataObject
+import irods.keywords as kw
+from Checksum import local_checksum
+from SyncMetrics import metrics
+from FolderWatcher import FolderWatcher
+from Formatting import format_size, format_duration
+from SyncBundler import BUNDLE_COLLECTION, read_indexes, bundled_files, \
+        compact_bundles, read_member
+from ChunkedTransfer import PARTIAL_SUFFIX, partial_path
+from TransferScheduler import TransferScheduler, DEFAULT_WORKERS, \
+        EVENT_DONE, EVENT_FAILED
+
+# synctypes: 0 = upload (to iRODS)  1 = download (from iRODS)
+UPLOAD = 0
+DOWNLOAD = 1
+
+# status of a file in a plan
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+# event reported for each chunk of a file that is transferred in chunks
+EVENT_CHUNK = 'chunk'
+
+# modification times closer than this (seconds) are considered equal
+MTIME_TOLERANCE = 2
+
+# number of largest files listed in a plan summary
+LARGEST_FILES = 5
+
+
+class FileInfo():
+    def __init__(self, size, mtime, checksum=None, mtime_ns=None, inode=None,
+            replica_status=None, bundle=None):
+        self.size = size
+        self.mtime = mtime
+        self.checksum = checksum
+        # local files only
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        # remote files only
+        self.replica_status = replica_status
+        # (bundle path, offset) for files that are stored in a bundle
+        self.bundle = bundle
+
+
+class SyncItem():
+    def __init__(self, relpath, status, local=None, remote=None):
+        # relpath uses '/' as separator, relative to the synchronized folders
+        self.relpath = relpath
+        self.status = status
+        self.local = local
+        self.remote = remote
+        self.error = None
+        # (offset, length) of the last transferred chunk, see EVENT_CHUNK
+        self.chunk = None
+
+    # size of the source copy, the amount of data to transfer
+    def size(self, direction):
+        source = self.local if direction == UPLOAD else self.remote
+        return source.size if source is not None else 0
+
+
+class SyncPlan():
+    def __init__(self, direction, local_root, remote_root):
+        self.direction = direction
+        self.local_root = local_root
+        self.remote_root = remote_root
+        self.items = []
+        # relative paths of (sub)folders that must be created at the destination
+        self.folders = []
+
+    def transfers(self):
+        return [ item for item in self.items if item.status != UNCHANGED ]
+
+    def count(self, status):
+        return len([ item for item in self.items if item.status == status ])
+
+    def transfer_size(self):
+        return sum([ item.size(self.direction) for item in self.transfers() ])
+
+    # returns the transfers with the largest amount of data, largest first
+    def largest(self, count=LARGEST_FILES):
+        transfers = sorted(self.transfers(), 
+                key = lambda item: item.size(self.direction), reverse = True)
+        return transfers[:count]
+
+    # returns a dict that summarizes the plan, estimated duration is in seconds
+    def summary(self, history=None):
+        transfers = self.transfers()
+        size = self.transfer_size()
+        estimate = None
+        if history is not None:
+            estimate = history.estimate(self.direction, len(transfers), size)
+        return {
+            'direction' : 'upload' if self.direction == UPLOAD else 'download',
+            'local'     : self.local_root,
+            'remote'    : self.remote_root,
+            'new'       : self.count(NEW),
+            'changed'   : self.count(CHANGED),
+            'unchanged' : self.count(UNCHANGED),
+            'files'     : len(transfers),
+            'bytes'     : size,
+            'largest'   : [ [item.relpath, item.size(self.direction)] 
+                            for item in self.largest() ],
+            'estimated_seconds' : estimate
+            }
+
+
+class SyncEngine():
+    # connection is a (connected) MyRodsConnection, session the session to
+    # plan with (by default the main session of the connection)
+    def __init__(self, connection, local_root, remote_root, direction, 
+            report=None, workers=DEFAULT_WORKERS, manifest=None, full_check=False,
+            chunked=None, bundler=None, concurrency=None, limiter=None,
+            session=None):
+        self.connection = connection
+        self.chunked = chunked
+        self.bundler = bundler
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.session = session if session is not None else connection.session
+        self.workers = workers
+        self.manifest = manifest
+        self.full_check = full_check
+        self.local_root = os.path.abspath(local_root)
+        self.remote_root = remote_root.rstrip('/')
+        self.direction = direction
+        self.report = report
+        self.watcher = None
+        # (bundles, indexes, live members) as listed, see compact_bundles
+        self.bundle_state = None
+
+
+    # record is false to leave the manifest as it is, e.g. for a preview of
+    # a sync that is run by another process
+    def plan(self, record=True):
+        with metrics.timer('scan'):
+            local_files, local_dirs = self.scan_local()
+        entries = {}
+        if self.manifest is not None:
+            entries = self.manifest.entries()
+            if (self.direction == UPLOAD and not self.full_check and
+                    self.matches_manifest(local_files, local_dirs, entries)):
+                # nothing changed since last sync
+                plan = SyncPlan(self.direction, self.local_root, self.remote_root)
+                plan.items = [ SyncItem(relpath, UNCHANGED, local_files[relpath])
+                               for relpath in sorted(local_files) ]
+                return plan
+        with metrics.timer('list'):
+            remote_files, remote_colls = self.list_remote()
+        if self.direction == UPLOAD:
+            source, destination = local_files, remote_files
+            source_dirs, destination_dirs = local_dirs, remote_colls
+        else:
+            source, destination = remote_files, local_files
+            source_dirs, destination_dirs = remote_colls, local_dirs
+
+        # files of which a chunked transfer was interrupted are incomplete
+        # at the destination, whatever their size and mtime
+        pending = set()
+        if self.manifest is not None:
+            pending = self.manifest.pending_chunks()
+        plan = SyncPlan(self.direction, self.local_root, self.remote_root)
+        plan.folders = sorted(source_dirs - destination_dirs)
+        for relpath in sorted(source):
+            if relpath not in destination:
+                status = NEW
+            elif (relpath in pending or
+                    self.is_changed(source[relpath], destination[relpath])):
+                status = CHANGED
+            else:
+                status = UNCHANGED
+            plan.items.append(SyncItem(relpath, status,
+                local_files.get(relpath), remote_files.get(relpath)))
+        if self.manifest is not None and record:
+            self.update_manifest(plan, entries, source, source_dirs & destination_dirs)
+        return plan
+
+
+    # plans the upload of a set of changed local files, e.g. as reported 
+    # by a FolderWatcher, without listing the remote tree
+    def plan_paths(self, relpaths):
+        plan = SyncPlan(self.direction, self.local_root, self.remote_root)
+        folders = set()
+        for relpath in sorted(relpaths):
+            try:
+                info = local_info(os.stat(self.local_path(relpath)))
+            except OSError:
+                # file has been removed meanwhile
+                continue
+            status = CHANGED
+            if self.manifest is not None:
+                entry = self.manifest.get(relpath)
+                if entry is not None and entry.matches_local(info) and entry.in_sync():
+                    status = UNCHANGED
+            plan.items.append(SyncItem(relpath, status, info))
+            parts = relpath.split('/')[:-1]
+            for i in range(len(parts)):
+                folders.add('/'.join(parts[:i + 1]))
+        if self.manifest is not None:
+            folders = [ folder for folder in folders 
+                        if self.manifest.get(folder + '/') is None ]
+        plan.folders = sorted(folders)
+        return plan
+
+
+    # starts watching the local folder, call before the initial sync so that
+    # files that change during that sync are uploaded by watch() as well
+    def start_watching(self):
+        self.watcher = FolderWatcher(self.local_root)
+        self.watcher.start()
+
+
+    # uploads changes in the local folder as they happen, never returns
+    def watch(self):
+        if self.watcher is None:
+            self.start_watching()
+        for relpaths in self.watcher.changes():
+            plan = self.plan_paths(relpaths)
+            if len(plan.transfers()) > 0:
+                print_plan(plan)
+                self.execute(plan)
+
+
+    def execute(self, plan):
+        self.create_folders([''] + plan.folders)
+        transfers = plan.transfers()
+        bundles = []
+        if self.bundler is not None and self.direction == UPLOAD:
+            small = [ item for item in transfers 
+                      if self.bundler.applies_to(item.local.size) ]
+            if len(small) > 1:
+                bundles = self.bundler.make_bundles(small)
+                transfers = [ item for item in transfers 
+                              if not self.bundler.applies_to(item.local.size) ]
+        scheduler = TransferScheduler(self.connection, self.transfer,
+                workers = self.workers, report = self.report,
+                concurrency = self.concurrency,
+                size = lambda item: item.size(self.direction),
+                credited = lambda item: (item.size(self.direction)
+                                         if self.in_chunks(item) else 0))
+        failed = scheduler.run(transfers)
+        if len(bundles) > 0:
+            scheduler = TransferScheduler(self.connection, self.transfer_bundle,
+                    workers = self.workers, report = self.report_bundle,
+                    concurrency = self.concurrency,
+                    size = lambda bundle: bundle.size)
+            failed.extend(scheduler.run(bundles))
+        if self.direction == UPLOAD and self.bundle_state is not None:
+            self.compact_bundles()
+        return len(failed) == 0
+
+
+    # uploads a bundle of small files (called by worker threads)
+    def transfer_bundle(self, session, bundle):
+        if self.limiter is not None:
+            self.limiter.consume(bundle.size)
+        self.bundler.upload(session, bundle, self.local_root, self.remote_root)
+        metrics.count('files_transferred', len(bundle.members))
+        metrics.count('bytes_transferred', sum([ item.local.size
+                                                 for item in bundle.members ]))
+        if self.manifest is not None:
+            for item in bundle.members:
+                self.manifest.record(item.relpath, item.local,
+                        FileInfo(item.local.size, None))
+
+
+    # reports the events of a bundle as events of its members
+    def report_bundle(self, event, bundle):
+        if self.report is None:
+            return
+        for item in bundle.members:
+            item.error = bundle.error
+            self.report(event, item)
+
+
+    # true if the file is transferred in chunks (by the ChunkedTransfer, which
+    # also reports the progress of each buffer to the concurrency)
+    def in_chunks(self, item):
+        return (self.chunked is not None and
+                self.chunked.applies_to(item.size(self.direction)) and
+                (self.direction == UPLOAD or item.remote.bundle is None))
+
+
+    # transfers a file using the given session (called by worker threads)
+    def transfer(self, session, item):
+        local_path = self.local_path(item.relpath)
+        remote_path = self.remote_path(item.relpath)
+        size = item.size(self.direction)
+        chunked = self.in_chunks(item)
+        if chunked:
+            # (the chunks are throttled by the ChunkedTransfer itself)
+            self.transfer_chunked(session, item, local_path, remote_path, size)
+        elif self.limiter is not None:
+            self.limiter.consume(size)
+        if self.direction == UPLOAD:
+            if not chunked:
+                with metrics.call('put'):
+                    session.data_objects.put(local_path, remote_path,
+                            **{kw.FORCE_FLAG_KW: ''})
+            if self.manifest is not None:
+                # the remote mtime is unknown, but that only matters for downloads
+                self.manifest.record(item.relpath, item.local,
+                        FileInfo(item.local.size, None))
+        else:
+            if item.remote.bundle is not None:
+                bundle_path, offset = item.remote.bundle
+                read_member(session, bundle_path, offset, size, local_path)
+            elif not chunked:
+                with metrics.call('get'):
+                    session.data_objects.get(remote_path, local_path,
+                            **{kw.FORCE_FLAG_KW: ''})
+            # preserve modification time, so the file is unchanged next time
+            os.utime(local_path, (item.remote.mtime, item.remote.mtime))
+            if self.manifest is not None:
+                self.manifest.record(item.relpath, 
+                        local_info(os.stat(local_path)), item.remote)
+        metrics.count('files_transferred')
+        metrics.count('bytes_transferred', size)
+
+
+    # transfers a large file in chunks, skips chunks that have been
+    # transferred by a previous (interrupted) run
+    def transfer_chunked(self, session, item, local_path, remote_path, size):
+        chunks = self.chunked.chunks(size)
+        report = self.chunk_reporter(item)
+        if self.manifest is None:
+            self.chunked_copy(session, local_path, remote_path, size, chunks,
+                    report)
+            return
+        signature = self.signature(item)
+        completed = self.manifest.completed_chunks(item.relpath, signature)
+        if len(completed) > 0 and not self.holds_chunk(session, local_path, 
+                remote_path, completed[-1]):
+            # the destination does not hold what the journal says, start over
+            self.manifest.forget_chunks(item.relpath)
+            completed = []
+        offsets = set([ offset for offset, length, checksum in completed ])
+        missing = [ chunk for chunk in chunks if chunk[0] not in offsets ]
+        def done(offset, length, checksum):
+            self.manifest.record_chunk(item.relpath, signature, offset, length,
+                    checksum)
+            report(offset, length, checksum)
+        try:
+            self.chunked_copy(session, local_path, remote_path, size, missing,
+                    done, len(completed) > 0)
+        except:
+            if len(completed) > 0:
+                # do not attempt to resume again, a retry starts over
+                self.manifest.forget_chunks(item.relpath)
+            raise
+        self.manifest.forget_chunks(item.relpath)
+
+
+    def chunked_copy(self, session, local_path, remote_path, size, chunks,
+            done=None, resume=False):
+        if self.direction == UPLOAD:
+            self.chunked.upload(session, local_path, remote_path, size, chunks,
+                    done, resume)
+        else:
+            self.chunked.download(session, remote_path, local_path, size, chunks,
+                    done)
+
+
+    # returns a callback for ChunkedTransfer that reports each chunk of an item
+    def chunk_reporter(self, item):
+        def done(offset, length, checksum):
+            if self.report is not None:
+                item.chunk = (offset, length)
+                self.report(EVENT_CHUNK, item)
+        return done
+
+
+    # identifies the content of the source copy of a file
+    def signature(self, item):
+        if self.direction == UPLOAD:
+            return '{}:{}'.format(item.local.size, item.local.mtime_ns)
+        return '{}:{}:{}'.format(item.remote.size, item.remote.mtime,
+                item.remote.checksum)
+
+
+    # checks that the destination holds a transferred chunk, by its checksum
+    def holds_chunk(self, session, local_path, remote_path, chunk):
+        offset, length, checksum = chunk
+        try:
+            if self.direction == UPLOAD:
+                found = self.chunked.remote_chunk_checksum(session, remote_path,
+                        offset, length)
+            else:
+                found = local_checksum(partial_path(local_path), None, offset,
+                        length)
+        except:
+            return False
+        return found == checksum
+
+
+    # returns (files, dirs) where files is a dict { relpath : FileInfo }
+    # and dirs a set of relpaths of all subdirectories
+    def scan_local(self):
+        files = {}
+        dirs = set()
+        if not os.path.isdir(self.local_root):
+            return files, dirs
+        todo = ['']
+        while len(todo) > 0:
+            reldir = todo.pop()
+            try:
+                entries = list(os.scandir(self.local_path(reldir)))
+            except OSError:
+                # unreadable directory, skip it
+                continue
+            for entry in entries:
+                relpath = entry.name if reldir == '' else reldir + '/' + entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.add(relpath)
+                        todo.append(relpath)
+                    elif entry.is_file() and not entry.name.endswith(PARTIAL_SUFFIX):
+                        # (skips the partial files of chunked downloads)
+                        files[relpath] = local_info(entry.stat())
+                except OSError:
+                    continue
+        return files, dirs
+
+
+    # returns (files, collections) where files is a dict { relpath : FileInfo }
+    # and collections a set of relpaths of all subcollections
+    def list_remote(self):
+        files = {}
+        colls = set()
+        prefix = len(self.remote_root) + 1
+        columns = (Collection.name, DataObject.name, DataObject.size,
+                DataObject.modify_time, DataObject.checksum, 
+                DataObject.replica_status)
+        # one query for the data objects in the collection itself,
+        # and one for all data objects in its subcollections
+        # (LIKE treats '_' and '%' in the root as wildcards, so rows of
+        # sibling collections that happen to match are dropped)
+        queries = [
+            self.session.query(*columns).filter(
+                Collection.name == self.remote_root),
+            self.session.query(*columns).filter(
+                Like(Collection.name, self.remote_root + '/%')),
+            ]
+        for query in queries:
+            for result_set in metrics.calls('query', query.get_batches()):
+                for row in result_set:
+                    if not self.in_tree(row[Collection.name]):
+                        continue
+                    relpath = (row[Collection.name] + '/' + row[DataObject.name])[prefix:]
+                    if relpath.startswith(BUNDLE_COLLECTION + '/'):
+                        continue
+                    info = FileInfo(
+                            row[DataObject.size],
+                            epoch(row[DataObject.modify_time]),
+                            row[DataObject.checksum],
+                            replica_status = row[DataObject.replica_status])
+                    # of several replicas of a data object, keep the best one
+                    if relpath not in files or better_replica(info, files[relpath]):
+                        files[relpath] = info
+        query = self.session.query(Collection.name).filter(
+                Like(Collection.name, self.remote_root + '/%'))
+        for result_set in metrics.calls('query', query.get_batches()):
+            for row in result_set:
+                if self.in_tree(row[Collection.name]):
+                    colls.add(row[Collection.name][prefix:])
+        if BUNDLE_COLLECTION in colls:
+            colls.discard(BUNDLE_COLLECTION)
+            self.add_bundled_files(files, colls)
+        return files, colls
+
+
+    # adds the members of bundles to the remote files, unless a more recent
+    # copy has been stored as an individual data object
+    def add_bundled_files(self, files, colls):
+        bundles, indexes = read_indexes(self.session, self.remote_root)
+        live = set()
+        for relpath, (bundle_path, offset, size, mtime) in bundled_files(bundles).items():
+            if relpath in files and files[relpath].mtime >= mtime:
+                continue
+            live.add((bundle_path, relpath))
+            files[relpath] = FileInfo(size, mtime, bundle = (bundle_path, offset))
+            parts = relpath.split('/')[:-1]
+            for i in range(len(parts)):
+                colls.add('/'.join(parts[:i + 1]))
+        self.bundle_state = (bundles, indexes, live)
+
+
+    # merges the bundle indexes and removes superseded bundles after an upload
+    # (a failure is left to the next run)
+    def compact_bundles(self):
+        bundles, indexes, live = self.bundle_state
+        self.bundle_state = None
+        try:
+            with metrics.timer('compact'):
+                compact_bundles(self.session, self.remote_root, bundles, indexes,
+                        live)
+        except:
+            pass
+
+
+    # PRIVATE METHODS
+
+    # true if a collection is the remote root or one of its subcollections
+    def in_tree(self, coll_path):
+        return (coll_path == self.remote_root or
+                coll_path.startswith(self.remote_root + '/'))
+
+
+    def is_changed(self, source, destination):
+        if source.size != destination.size:
+            return True
+        return source.mtime > destination.mtime + MTIME_TOLERANCE
+
+
+    def create_folders(self, folders):
+        for relpath in folders:
+            if self.direction == UPLOAD:
+                try:
+                    with metrics.call('collection_create'):
+                        self.session.collections.create(self.remote_path(relpath))
+                except:
+                    # collection exists already
+                    pass
+            else:
+                os.makedirs(self.local_path(relpath), exist_ok=True)
+            if self.manifest is not None and relpath != '':
+                self.manifest.record(relpath + '/')
+        if self.manifest is not None:
+            self.manifest.commit()
+
+
+    # true if all local files and folders were in sync at the previous run
+    # (folders are recorded in the manifest with a trailing '/')
+    def matches_manifest(self, local_files, local_dirs, entries):
+        for relpath in local_dirs:
+            if relpath + '/' not in entries:
+                return False
+        for relpath, info in local_files.items():
+            entry = entries.get(relpath)
+            if entry is None or not entry.matches_local(info) or not entry.in_sync():
+                return False
+        return True
+
+
+    # records unchanged files and folders that exist on both sides,
+    # forgets files and folders that no longer exist at the source
+    def update_manifest(self, plan, entries, source, common_dirs):
+        for item in plan.items:
+            if item.status != UNCHANGED:
+                continue
+            entry = entries.get(item.relpath)
+            if (entry is None or not entry.matches_local(item.local) 
+                    or not entry.matches_remote(item.remote)):
+                self.manifest.record(item.relpath, item.local, item.remote)
+        for relpath in common_dirs:
+            if relpath + '/' not in entries:
+                self.manifest.record(relpath + '/')
+        stale = [ relpath for relpath in entries if relpath.endswith('/')
+                  and relpath[:-1] not in common_dirs ]
+        stale.extend([ relpath for relpath in entries if not relpath.endswith('/')
+                       and relpath not in source ])
+        self.manifest.forget(stale)
+        self.manifest.commit()
+
+
+    def local_path(self, relpath):
+        if relpath == '':
+            return self.local_root
+        return os.path.join(self.local_root, *relpath.split('/'))
+
+
+    def remote_path(self, relpath):
+        if relpath == '':
+            return self.remote_root
+        return self.remote_root + '/' + relpath
+
+
+
+def local_info(stat):
+    return FileInfo(stat.st_size, stat.st_mtime, mtime_ns = stat.st_mtime_ns,
+            inode = stat.st_ino)
+
+
+# converts a datetime (in UTC) as returned by the iRODS client to epoch seconds
+def epoch(timestamp):
+    if timestamp is None:
+        return 0
+    return calendar.timegm(timestamp.utctimetuple())
+
+
+# true if a replica is preferable to another replica of the same data object:
+# a good replica (status '1') over a stale one, and one with a checksum
+def better_replica(info, other):
+    good, other_good = info.replica_status == '1', other.replica_status == '1'
+    if good != other_good:
+        return good
+    return info.checksum is not None and other.checksum is None
+
+
+def print_plan(plan, history=None):
+    print('plan: {} new, {} changed, {} unchanged files, {} bytes to transfer'.format(
+        plan.count(NEW), plan.count(CHANGED), plan.count(UNCHANGED),
+        plan.transfer_size()))
+    if history is None:
+        return
+    summary = plan.summary(history)
+    print('{} files, {} to {}'.format(summary['files'], 
+        format_size(summary['bytes']), 
+        'send' if plan.direction == UPLOAD else 'receive'))
+    if len(summary['largest']) > 0:
+        print('largest files:')
+        for relpath, size in summary['largest']:
+            print('  {:>10}  {}'.format(format_size(size), relpath))
+    print('estimated duration: ' + format_duration(summary['estimated_seconds']))
+
+
+def print_event(direction):
+    def report(event, item):
+        if event == EVENT_DONE:
+            print('{} {} {}'.format('put' if direction == UPLOAD else 'get',
+                item.relpath, item.size(direction)))
+        if event == EVENT_CHUNK:
+            print('chunk {} {}'.format(item.relpath, item.chunk[1]))
+        if event == EVENT_FAILED:
+            print('failed {}: {}'.format(item.relpath, item.error))
+    return report
+
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# SyncManifest keeps the state of the files of a sync pair (local folder and
+# remote collection) as it was after the last successful transfer or check
+#
+# The manifest is an SQLite database in the cache directory, one per sync
+# pair, keyed by the path of a file relative to the synchronized folders.
+# For each file it holds the local stat tuple (size, mtime_ns, inode), the
+# local checksum (if known) and the last known remote size, mtime, checksum
+# and replica status. A file of which the local stat tuple and the remote
+# state are unchanged does not need to be examined again.
+#
+# The manifest also serves as checkpoint journal of the chunks of large files
+# that have been transferred. A chunk is recorded with its checksum and the
+# signature of the source file, so a later run can resume the transfer as long
+# as the source has not changed.
+#
+# Updates are buffered and committed at least every COMMIT_INTERVAL seconds.
+# The manifest can be updated from multiple threads.
+#
+
+import time
+import sqlite3
+import hashlib
+import threading
+from CacheDir import cache_path
+
+COMMIT_INTERVAL = 2.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    relpath         TEXT PRIMARY KEY,
+    size            INTEGER,
+    mtime_ns        INTEGER,
+    inode           INTEGER,
+    local_checksum  TEXT,
+    remote_size     INTEGER,
+    remote_mtime    INTEGER,
+    remote_checksum TEXT,
+    replica_status  TEXT
+    );
+CREATE TABLE IF NOT EXISTS chunks (
+    relpath         TEXT,
+    signature       TEXT,
+    offset          INTEGER,
+    length          INTEGER,
+    checksum        TEXT,
+    PRIMARY KEY (relpath, offset)
+    );
+'''
+
+
+class ManifestEntry():
+    def __init__(self, row):
+        (self.relpath, self.size, self.mtime_ns, self.inode, self.local_checksum,
+         self.remote_size, self.remote_mtime, self.remote_checksum,
+         self.replica_status) = row
+
+    # true if the local file has not been touched since it was recorded
+    def matches_local(self, info):
+        return (info.size == self.size and info.mtime_ns == self.mtime_ns
+                and info.inode == self.inode)
+
+    # true if the remote copy has not changed since it was recorded
+    def matches_remote(self, info):
+        return (info.size == self.remote_size and info.mtime == self.remote_mtime
+                and info.checksum == self.remote_checksum)
+
+    # true if the remote copy was in sync with the local file when recorded
+    def in_sync(self):
+        return self.remote_size == self.size
+
+
+class SyncManifest():
+    def __init__(self, local_root, remote_root, db_file=None):
+        if db_file is None:
+            pair = hashlib.sha1((local_root + '\n' + remote_root).encode('utf-8'))
+            db_file = cache_path('manifest', pair.hexdigest() + '.sqlite')
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, check_same_thread = False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        self.last_commit = time.time()
+
+
+    # returns all entries as a dict { relpath : ManifestEntry }
+    def entries(self):
+        with self.lock:
+            rows = self.db.execute('SELECT * FROM files').fetchall()
+        return { row[0]: ManifestEntry(row) for row in rows }
+
+
+    # returns the ManifestEntry of a file, or None if it is unknown
+    def get(self, relpath):
+        with self.lock:
+            row = self.db.execute('SELECT * FROM files WHERE relpath = ?',
+                    (relpath,)).fetchone()
+        return ManifestEntry(row) if row is not None else None
+
+
+    # records the state of a file, local and/or remote is a FileInfo
+    def record(self, relpath, local=None, remote=None, local_checksum=None):
+        row = (relpath,
+               local.size if local else None,
+               local.mtime_ns if local else None,
+               local.inode if local else None,
+               local_checksum,
+               remote.size if remote else None,
+               remote.mtime if remote else None,
+               remote.checksum if remote else None,
+               remote.replica_status if remote else None)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?)',
+                    row)
+            self.commit_if_due()
+
+
+    def forget(self, relpaths):
+        with self.lock:
+            self.db.executemany('DELETE FROM files WHERE relpath = ?',
+                    [ (relpath,) for relpath in relpaths ])
+            self.commit_if_due()
+
+
+    # returns the list of (offset, length, checksum) of the chunks of a file 
+    # that have been transferred, in the order in which they were recorded
+    def completed_chunks(self, relpath, signature):
+        with self.lock:
+            rows = self.db.execute('SELECT offset, length, checksum FROM chunks '
+                    'WHERE relpath = ? AND signature = ? ORDER BY rowid', 
+                    (relpath, signature)).fetchall()
+        return rows
+
+
+    def record_chunk(self, relpath, signature, offset, length, checksum):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO chunks VALUES (?,?,?,?,?)',
+                    (relpath, signature, offset, length, checksum))
+            self.commit_if_due()
+
+
+    # returns the paths of the files of which chunks have been journaled,
+    # i.e. of which a chunked transfer has not completed
+    def pending_chunks(self):
+        with self.lock:
+            rows = self.db.execute('SELECT DISTINCT relpath FROM chunks').fetchall()
+        return set([ row[0] for row in rows ])
+
+
+    def forget_chunks(self, relpath):
+        with self.lock:
+            self.db.execute('DELETE FROM chunks WHERE relpath = ?', (relpath,))
+            self.commit_if_due()
+
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+            self.last_commit = time.time()
+
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+    # PRIVATE METHODS
+
+    def commit_if_due(self):
+        # caller holds the lock
+        if time.time() > self.last_commit + COMMIT_INTERVAL:
+            self.db.commit()
+            self.last_commit = time.time()
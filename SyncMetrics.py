@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# SyncMetrics records where the time of a sync run goes: authentication,
+# listing, scanning, hashing, catalog round trips or data transfer
+#
+#   timers     : seconds and count per phase of the run
+#                    with metrics.timer('plan'): ...
+#   counters   : totals, e.g. metrics.count('bytes_transferred', size)
+#   gauges     : values, e.g. metrics.set('exit_code', code)
+#   histograms : latency of the individual iRODS calls, per kind of call
+#                    with metrics.call('put'): ...
+#                    for batch in metrics.calls('query', query.get_batches()):
+#
+# The module holds a single instance, metrics, that is disabled by default.
+# While disabled, timer() and call() return a shared context manager that
+# does nothing, calls() returns the iterable as is and count() returns right
+# away, so instrumented code runs at (nearly) the same speed.
+#
+# The timers of phases that run in worker threads (e.g. transfer and hash)
+# add up the time of all workers, and may exceed the duration of the run.
+#
+# The recorded metrics can be written as a JSON document and as a text file
+# in the Prometheus exposition format, for the textfile collector of the
+# node exporter. The values are those of a single run, the file is replaced
+# at the end of each run.
+#
+
+import os
+import json
+import time
+import threading
+
+# upper bounds (seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# prefix of the names of the exported Prometheus metrics
+PROMETHEUS_PREFIX = 'myrods_sync_'
+
+
+class SyncMetrics():
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def enable(self):
+        self.enabled = True
+
+
+    def reset(self):
+        self.started = time.time()
+        # phase -> [count, seconds]
+        self.timers = {}
+        self.counters = {}
+        self.gauges = {}
+        # call -> [bucket counts..., count of larger values], count and sum
+        self.histograms = {}
+
+
+    # returns a context manager that adds its duration to the timer of a phase
+    def timer(self, phase):
+        if not self.enabled:
+            return NO_TIMER
+        return Timer(self.add_time, phase)
+
+
+    # returns a context manager that records the latency of an iRODS call
+    def call(self, name):
+        if not self.enabled:
+            return NO_TIMER
+        return Timer(self.observe, name)
+
+
+    # wraps an iterable of which each next() is an iRODS call (e.g. the pages
+    # of a query result), the latency of each call is recorded
+    def calls(self, name, iterable):
+        if not self.enabled:
+            return iterable
+        return self.timed_calls(name, iterable)
+
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def set(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(phase, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = { 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                              'count': 0, 'sum': 0.0 }
+                self.histograms[name] = histogram
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                i = len(LATENCY_BUCKETS)
+            histogram['buckets'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+
+    # returns the metrics as a dict (suitable for a JSON report)
+    def summary(self):
+        with self.lock:
+            return {
+                'seconds'  : round(time.time() - self.started, 3),
+                'phases'   : { phase: { 'count': count, 'seconds': round(seconds, 6) }
+                               for phase, (count, seconds) in sorted(self.timers.items()) },
+                'counters' : dict(sorted(self.counters.items())),
+                'gauges'   : dict(sorted(self.gauges.items())),
+                'irods_calls' : { name: self.histogram_summary(histogram)
+                                  for name, histogram in sorted(self.histograms.items()) }
+                }
+
+
+    def write_json(self, path):
+        write_file(path, json.dumps(self.summary(), indent = 2) + '\n')
+
+
+    # labels (a dict) are added to each sample, e.g. the direction of the run
+    def write_prometheus(self, path, labels=None):
+        write_file(path, self.prometheus_text(labels or {}))
+
+
+    def prometheus_text(self, labels):
+        lines = []
+        def add(name, kind, help_text, samples):
+            name = PROMETHEUS_PREFIX + name
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for suffix, sample_labels, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix,
+                        format_labels(dict(labels, **sample_labels)), value))
+        with self.lock:
+            add('run_timestamp_seconds', 'gauge', 'Start time of the sync run',
+                    [('', {}, '{:.3f}'.format(self.started))])
+            add('run_seconds', 'gauge', 'Duration of the sync run',
+                    [('', {}, '{:.3f}'.format(time.time() - self.started))])
+            add('phase_seconds', 'gauge', 'Time spent per phase of the sync run',
+                    [('', { 'phase': phase }, '{:.6f}'.format(seconds))
+                     for phase, (count, seconds) in sorted(self.timers.items())])
+            add('phase_count', 'gauge', 'Number of times a phase was entered',
+                    [('', { 'phase': phase }, count)
+                     for phase, (count, seconds) in sorted(self.timers.items())])
+            for name, value in sorted(self.counters.items()):
+                add(name, 'gauge', 'Total ' + name.replace('_', ' ') +
+                        ' of the sync run', [('', {}, value)])
+            for name, value in sorted(self.gauges.items()):
+                add(name, 'gauge', name.replace('_', ' ').capitalize() +
+                        ' of the sync run', [('', {}, value)])
+            samples = []
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                bounds = [ repr(bound) for bound in LATENCY_BUCKETS ] + ['+Inf']
+                for bound, count in zip(bounds, histogram['buckets']):
+                    cumulative += count
+                    samples.append(('_bucket', { 'call': name, 'le': bound }, cumulative))
+                samples.append(('_sum', { 'call': name }, '{:.6f}'.format(histogram['sum'])))
+                samples.append(('_count', { 'call': name }, histogram['count']))
+            if len(samples) > 0:
+                add('irods_call_seconds', 'histogram',
+                        'Latency of iRODS calls', samples)
+        return '\n'.join(lines) + '\n'
+
+
+    # PRIVATE METHODS
+
+    def timed_calls(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                self.observe(name, time.perf_counter() - start)
+                return
+            self.observe(name, time.perf_counter() - start)
+            yield value
+
+
+    def histogram_summary(self, histogram):
+        bounds = [ str(bound) for bound in LATENCY_BUCKETS ] + ['inf']
+        return { 'count'   : histogram['count'],
+                 'seconds' : round(histogram['sum'], 6),
+                 'buckets' : { bound: count for bound, count
+                               in zip(bounds, histogram['buckets']) if count > 0 } }
+
+
+class Timer():
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NoTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+
+NO_TIMER = NoTimer()
+
+metrics = SyncMetrics()
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join([ '{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+            .replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in sorted(labels.items()) ]) + '}'
+
+
+# writes a file atomically, so that a collector never reads a partial file
+def write_file(path, text):
+    temp = path + '.tmp'
+    with open(temp, 'wt') as f:
+        f.write(text)
+    os.replace(temp, path)
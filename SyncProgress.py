@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# SyncProgress keeps track of the progress of a sync run, based on the text
+# output of the sync command. It understands the output of the native sync
+# engine (see SyncEngine.print_plan and print_event):
+#     plan: <n> new, <n> changed, <n> unchanged files, <bytes> bytes to transfer
+#     put|get <relpath> <bytes>
+#     chunk <relpath> <bytes>
+#     failed <relpath>: <error>
+# and the per file lines of irsync -v:
+#     <path>   <size> MB | <time> sec | <n> thr | <rate> MB/s
+# irsync does not announce the totals, so its runs have no fraction or ETA.
+# The chunk lines of large files count as progress, the put|get line of such
+# a file adds the bytes that were not reported in chunks (e.g. on a resume).
+#
+# The current rate is measured over the last RATE_WINDOW seconds, the
+# average throughput is an exponential moving average of the current rate,
+# updated at most once per SAMPLE_INTERVAL seconds.
+#
+
+import re
+import time
+from collections import deque
+from Formatting import format_size, format_duration
+
+RATE_WINDOW = 5.0
+SAMPLE_INTERVAL = 1.0
+# weight of a new sample in the moving average
+SMOOTHING = 0.2
+# no progress for this long (seconds) is reported as stalled
+STALL_TIME = 30.0
+
+PLAN_LINE = re.compile(r'^plan: (\d+) new, (\d+) changed, \d+ unchanged files, '
+                       r'(\d+) bytes to transfer')
+TRANSFER_LINE = re.compile(r'^(put|get) (.+) (\d+)$')
+CHUNK_LINE = re.compile(r'^chunk (.+) (\d+)$')
+FAILED_LINE = re.compile(r'^failed (.+?): ')
+IRSYNC_LINE = re.compile(r'^\s*(\S.*?)\s+(\d+(?:\.\d+)?) MB \| (\d+(?:\.\d+)?) sec \|')
+
+
+class SyncProgress():
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        # true once totals are known
+        self.planned = False
+        self.finished = False
+        self.start = clock()
+        self.last_progress = self.start
+        self.samples = deque([(self.start, 0)])
+        self.average = None
+        self.partial = ''
+        # relpath -> bytes reported in chunk lines of files in transfer
+        self.chunked = {}
+
+
+    # processes a chunk of output, returns true if the progress has changed
+    def feed(self, text):
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        changed = False
+        for line in lines:
+            changed = self.parse(line) or changed
+        return changed
+
+
+    def finish(self):
+        if self.partial != '':
+            self.parse(self.partial)
+            self.partial = ''
+        self.finished = True
+
+
+    # fraction of the work done (0..1), or None if the totals are unknown
+    def fraction(self):
+        if not self.planned:
+            return None
+        if self.bytes_total > 0:
+            return min(1.0, self.bytes_done / self.bytes_total)
+        if self.files_total > 0:
+            return min(1.0, (self.files_done + self.files_failed) / self.files_total)
+        return 1.0
+
+
+    # bytes per second over the last RATE_WINDOW seconds
+    def rate(self):
+        now = self.sample()
+        first_time, first_bytes = self.samples[0]
+        if now - first_time <= 0:
+            return 0.0
+        return (self.bytes_done - first_bytes) / (now - first_time)
+
+
+    # moving average of the rate (bytes per second)
+    def throughput(self):
+        self.sample()
+        return self.average if self.average is not None else 0.0
+
+
+    def files_per_second(self):
+        elapsed = self.clock() - self.start
+        return self.files_done / elapsed if elapsed > 0 else 0.0
+
+
+    # estimated remaining time (seconds), or None if unknown
+    def eta(self):
+        if not self.planned or self.finished:
+            return None
+        remaining = self.bytes_total - self.bytes_done
+        if remaining <= 0:
+            return 0.0
+        throughput = self.throughput()
+        if throughput <= 0:
+            return None
+        return remaining / throughput
+
+
+    def stalled(self):
+        return (not self.finished and
+                self.clock() - self.last_progress > STALL_TIME)
+
+
+    # returns a one line description of the progress
+    def summary(self):
+        if self.planned:
+            files = '{} of {} files'.format(self.files_done, self.files_total)
+            size = '{} of {}'.format(format_size(self.bytes_done),
+                    format_size(self.bytes_total))
+        else:
+            files = '{} files'.format(self.files_done)
+            size = format_size(int(self.bytes_done))
+        parts = [files, size, '{}/s'.format(format_size(int(self.throughput()))),
+                 '{:.1f} files/s'.format(self.files_per_second())]
+        if self.files_failed > 0:
+            parts.append('{} failed'.format(self.files_failed))
+        eta = self.eta()
+        if self.finished:
+            parts.append('finished')
+        elif self.stalled():
+            parts.append('stalled')
+        elif eta is not None:
+            parts.append('ETA ' + format_duration(eta))
+        return ', '.join(parts)
+
+
+    # PRIVATE METHODS
+
+    def parse(self, line):
+        match = TRANSFER_LINE.match(line)
+        if match is not None:
+            size = int(match.group(3))
+            self.add_file(size - self.chunked.pop(match.group(2), 0))
+            return True
+        match = CHUNK_LINE.match(line)
+        if match is not None:
+            relpath = match.group(1)
+            size = int(match.group(2))
+            self.chunked[relpath] = self.chunked.get(relpath, 0) + size
+            self.bytes_done += size
+            self.last_progress = self.clock()
+            return True
+        match = PLAN_LINE.match(line)
+        if match is not None:
+            # in watch mode, every batch of changes has its own plan
+            self.files_total += int(match.group(1)) + int(match.group(2))
+            self.bytes_total += int(match.group(3))
+            self.planned = True
+            return True
+        match = FAILED_LINE.match(line)
+        if match is not None:
+            self.files_failed += 1
+            self.bytes_done -= self.chunked.pop(match.group(1), 0)
+            self.last_progress = self.clock()
+            return True
+        match = IRSYNC_LINE.match(line)
+        if match is not None:
+            self.add_file(int(float(match.group(2)) * 1024 * 1024))
+            return True
+        return False
+
+
+    def add_file(self, size):
+        self.files_done += 1
+        self.bytes_done += size
+        self.last_progress = self.clock()
+
+
+    # records the bytes done for the rate calculation, returns the current time
+    def sample(self):
+        now = self.clock()
+        last_time = self.samples[-1][0]
+        if now - last_time >= SAMPLE_INTERVAL:
+            first_time, first_bytes = self.samples[0]
+            self.samples.append((now, self.bytes_done))
+            while len(self.samples) > 2 and now - self.samples[1][0] >= RATE_WINDOW:
+                self.samples.popleft()
+            current = (self.bytes_done - first_bytes) / (now - first_time)
+            if self.average is None:
+                self.average = current
+            else:
+                self.average += SMOOTHING * (current - self.average)
+        return now
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# SyncVerifier checks that the files of a synchronized pair are identical,
+# by comparing the checksums of the local files with the DATA_CHECKSUM of
+# the data objects
+#
+#   - the remote checksums come with the listing of the remote tree (see
+#     SyncEngine.list_remote), a few paged bulk queries for the whole
+#     collection subtree instead of a round trip per data object
+#   - data objects without a checksum get one computed by the server, these
+#     requests run concurrently (a TransferScheduler, a session per worker)
+#   - local files are hashed in a pool of processes, so that hashing uses
+#     several cores and is limited by the disk rather than by Python. The
+#     files are hashed while the server computes the missing checksums.
+# Files of which the sizes differ are reported as mismatch without hashing.
+#
+# With a SyncManifest, the local checksum of a file that has not been touched
+# since it was recorded is taken from the manifest (unless full_check is set),
+# and the checksums of verified files are recorded.
+#
+# verify() returns a list of SyncItem, one per file at the source, with one
+# of the statuses below. Files that only exist at the destination are ignored.
+#
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from Checksum import hash_files, SHA256_PREFIX
+from SyncMetrics import metrics
+from SyncEngine import SyncItem, UPLOAD
+from TransferScheduler import TransferScheduler
+
+# status of a file after verification
+VERIFIED = 'verified'
+MISMATCH = 'mismatch'
+MISSING = 'missing'
+UNVERIFIED = 'unverified'
+
+
+class SyncVerifier():
+    # engine is the SyncEngine of the sync pair, processes the number of
+    # hashing processes (None for the number of CPUs)
+    def __init__(self, engine, processes=None, full_check=False):
+        self.engine = engine
+        self.processes = processes or os.cpu_count() or 1
+        self.full_check = full_check
+
+
+    def verify(self):
+        engine = self.engine
+        with metrics.timer('scan'):
+            local_files, local_dirs = engine.scan_local()
+        with metrics.timer('list'):
+            remote_files, remote_colls = engine.list_remote()
+        source = local_files if engine.direction == UPLOAD else remote_files
+        entries = engine.manifest.entries() if engine.manifest is not None else {}
+        items = []
+        compare = []
+        for relpath in sorted(source):
+            item = SyncItem(relpath, UNVERIFIED, local_files.get(relpath),
+                    remote_files.get(relpath))
+            items.append(item)
+            if item.local is None or item.remote is None:
+                item.status = MISSING
+            elif item.remote.bundle is not None:
+                item.error = 'stored in a bundle'
+            elif item.local.size != item.remote.size:
+                item.status = MISMATCH
+            else:
+                compare.append(item)
+        # local checksums that are known from the manifest
+        checksums = {}
+        if not self.full_check:
+            for item in compare:
+                entry = entries.get(item.relpath)
+                if (entry is not None and entry.local_checksum is not None
+                        and entry.matches_local(item.local)):
+                    checksums[item.relpath] = entry.local_checksum
+        todo = [ item for item in compare if item.relpath not in checksums ]
+        missing = [ item for item in compare if item.remote.checksum is None ]
+        with ProcessPoolExecutor(self.processes) as pool:
+            # the files are submitted right away, hashing runs in the background
+            results = self.hash(pool, todo)
+            with metrics.timer('checksum_remote'):
+                scheduler = TransferScheduler(engine.connection,
+                        self.remote_checksum, workers = engine.workers)
+                failed = set([ item.relpath for item in scheduler.run(missing) ])
+            with metrics.timer('checksum_local'):
+                self.collect(todo, results, checksums)
+                # hashed (or recorded) in another scheme than the one the
+                # server has used
+                again = [ item for item in compare if item.relpath in checksums and
+                          not same_scheme(checksums[item.relpath], item.remote.checksum) ]
+                for item in again:
+                    del checksums[item.relpath]
+                self.collect(again, self.hash(pool, again), checksums)
+        for item in compare:
+            if item.relpath in failed:
+                continue
+            checksum = checksums.get(item.relpath)
+            if checksum is None:
+                continue
+            if checksum != item.remote.checksum:
+                item.status = MISMATCH
+                continue
+            item.status = VERIFIED
+            if engine.manifest is not None:
+                engine.manifest.record(item.relpath, item.local, item.remote,
+                        checksum)
+        if engine.manifest is not None:
+            engine.manifest.commit()
+        for status in (VERIFIED, MISMATCH, MISSING, UNVERIFIED):
+            metrics.count('files_' + status, count(items, status))
+        return items
+
+
+    # PRIVATE METHODS
+
+    # asks the server to compute the checksum of a data object (called by
+    # worker threads)
+    def remote_checksum(self, session, item):
+        with metrics.call('chksum'):
+            item.remote.checksum = session.data_objects.chksum(
+                    self.engine.remote_path(item.relpath))
+
+
+    # starts hashing the local files of items, in the scheme of their remote
+    # checksum (SHA-256 if it is not known yet)
+    def hash(self, pool, items):
+        return hash_files(pool, [ (self.engine.local_path(item.relpath),
+                                   item.remote.checksum) for item in items ],
+                self.processes)
+
+
+    def collect(self, items, results, checksums):
+        for item, (checksum, error) in zip(items, results):
+            if error is not None:
+                item.error = error
+                continue
+            checksums[item.relpath] = checksum
+            metrics.count('bytes_hashed', item.local.size)
+
+
+def same_scheme(checksum, reference):
+    if reference is None:
+        return True
+    return checksum.startswith(SHA256_PREFIX) == reference.startswith(SHA256_PREFIX)
+
+
+def count(items, status):
+    return len([ item for item in items if item.status == status ])
+
+
+# returns a dict that summarizes the verification
+def summary(items):
+    return {
+        'verified'   : count(items, VERIFIED),
+        'mismatch'   : count(items, MISMATCH),
+        'missing'    : count(items, MISSING),
+        'unverified' : count(items, UNVERIFIED),
+        'bytes'      : sum([ item.local.size for item in items
+                             if item.status == VERIFIED ])
+        }
+
+
+def print_verification(items, quiet=False):
+    if not quiet:
+        for item in items:
+            if item.status == MISMATCH:
+                print('mismatch ' + item.relpath)
+            if item.status == MISSING:
+                print('missing ' + item.relpath)
+            if item.status == UNVERIFIED:
+                print('unverified {}: {}'.format(item.relpath, item.error))
+    print('verify: {verified} verified, {mismatch} mismatch, {missing} missing, '
+          '{unverified} unverified files'.format(**summary(items)))
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# ThroughputHistory remembers the throughput of previous sync runs per iRODS
+# host and direction, and uses it to estimate the duration of a new run
+#
+# The duration of a run is modelled as  
+#      seconds = files * seconds_per_file + bytes / bytes_per_second
+# where both parameters are fitted (least squares) to the recent runs.
+#
+
+import json
+from CacheDir import cache_path
+
+# number of recent runs per host and direction that are remembered
+MAX_RUNS = 20
+
+# assumptions used while there is no (usable) history
+DEFAULT_SECONDS_PER_FILE = 0.05
+DEFAULT_BYTES_PER_SECOND = 10 * 1024 * 1024
+
+
+class ThroughputHistory():
+    def __init__(self, host, history_file=None):
+        self.host = host if host is not None else 'unknown'
+        if history_file is None:
+            history_file = cache_path('throughput.json')
+        self.history_file = history_file
+        self.history = self.load()
+
+
+    def record(self, direction, files, size, seconds):
+        if files == 0 or seconds <= 0:
+            return
+        runs = self.history.setdefault(self.key(direction), [])
+        runs.append([files, size, seconds])
+        del runs[:-MAX_RUNS]
+        self.save()
+
+
+    # returns the estimated duration (seconds) of transferring files/size bytes
+    def estimate(self, direction, files, size):
+        per_file, per_byte = self.fit(self.history.get(self.key(direction), []))
+        return files * per_file + size * per_byte
+
+
+    # PRIVATE METHODS
+
+    def key(self, direction):
+        return self.host + '/' + str(direction)
+
+
+    # least squares fit of seconds = a * files + b * bytes, returns (a, b)
+    def fit(self, runs):
+        default = (DEFAULT_SECONDS_PER_FILE, 1.0 / DEFAULT_BYTES_PER_SECOND)
+        if len(runs) == 0:
+            return default
+        sff = sum([ f * f for f, b, s in runs ])
+        sbb = sum([ b * b for f, b, s in runs ])
+        sfb = sum([ f * b for f, b, s in runs ])
+        sfs = sum([ f * s for f, b, s in runs ])
+        sbs = sum([ b * s for f, b, s in runs ])
+        det = sff * sbb - sfb * sfb
+        if det > 1e-9 * sff * sbb:
+            a = (sfs * sbb - sbs * sfb) / det
+            b = (sbs * sff - sfs * sfb) / det
+            if a >= 0 and b >= 0:
+                return a, b
+        # runs are too much alike to separate file overhead from bandwidth,
+        # attribute the observed time proportionally to both
+        files = sum([ f for f, b, s in runs ])
+        size = sum([ b for f, b, s in runs ])
+        seconds = sum([ s for f, b, s in runs ])
+        expected = files * default[0] + size * default[1]
+        if expected <= 0:
+            return default
+        scale = seconds / expected
+        return default[0] * scale, default[1] * scale
+
+
+    def load(self):
+        try:
+            with open(self.history_file, 'rt') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+
+    def save(self):
+        try:
+            with open(self.history_file, 'wt') as f:
+                json.dump(self.history, f)
+            return True
+        except IOError:
+            return False
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# TransferScheduler runs transfer tasks concurrently
+#
+# A number of worker threads pull tasks from a shared queue. Each worker 
+# borrows its own iRODS session from the pool of a MyRodsConnection, so that
+# the round trips of many small transfers overlap. A failed task is retried,
+# with a fresh session, after an increasing delay.
+#
+#    transfer(session, item)  performs a task, raises an exception on failure
+#    report(event, item)      is called (serialized) when a task starts, 
+#                             is done or has finally failed
+#
+# With an AdaptiveConcurrency, the workers only run as many tasks at the same
+# time as it allows, and report the size (see size(item)) and duration of
+# each task to it. The number of workers is the maximum concurrency then.
+#
+
+import time
+import queue
+import threading
+from SyncMetrics import metrics
+
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 2
+# delay (seconds) before the first retry, doubled for each next retry
+RETRY_DELAY = 1.0
+
+# events reported for a task
+EVENT_START = 'start'
+EVENT_DONE = 'done'
+EVENT_FAILED = 'failed'
+
+
+class TransferScheduler():
+    def __init__(self, connection, transfer, workers=DEFAULT_WORKERS,
+            retries=DEFAULT_RETRIES, report=None, concurrency=None, size=None,
+            credited=None):
+        self.connection = connection
+        self.transfer = transfer
+        self.concurrency = concurrency
+        self.size = size
+        # returns the bytes of an item that its transfer reports to the
+        # concurrency itself, as they move (see AdaptiveConcurrency.progress)
+        self.credited = credited
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.report = report
+        self.lock = threading.Lock()
+        self.tasks = queue.Queue()
+        self.failed = []
+
+
+    # processes all items, returns the list of items that failed
+    def run(self, items):
+        self.failed = []
+        for item in items:
+            self.tasks.put(item)
+        threads = [ threading.Thread(target = self.worker, daemon = True) 
+                    for i in range(min(self.workers, len(items))) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.failed
+
+
+    # PRIVATE METHODS
+
+    def worker(self):
+        session = self.connection.acquire()
+        while True:
+            try:
+                item = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            session = self.process(session, item)
+        if session is not None:
+            self.connection.release(session)
+
+
+    # returns the session to use for the next task
+    def process(self, session, item):
+        self.notify(EVENT_START, item)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                metrics.count('retries')
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            if session is None:
+                session = self.connection.acquire()
+            if session is None:
+                item.error = 'no iRODS connection available'
+                continue
+            try:
+                self.run_task(session, item)
+                item.error = None
+                self.notify(EVENT_DONE, item)
+                return session
+            except Exception as e:
+                item.error = str(e)
+                # the connection may be broken, continue with a fresh one
+                self.connection.discard(session)
+                session = None
+        with self.lock:
+            self.failed.append(item)
+        metrics.count('transfers_failed')
+        self.notify(EVENT_FAILED, item)
+        return session
+
+
+    def run_task(self, session, item):
+        if self.concurrency is None:
+            with metrics.timer('transfer'):
+                self.transfer(session, item)
+            return
+        self.concurrency.acquire()
+        ok = False
+        start = time.monotonic()
+        try:
+            with metrics.timer('transfer'):
+                self.transfer(session, item)
+            ok = True
+        finally:
+            self.concurrency.release()
+            size = self.size(item) if self.size is not None else 0
+            credited = self.credited(item) if self.credited is not None else 0
+            self.concurrency.record(size, time.monotonic() - start, ok, credited)
+
+
+    def notify(self, event, item):
+        if self.report is not None:
+            with self.lock:
+                self.report(event, item)
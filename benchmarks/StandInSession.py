@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# StandInSession is a local, in-memory stand-in for an iRODS session of the
+# Python iRODS client. It mimics the parts of the collections, data_objects
+# and query APIs that the application uses, so that hot paths can be
+# exercised without an iRODS server.
+#
+# Every call that would be a round trip to the server sleeps for the
+# configured latency (seconds), so concurrency effects remain visible. With a
+# bandwidth (bytes/s), calls that move file content also sleep for the time
+# the content takes at that rate. The bandwidth applies to each session (i.e.
+# each stream) separately.
+#
+# StandInConnection mimics a (connected) MyRodsConnection, handing out
+# sessions that share one in-memory zone.
+#
+
+import io
+import time
+import base64
+import hashlib
+import datetime
+import fnmatch
+import threading
+from irods.models import Collection, DataObject
+
+PAGE_SIZE = 500
+
+
+class StandInZone():
+    def __init__(self, zone='standin', username='tester'):
+        self.zone = zone
+        self.username = username
+        self.lock = threading.Lock()
+        # path -> modify time
+        self.collections = {}
+        # path -> [bytearray, modify time]
+        self.objects = {}
+        # path -> checksum registered by chksum(), dropped when the data changes
+        self.checksums = {}
+        self.calls = 0
+        self.add_collection('/' + zone + '/home/' + username)
+
+    def add_collection(self, path):
+        now = datetime.datetime.utcnow()
+        while path not in ('', '/') and path not in self.collections:
+            self.collections[path] = now
+            path = path.rsplit('/', 1)[0]
+
+    def add_object(self, path, data):
+        self.add_collection(path.rsplit('/', 1)[0])
+        self.objects[path] = [bytearray(data), datetime.datetime.utcnow()]
+        self.checksums.pop(path, None)
+
+
+class StandInConnection():
+    def __init__(self, zone=None, latency=0.0, bandwidth=None):
+        self.zone = zone if zone is not None else StandInZone()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.session = StandInSession(self.zone, latency, bandwidth)
+
+    def host(self):
+        return 'standin'
+
+    def acquire(self):
+        return StandInSession(self.zone, self.latency, self.bandwidth)
+
+    def release(self, session):
+        pass
+
+    def discard(self, session):
+        pass
+
+    def open_session(self):
+        return self.acquire()
+
+    def cleanup(self):
+        pass
+
+
+class StandInSession():
+    def __init__(self, zone, latency=0.0, bandwidth=None):
+        self.store = zone
+        self.zone = zone.zone
+        self.username = zone.username
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.collections = CollectionManager(self)
+        self.data_objects = DataObjectManager(self)
+
+    def round_trip(self):
+        with self.store.lock:
+            self.store.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    # a round trip that moves size bytes of file content
+    def transfer(self, size):
+        self.round_trip()
+        if self.bandwidth and size > 0:
+            time.sleep(size / self.bandwidth)
+
+    def query(self, *columns):
+        return Query(self, columns)
+
+    def cleanup(self):
+        pass
+
+
+class CollectionManager():
+    def __init__(self, session):
+        self.session = session
+
+    def create(self, path, recurse=True, **options):
+        self.session.round_trip()
+        with self.session.store.lock:
+            self.session.store.add_collection(path.rstrip('/'))
+
+
+class DataObjectManager():
+    def __init__(self, session):
+        self.session = session
+
+    def put(self, local_path, irods_path, **options):
+        with open(local_path, 'rb') as f:
+            data = f.read()
+        self.session.transfer(len(data))
+        with self.session.store.lock:
+            self.session.store.add_object(irods_path, data)
+
+    def get(self, irods_path, local_path=None, **options):
+        self.session.round_trip()
+        with self.session.store.lock:
+            if irods_path not in self.session.store.objects:
+                raise KeyError('data object does not exist: ' + irods_path)
+            data = bytes(self.session.store.objects[irods_path][0])
+        if local_path is None:
+            return StandInDataObject(irods_path, data)
+        self.session.transfer(len(data))
+        with open(local_path, 'wb') as f:
+            f.write(data)
+
+    def open(self, irods_path, mode, create=True, finalize_on_close=True, **options):
+        self.session.round_trip()
+        store = self.session.store
+        with store.lock:
+            if irods_path not in store.objects:
+                if mode == 'r' or not create:
+                    raise KeyError('data object does not exist: ' + irods_path)
+                store.add_object(irods_path, b'')
+            elif mode == 'w':
+                store.objects[irods_path][0] = bytearray()
+                store.checksums.pop(irods_path, None)
+        return StandInFile(self.session, irods_path, mode)
+
+    def unlink(self, irods_path, force=False, **options):
+        self.session.round_trip()
+        with self.session.store.lock:
+            if irods_path not in self.session.store.objects:
+                raise KeyError('data object does not exist: ' + irods_path)
+            del self.session.store.objects[irods_path]
+            self.session.store.checksums.pop(irods_path, None)
+
+    def chksum(self, irods_path, **options):
+        checksum = self.get(irods_path).chksum()
+        with self.session.store.lock:
+            self.session.store.checksums[irods_path] = checksum
+        return checksum
+
+
+class StandInDataObject():
+    def __init__(self, path, data):
+        self.path = path
+        self.name = path.rsplit('/', 1)[-1]
+        self.size = len(data)
+        self.data = data
+
+    def chksum(self, **options):
+        return 'sha2:' + base64.b64encode(hashlib.sha256(self.data).digest()).decode('ascii')
+
+
+class StandInRaw():
+    def replica_access_info(self):
+        return ('standin-token', 'standinResc')
+
+
+class StandInFile(io.RawIOBase):
+    def __init__(self, session, path, mode):
+        self.session = session
+        self.path = path
+        self.mode = mode
+        self.position = 0
+        self.raw = StandInRaw()
+        if mode == 'a':
+            self.position = len(self.content())
+
+    def content(self):
+        return self.session.store.objects[self.path][0]
+
+    def seek(self, offset, whence=0):
+        self.position = offset
+        return offset
+
+    def read(self, size=-1):
+        with self.session.store.lock:
+            content = self.content()
+            end = len(content) if size is None or size < 0 else self.position + size
+            data = bytes(content[self.position:end])
+        self.session.transfer(len(data))
+        self.position += len(data)
+        return data
+
+    def write(self, data):
+        self.session.transfer(len(data))
+        with self.session.store.lock:
+            content = self.content()
+            if len(content) < self.position:
+                content.extend(bytes(self.position - len(content)))
+            content[self.position:self.position + len(data)] = data
+            self.session.store.objects[self.path][1] = datetime.datetime.utcnow()
+            self.session.store.checksums.pop(self.path, None)
+        self.position += len(data)
+        return len(data)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return self.mode != 'r'
+
+
+class Query():
+    def __init__(self, session, columns):
+        self.session = session
+        self.columns = columns
+        self.criteria = []
+
+    def filter(self, *criteria):
+        self.criteria.extend(criteria)
+        return self
+
+    def get_batches(self):
+        rows = [ row for row in self.rows() if self.matches(row) ]
+        for i in range(0, max(1, len(rows)), PAGE_SIZE):
+            self.session.round_trip()
+            yield rows[i:i + PAGE_SIZE]
+
+    def first(self):
+        for row in self:
+            return row
+        return None
+
+    def __iter__(self):
+        for batch in self.get_batches():
+            for row in batch:
+                yield row
+
+    # PRIVATE METHODS
+
+    def rows(self):
+        store = self.session.store
+        with store.lock:
+            if any([ is_data_column(column) for column in self.columns ]):
+                return [ self.object_row(path, content, mtime)
+                         for path, (content, mtime) in store.objects.items() ]
+            return [ self.collection_row(path, mtime)
+                     for path, mtime in store.collections.items() ]
+
+    def collection_row(self, path, mtime):
+        return { Collection.name: path,
+                 Collection.parent_name: path.rsplit('/', 1)[0] or '/',
+                 Collection.modify_time: mtime }
+
+    def object_row(self, path, content, mtime):
+        coll, name = path.rsplit('/', 1)
+        row = self.collection_row(coll, self.session.store.collections.get(coll))
+        row.update({ DataObject.name: name,
+                     DataObject.size: len(content),
+                     DataObject.modify_time: mtime,
+                     DataObject.checksum: self.session.store.checksums.get(path),
+                     DataObject.replica_status: '1' })
+        return row
+
+    def matches(self, row):
+        for criterion in self.criteria:
+            value = lookup(row, criterion.query_key)
+            wanted = criterion.value
+            op = criterion.op.lower()
+            if op == '=' and value != wanted:
+                return False
+            if op == 'like' and not fnmatch.fnmatchcase(value,
+                    wanted.replace('%', '*').replace('_', '?')):
+                return False
+            if op == 'in' and value not in wanted:
+                return False
+            if op == '>=' and not value >= wanted:
+                return False
+            if op == '>' and not value > wanted:
+                return False
+        return True
+
+
+def is_data_column(column):
+    return any([ column is data_column for data_column in (DataObject.name,
+        DataObject.size, DataObject.modify_time, DataObject.checksum,
+        DataObject.replica_status) ])
+
+
+# finds a column in a row by identity (columns overload ==)
+def lookup(row, column):
+    for key, value in row.items():
+        if key is column:
+            return value
+    return None
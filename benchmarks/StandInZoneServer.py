@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# StandInZoneServer is a local HTTP server that serves an iRODS zone list
+# (see Iselect), as a stand-in for the server of the zone list URL
+#
+# It supports conditional requests: the list is served with an ETag and a
+# Last-Modified header, and a request with a matching If-None-Match or
+# If-Modified-Since header is answered with 304 Not Modified. Each response
+# can be delayed, to mimic a slow or unreachable server.
+#
+
+import json
+import time
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PATH = '/irods_zones.json'
+
+
+class StandInZoneServer():
+    def __init__(self, zones, delay=0.0):
+        self.delay = delay
+        # response status codes, in order of the requests
+        self.statuses = []
+        self.set_zones(zones)
+        server = self
+        class Handler(ZoneRequestHandler):
+            zone_server = server
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://localhost:{}{}'.format(self.httpd.server_port, PATH)
+        self.thread = threading.Thread(target = self.httpd.serve_forever,
+                daemon = True)
+
+
+    def set_zones(self, zones):
+        self.body = json.dumps(zones).encode('utf-8')
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        # HTTP dates have a resolution of one second
+        self.modified = int(time.time())
+
+
+    def start(self):
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ZoneRequestHandler(BaseHTTPRequestHandler):
+    zone_server = None
+
+    def do_GET(self):
+        server = self.zone_server
+        time.sleep(server.delay)
+        if self.path != PATH:
+            self.reply(404)
+            return
+        if self.not_modified(server):
+            self.reply(304)
+            return
+        self.reply(200, server.body, {
+            'Content-Type': 'application/json',
+            'ETag': server.etag,
+            'Last-Modified': formatdate(server.modified, usegmt = True) })
+
+
+    def not_modified(self, server):
+        etag = self.headers.get('If-None-Match')
+        if etag is not None:
+            return etag == server.etag
+        since = self.headers.get('If-Modified-Since')
+        if since is not None:
+            try:
+                return parsedate_to_datetime(since).timestamp() >= server.modified
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+    def reply(self, status, body=b'', headers=None):
+        self.zone_server.statuses.append(status)
+        try:
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            # client has given up (timeout)
+            pass
+
+
+    def log_message(self, format, *args):
+        pass
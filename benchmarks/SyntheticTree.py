@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# SyntheticTree describes a folder tree of a given shape, that can be written
+# to a local folder and/or added to the in-memory zone of a StandInSession
+#
+# The shapes (see SHAPES) cover the cases that stress different parts of the
+# application:
+#   wide  : many collections on a single level (tree loading, planning)
+#   deep  : long chains of nested collections (tree loading, planning)
+#   small : many small files (per-file overhead of planning and transfers)
+#   huge  : a few large files (transfer throughput, chunked transfers)
+# The scale multiplies the number of folders and files (or, for the huge
+# shape, the file size).
+#
+
+import os
+
+KB = 1024
+MB = 1024 * 1024
+
+# shape -> (description, function(scale) that returns (folders, files, size))
+SHAPES = {
+    'wide' : ('one level of many folders with a few files each',
+              lambda scale: (wide_folders(int(2000 * scale)), 2, 4 * KB)),
+    'deep' : ('chains of nested folders with a file each',
+              lambda scale: (deep_folders(20, int(50 * scale)), 1, 4 * KB)),
+    'small': ('many small files',
+              lambda scale: (wide_folders(int(200 * scale)), 100, 1 * KB)),
+    'huge' : ('a few large files',
+              lambda scale: ([''], 4, int(32 * MB * scale))),
+    }
+
+
+class SyntheticTree():
+    # folders are relative paths ('' is the root folder), each folder holds
+    # files_per_folder files of file_size bytes
+    def __init__(self, name, folders, files_per_folder, file_size):
+        self.name = name
+        self.folders = folders
+        self.files_per_folder = files_per_folder
+        self.file_size = file_size
+
+
+    # number of folders, not counting the root folder
+    def folder_count(self):
+        return len([ folder for folder in self.folders if folder != '' ])
+
+
+    def file_count(self):
+        return len(self.folders) * self.files_per_folder
+
+
+    def total_size(self):
+        return self.file_count() * self.file_size
+
+
+    # yields the relative path of each file
+    def files(self):
+        for folder in self.folders:
+            for i in range(self.files_per_folder):
+                name = 'file{:04d}.dat'.format(i)
+                yield folder + '/' + name if folder != '' else name
+
+
+    def write_local(self, root):
+        block = os.urandom(min(self.file_size, MB))
+        for folder in self.folders:
+            os.makedirs(os.path.join(root, folder), exist_ok = True)
+        for path in self.files():
+            with open(os.path.join(root, path), 'wb') as f:
+                remaining = self.file_size
+                while remaining > 0:
+                    f.write(block[:remaining])
+                    remaining -= len(block)
+
+
+    # adds the collections (and, if with_files is set, the data objects) to
+    # a StandInZone, below the collection root
+    def add_remote(self, zone, root, with_files=False):
+        with zone.lock:
+            for folder in self.folders:
+                zone.add_collection(root + '/' + folder if folder != '' else root)
+            if with_files:
+                data = os.urandom(self.file_size)
+                for path in self.files():
+                    zone.add_object(root + '/' + path, data)
+
+
+def make_tree(shape, scale=1.0):
+    description, layout = SHAPES[shape]
+    folders, files_per_folder, file_size = layout(scale)
+    return SyntheticTree(shape, folders, files_per_folder, file_size)
+
+
+def wide_folders(count):
+    return [ 'dir{:05d}'.format(i) for i in range(max(1, count)) ]
+
+
+def deep_folders(chains, depth):
+    folders = []
+    for chain in range(chains):
+        path = 'chain{:02d}'.format(chain)
+        folders.append(path)
+        for level in range(1, max(1, depth)):
+            path += '/level{:03d}'.format(level)
+            folders.append(path)
+    return folders
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Measures the upload throughput (files/s) of a folder with many small files,
+# with and without bundling them into tar archives (see SyncBundler)
+#
+# The benchmark runs against a local in-memory stand-in of an iRODS session
+# (see StandInSession) that adds a fixed latency to each round trip, so no
+# iRODS server is needed.
+#
+# Usage: bench_bundling.py [-n <files>] [-s <file size>] [-l <latency ms>]
+#                          [-w <workers>]
+
+import os
+import sys
+import time
+import getopt
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from StandInSession import StandInConnection
+from SyncBundler import SyncBundler
+from SyncEngine import SyncEngine, UPLOAD
+
+
+def make_tree(root, files, size):
+    data = os.urandom(size)
+    for i in range(files):
+        folder = os.path.join(root, 'dir{:03d}'.format(i // 100))
+        os.makedirs(folder, exist_ok = True)
+        with open(os.path.join(folder, 'file{:05d}.dat'.format(i)), 'wb') as f:
+            f.write(data)
+
+
+def bench_upload(root, latency, workers, bundler):
+    connection = StandInConnection(latency = latency)
+    remote_root = '/standin/home/tester/bench'
+    engine = SyncEngine(connection, root, remote_root, UPLOAD,
+            workers = workers, bundler = bundler)
+    start = time.perf_counter()
+    plan = engine.plan()
+    ok = engine.execute(plan)
+    seconds = time.perf_counter() - start
+    if not ok:
+        print('Error: upload failed')
+        exit(1)
+    return seconds, len(plan.transfers()), connection.zone.calls
+
+
+def main(files, size, latency, workers):
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, files, size)
+        print('{} files of {} bytes, {:.1f} ms latency, {} workers'.format(
+            files, size, latency * 1000, workers))
+        for label, bundler in (('per file', None), ('bundled ', SyncBundler())):
+            seconds, count, trips = bench_upload(root, latency, workers, bundler)
+            print('{}: {:8.3f} s {:9.1f} files/s {:7d} round trips'.format(
+                label, seconds, count / seconds, trips))
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'n:s:l:w:')
+    except:
+        print('Error: Invalid program arguments specified.')
+        exit(1)
+    files = 2000
+    size = 4096
+    latency = 0.005
+    workers = 4
+    for opt, arg in opts:
+        if opt == '-n':
+            files = int(arg)
+        elif opt == '-s':
+            size = int(arg)
+        elif opt == '-l':
+            latency = float(arg) / 1000
+        elif opt == '-w':
+            workers = int(arg)
+    main(files, size, latency, workers)
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Measures the cold start of the GUI: the time from program start until the
+# main window is first painted, as reported by the application itself, and
+# the wall clock time of the whole run (including the interpreter startup and
+# the shutdown right after the first paint).
+#
+# The application must not wait on the iRODS server or the network before
+# it shows its window. The benchmark fails (exit code 1) if the median time
+# to first paint exceeds the budget.
+#
+# Requires a display, e.g. run it with xvfb-run on a headless host.
+#
+# Usage: bench_first_paint.py [-r <repeat>] [-b <budget ms>]
+
+import os
+import re
+import sys
+import time
+import getopt
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from Application import FIRST_PAINT_ENV
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))), 'myrods-sync.py')
+BUDGET = 1000.0
+FIRST_PAINT = re.compile(r'first paint: ([0-9.]+) ms')
+
+
+def run_once():
+    env = dict(os.environ)
+    env[FIRST_PAINT_ENV] = '1'
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, PROGRAM], env = env,
+            stdout = subprocess.PIPE, stderr = subprocess.STDOUT, timeout = 120)
+    wall = (time.perf_counter() - start) * 1000
+    match = FIRST_PAINT.search(result.stdout.decode('utf-8', 'replace'))
+    if match is None:
+        print(result.stdout.decode('utf-8', 'replace'))
+        print('Error: application did not report its first paint')
+        exit(2)
+    return float(match.group(1)), wall
+
+
+def main(repeat, budget):
+    paints = []
+    walls = []
+    for i in range(repeat):
+        paint, wall = run_once()
+        paints.append(paint)
+        walls.append(wall)
+        print('run {:3d}: first paint {:8.1f} ms, wall clock {:8.1f} ms'.format(
+            i + 1, paint, wall))
+    median = statistics.median(paints)
+    print('median first paint {:.1f} ms (budget {:.0f} ms), median wall clock '
+          '{:.1f} ms'.format(median, budget, statistics.median(walls)))
+    if median > budget:
+        print('Error: first paint exceeds the budget')
+        exit(1)
+
+
+if __name__ == "__main__":
+    if not 'DISPLAY' in os.environ:
+        print('Error: This benchmark requires a display (try xvfb-run)')
+        exit(2)
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'r:b:')
+    except:
+        print('Error: Invalid program arguments specified.')
+        exit(1)
+    repeat = 5
+    budget = BUDGET
+    for opt, arg in opts:
+        if opt == '-r':
+            repeat = int(arg)
+        elif opt == '-b':
+            budget = float(arg)
+    main(repeat, budget)
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Measures the startup cost of each entry point of myrods-sync: the wall
+# clock time of a run and the time spent on imports (python -X importtime).
+#
+# Each entry point has a budget for its import time and a list of modules
+# that it must not import (e.g. '-v' must not load GTK or the iRODS client).
+# The benchmark fails (exit code 1) if an entry point exceeds its budget or
+# imports a forbidden module. The slowest imports are listed per entry point.
+#
+# The runs use a temporary home and cache directory and an iRODS environment
+# file that does not exist, so the headless run fails fast on its connect.
+#
+# Usage: bench_startup.py [-r <repeat>] [-t <top imports>] [-o <report file>]
+
+import os
+import re
+import sys
+import json
+import time
+import getopt
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PROGRAM = os.path.join(ROOT, 'myrods-sync.py')
+GUI_IMPORT = ('import gi; gi.require_version("Gtk", "3.0"); '
+              'import Application')
+
+# name, command line arguments (after the interpreter), import budget (ms),
+# forbidden modules
+ENTRY_POINTS = [
+    ('version',  [PROGRAM, '-v'],          100.0, ('gi', 'irods')),
+    ('help',     [PROGRAM, '-h'],          100.0, ('gi', 'irods')),
+    ('queue',    [PROGRAM, '--queue'],     150.0, ('gi', 'irods')),
+    ('headless', [PROGRAM, '--headless', '-n', '{local}', '/zone/home/user'],
+                                          1000.0, ('gi',)),
+    ('gui',      ['-c', GUI_IMPORT],       800.0, ('irods',)),
+    ]
+
+# import time: self [us] | cumulative | imported package
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+# returns a dict with the wall clock time, the total import time and
+# the imported modules (cumulative ms per module) of a single run
+def run_once(arguments, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + arguments,
+            env = env, cwd = ROOT, stdout = subprocess.DEVNULL,
+            stderr = subprocess.PIPE, timeout = 120)
+    wall = (time.perf_counter() - start) * 1000
+    imports = {}
+    total = 0
+    for line in result.stderr.decode('utf-8', 'replace').splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        cumulative = int(match.group(2)) / 1000
+        imports[match.group(4)] = cumulative
+        if match.group(3) == '':
+            # top level import, its cumulative time includes its children
+            total += cumulative
+    return { 'wall': wall, 'imports': total, 'modules': imports }
+
+
+def measure(name, arguments, budget, forbidden, env, repeat, top):
+    runs = [run_once(arguments, env) for i in range(repeat)]
+    wall = statistics.median(run['wall'] for run in runs)
+    imports = statistics.median(run['imports'] for run in runs)
+    modules = runs[-1]['modules']
+    loaded = sorted(module for module in modules
+            if module.split('.')[0] in forbidden)
+    slowest = sorted(modules.items(), key = lambda item: -item[1])[:top]
+    ok = imports <= budget and len(loaded) == 0
+    print('{:9s}: imports {:7.1f} ms (budget {:6.0f} ms), wall clock {:7.1f} ms, '
+          '{} modules{}'.format(name, imports, budget, wall, len(modules),
+          '' if ok else '  <-- FAILED'))
+    if len(loaded) > 0:
+        print('           forbidden imports: ' + ', '.join(loaded[:10]))
+    for module, ms in slowest:
+        print('           {:7.1f} ms  {}'.format(ms, module))
+    return { 'name': name, 'wall_ms': wall, 'imports_ms': imports,
+             'budget_ms': budget, 'modules': len(modules),
+             'forbidden': loaded, 'slowest': slowest, 'ok': ok }
+
+
+def main(repeat, top, report_file):
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        local = os.path.join(folder, 'local')
+        os.mkdir(local)
+        env = dict(os.environ)
+        env['HOME'] = folder
+        env['XDG_CACHE_HOME'] = os.path.join(folder, 'cache')
+        env['IRODS_ENVIRONMENT_FILE'] = os.path.join(folder, 'missing.json')
+        for name, arguments, budget, forbidden in ENTRY_POINTS:
+            if name == 'gui' and importlib.util.find_spec('gi') is None:
+                print('{:9s}: skipped, PyGObject is not installed'.format(name))
+                continue
+            arguments = [argument.format(local = local) for argument in arguments]
+            results.append(measure(name, arguments, budget, forbidden,
+                    env, repeat, top))
+    if report_file is not None:
+        with open(report_file, 'wt') as f:
+            json.dump(results, f, indent = 4)
+    if not all(result['ok'] for result in results):
+        print('Error: startup exceeds the budget or imports forbidden modules')
+        exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'r:t:o:')
+    except:
+        print('Error: Invalid program arguments specified.')
+        exit(1)
+    repeat = 5
+    top = 5
+    report_file = None
+    for opt, arg in opts:
+        if opt == '-r':
+            repeat = int(arg)
+        elif opt == '-t':
+            top = int(arg)
+        elif opt == '-o':
+            report_file = arg
+    main(repeat, top, report_file)
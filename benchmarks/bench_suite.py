@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Runs the hot paths of the application against the local in-memory stand-in
+# of an iRODS zone (see StandInSession), so no iRODS server is needed:
+#   connect    : MyRodsConnection.connect, and acquire() with and without a
+#                prewarmed pool of sessions
+# and for each synthetic tree (see SyntheticTree):
+#   tree_top   : IrodsChooserStore.load_iRODS_collections (top levels)
+#   tree_full  : IrodsChooserStore.load_all_iRODS_collections
+#   tree_index : the first IrodsChooserStore.search, which builds the index
+#   tree_search: IrodsChooserStore.search (mean of SEARCH_QUERIES queries)
+#   plan_new   : SyncEngine.plan of an upload to an empty collection
+#   upload     : SyncEngine.execute of that plan
+#   plan_same  : SyncEngine.plan of the same upload, once it is in sync
+#   download   : SyncEngine.plan and execute of a download to an empty folder
+#   verify     : SyncVerifier.verify of the upload, the server computes all
+#                checksums while the local files are hashed
+#   verify_listed : the same, now that the checksums come with the listing
+#   log_parse  : parsing the sync output as LogWindow does (SyncProgress)
+#   log_window : the same output shown by a LogWindow (only with a display)
+# The tree loading steps are skipped if PyGObject is not installed.
+#
+# The results are written as JSON. With a baseline (the results of an earlier
+# run, e.g. of the previous release) the benchmark reports the change of each
+# step and fails (exit code 1) if a step has become slower than the tolerance.
+#
+# Usage: bench_suite.py [-t <tree>,...] [-x <scale>] [-l <latency ms>]
+#                       [-B <bandwidth MB/s>] [-w <workers>] [-o <report file>]
+#                       [-L <label>] [-c <baseline file>] [-T <tolerance %>]
+
+import os
+import sys
+import json
+import time
+import codecs
+import getopt
+import shlex
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from StandInSession import StandInZone, StandInConnection, StandInSession
+from SyntheticTree import SHAPES, MB, make_tree
+from SyncEngine import SyncEngine, UPLOAD, DOWNLOAD
+from SyncVerifier import SyncVerifier
+from ChunkedTransfer import ChunkedTransfer
+from SyncProgress import SyncProgress
+
+REMOTE_HOME = '/standin/home/tester'
+# files of at least this size are transferred in chunks
+CHUNK_THRESHOLD = 16 * MB
+CHUNK_SIZE = 8 * MB
+# round trips needed to open and authenticate a session
+HANDSHAKE_ROUND_TRIPS = 5
+TOLERANCE = 20.0
+# differences of less than this (seconds) are not reported as slower
+MIN_DIFFERENCE = 0.005
+# size of the reads of LogWindow from the output pipe
+READ_SIZE = 65536
+# number of collection names searched for in the tree_search step
+SEARCH_QUERIES = 20
+
+
+class Suite():
+    def __init__(self, latency, bandwidth, workers):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.workers = workers
+        self.results = []
+
+
+    # records a step, rates are derived from its seconds
+    def record(self, tree, step, seconds, round_trips=None, files=None,
+            size=None, lines=None, collections=None):
+        result = { 'tree': tree, 'step': step, 'seconds': seconds }
+        if round_trips is not None:
+            result['round_trips'] = round_trips
+        for key, count, rate in (('files', files, 'files_per_second'),
+                ('bytes', size, 'bytes_per_second'),
+                ('lines', lines, 'lines_per_second'),
+                ('collections', collections, 'collections_per_second')):
+            if count is not None:
+                result[key] = count
+                result[rate] = count / seconds if seconds > 0 else None
+        self.results.append(result)
+        print('{:6s} {:14s} {:9.3f} s{}'.format(tree, step, seconds,
+            '' if round_trips is None else ' {:8d} round trips'.format(round_trips)))
+
+
+    def skip(self, tree, step, reason):
+        self.results.append({ 'tree': tree, 'step': step, 'skipped': reason })
+        print('{:6s} {:14s} skipped, {}'.format(tree, step, reason))
+
+
+    def run_connect(self, folder):
+        from MyRodsConnection import MyRodsConnection
+        import irods.session
+        zone = StandInZone()
+        handshake = self.latency * HANDSHAKE_ROUND_TRIPS
+        def open_session(**settings):
+            with zone.lock:
+                zone.calls += HANDSHAKE_ROUND_TRIPS
+            time.sleep(handshake)
+            return StandInSession(zone, self.latency, self.bandwidth)
+        irods.session.iRODSSession = open_session
+        os.environ['IRODS_ENVIRONMENT_FILE'] = os.path.join(folder, 'irods_environment.json')
+        for pool_size, suffix in ((0, ''), (self.workers, '_pooled')):
+            connection = MyRodsConnection(pool_size)
+            calls = zone.calls
+            start = time.perf_counter()
+            connection.connect()
+            self.record('-', 'connect' + suffix, time.perf_counter() - start,
+                    zone.calls - calls)
+            # give the keepalive thread time to fill the pool
+            deadline = time.time() + 10
+            while len(connection.pool) < pool_size and time.time() < deadline:
+                time.sleep(0.01)
+            calls = zone.calls
+            start = time.perf_counter()
+            sessions = [ connection.acquire() for i in range(self.workers) ]
+            self.record('-', 'acquire' + suffix, time.perf_counter() - start,
+                    zone.calls - calls)
+            for session in sessions:
+                connection.release(session)
+            connection.cleanup()
+
+
+    def run_tree_load(self, tree):
+        try:
+            import gi
+            gi.require_version("Gtk", "3.0")
+            from IrodsChooserDialog import IrodsChooserStore
+        except (ImportError, ValueError):
+            for step in ('tree_top', 'tree_full', 'tree_index', 'tree_search'):
+                self.skip(tree.name, step, 'PyGObject is not installed')
+            return
+        zone = StandInZone()
+        tree.add_remote(zone, REMOTE_HOME + '/' + tree.name)
+        session = StandInSession(zone, self.latency, self.bandwidth)
+        for step, load in (('tree_top', 'load_iRODS_collections'),
+                           ('tree_full', 'load_all_iRODS_collections')):
+            # without a session factory, the store loads synchronously
+            store = IrodsChooserStore(session)
+            calls = zone.calls
+            start = time.perf_counter()
+            getattr(store, load)()
+            self.record(tree.name, step, time.perf_counter() - start,
+                    zone.calls - calls, collections = store.count())
+        # type-ahead search in the complete tree
+        names = [ folder.rsplit('/', 1)[-1] for folder in tree.folders
+                  if folder != '' ]
+        if len(names) == 0:
+            self.skip(tree.name, 'tree_index', 'no collections')
+            self.skip(tree.name, 'tree_search', 'no collections')
+            return
+        queries = names[::max(1, len(names) // SEARCH_QUERIES)]
+        start = time.perf_counter()
+        store.search(queries[0])
+        self.record(tree.name, 'tree_index', time.perf_counter() - start,
+                collections = store.count())
+        start = time.perf_counter()
+        for query in queries:
+            store.search(query)
+        self.record(tree.name, 'tree_search',
+                (time.perf_counter() - start) / len(queries),
+                collections = store.count())
+
+
+    def run_sync(self, tree, folder):
+        local = os.path.join(folder, tree.name)
+        tree.write_local(local)
+        connection = StandInConnection(latency = self.latency,
+                bandwidth = self.bandwidth)
+        zone = connection.zone
+        remote = REMOTE_HOME + '/' + tree.name
+        new_engine = lambda local, direction: SyncEngine(connection, local,
+                remote, direction, workers = self.workers,
+                chunked = ChunkedTransfer(connection, CHUNK_THRESHOLD,
+                    CHUNK_SIZE, self.workers))
+
+        engine = new_engine(local, UPLOAD)
+        plan = self.timed(tree.name, 'plan_new', zone, engine.plan)
+        files = len(plan.transfers())
+        size = plan.transfer_size()
+        self.timed(tree.name, 'upload', zone, lambda: engine.execute(plan),
+                files, size)
+        self.timed(tree.name, 'plan_same', zone, new_engine(local, UPLOAD).plan)
+
+        engine = new_engine(os.path.join(folder, tree.name + '.download'), DOWNLOAD)
+        self.timed(tree.name, 'download', zone,
+                lambda: engine.execute(engine.plan()), files, size)
+
+        verifier = SyncVerifier(new_engine(local, UPLOAD))
+        for step in ('verify', 'verify_listed'):
+            self.timed(tree.name, step, zone, verifier.verify, files, size)
+        return plan
+
+
+    def run_log(self, tree, plan, folder):
+        output = ['plan: {} new, 0 changed, 0 unchanged files, {} bytes to '
+                  'transfer'.format(len(plan.transfers()), plan.transfer_size())]
+        output.extend([ 'put {} {}'.format(item.relpath, item.local.size)
+                        for item in plan.transfers() ])
+        data = ('\n'.join(output) + '\nfinished in 1.0 s\n').encode('utf-8')
+        # as LogWindow.on_output does for each read from the pipe
+        start = time.perf_counter()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        progress = SyncProgress()
+        for offset in range(0, len(data), READ_SIZE):
+            progress.feed(decoder.decode(data[offset:offset + READ_SIZE]))
+        progress.finish()
+        self.record(tree.name, 'log_parse', time.perf_counter() - start,
+                lines = len(output) + 1)
+        if not 'DISPLAY' in os.environ:
+            self.skip(tree.name, 'log_window', 'no display')
+            return
+        try:
+            import gi
+            gi.require_version("Gtk", "3.0")
+            from gi.repository import Gtk
+            from LogWindow import LogWindow
+        except (ImportError, ValueError):
+            self.skip(tree.name, 'log_window', 'PyGObject is not installed')
+            return
+        path = os.path.join(folder, tree.name + '.log')
+        with open(path, 'wb') as f:
+            f.write(data)
+        start = time.perf_counter()
+        window = LogWindow('cat ' + shlex.quote(path), None)
+        while not window.progress.finished or window.tick_id is not None:
+            Gtk.main_iteration_do(False)
+        self.record(tree.name, 'log_window', time.perf_counter() - start,
+                lines = len(output) + 1)
+        window.destroy()
+
+
+    def timed(self, tree, step, zone, function, files=None, size=None):
+        calls = zone.calls
+        start = time.perf_counter()
+        result = function()
+        self.record(tree, step, time.perf_counter() - start,
+                zone.calls - calls, files, size)
+        return result
+
+
+def compare(results, settings, baseline_file, tolerance):
+    with open(baseline_file, 'rt') as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != settings:
+        print('Warning: the baseline has been run with other settings: ' +
+                json.dumps(baseline.get('settings')))
+    before = { (result['tree'], result['step']): result['seconds']
+               for result in baseline['results'] if 'seconds' in result }
+    regressions = 0
+    print('compared with {} ({})'.format(baseline_file, baseline.get('label') or '-'))
+    for result in results:
+        key = (result['tree'], result['step'])
+        if not 'seconds' in result or not key in before or before[key] <= 0:
+            continue
+        change = (result['seconds'] / before[key] - 1) * 100
+        slower = (change > tolerance and
+                result['seconds'] - before[key] > MIN_DIFFERENCE)
+        regressions += slower
+        print('{:6s} {:14s} {:+7.1f} %{}'.format(result['tree'], result['step'],
+            change, '  <-- SLOWER' if slower else ''))
+    return regressions
+
+
+def main(trees, scale, latency, bandwidth, workers, label, report_file,
+        baseline_file, tolerance):
+    suite = Suite(latency, bandwidth, workers)
+    with tempfile.TemporaryDirectory() as folder:
+        # keep log files etc. out of the cache directory of the user
+        os.environ['XDG_CACHE_HOME'] = os.path.join(folder, 'cache')
+        suite.run_connect(folder)
+        for shape in trees:
+            tree = make_tree(shape, scale)
+            print('{}: {} folders, {} files of {} bytes'.format(shape,
+                tree.folder_count(), tree.file_count(), tree.file_size))
+            suite.run_tree_load(tree)
+            plan = suite.run_sync(tree, folder)
+            suite.run_log(tree, plan, folder)
+    settings = { 'trees': trees, 'scale': scale, 'latency': latency,
+                 'bandwidth': bandwidth, 'workers': workers }
+    report = {
+        'label'    : label,
+        'time'     : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python'   : platform.python_version(),
+        'settings' : settings,
+        'results'  : suite.results
+        }
+    if report_file is not None:
+        with open(report_file, 'wt') as f:
+            json.dump(report, f, indent = 4)
+    if baseline_file is not None and compare(suite.results, settings,
+            baseline_file, tolerance) > 0:
+        print('Error: steps have become slower than the baseline')
+        exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 't:x:l:B:w:L:o:c:T:')
+    except:
+        print('Error: Invalid program arguments specified.')
+        exit(1)
+    trees = list(SHAPES)
+    scale = 1.0
+    latency = 0.002
+    bandwidth = 100 * MB
+    workers = 4
+    label = None
+    report_file = None
+    baseline_file = None
+    tolerance = TOLERANCE
+    for opt, arg in opts:
+        if opt == '-t':
+            trees = arg.split(',')
+        elif opt == '-x':
+            scale = float(arg)
+        elif opt == '-l':
+            latency = float(arg) / 1000
+        elif opt == '-B':
+            bandwidth = float(arg) * MB if float(arg) > 0 else None
+        elif opt == '-w':
+            workers = int(arg)
+        elif opt == '-L':
+            label = arg
+        elif opt == '-o':
+            report_file = arg
+        elif opt == '-c':
+            baseline_file = arg
+        elif opt == '-T':
+            tolerance = float(arg)
+    for shape in trees:
+        if not shape in SHAPES:
+            print('Error: Unknown tree ' + shape + ', choose from ' + ', '.join(SHAPES))
+            exit(1)
+    main(trees, scale, latency, bandwidth, workers, label, report_file,
+            baseline_file, tolerance)
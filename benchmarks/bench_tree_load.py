@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Compares the time and number of iRODS round trips needed to obtain the
+# complete collection tree below /<zone>/home:
+#   - recursive : one collections.get plus one subcollections query per
+#                 collection (the way the chooser used to load its tree)
+#   - bulk      : a single paged query, as used by
+#                 IrodsChooserStore.load_all_iRODS_collections
+#
+# The benchmark uses the existing iRODS configuration (environment + token)
+# of the user, see MyRodsConnection.
+#
+# Usage: bench_tree_load.py [-r <repeat>]
+
+import os
+import sys
+import time
+import getopt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import gi
+gi.require_version("Gtk", "3.0")
+from MyRodsConnection import MyRodsConnection
+from IrodsChooserDialog import IrodsChooserStore
+
+
+def recursive_paths(session, path, counter):
+    # a collections.get and a read of its subcollections both query the catalog
+    counter[0] += 2
+    try:
+        coll = session.collections.get(path)
+        subcolls = coll.subcollections
+    except:
+        return []
+    paths = []
+    for subcoll in subcolls:
+        paths.append(subcoll.path)
+        paths.extend(recursive_paths(session, subcoll.path, counter))
+    return paths
+
+
+def bench_recursive(session):
+    counter = [0]
+    start = time.perf_counter()
+    paths = recursive_paths(session, '/' + session.zone + '/home', counter)
+    return time.perf_counter() - start, counter[0], len(paths)
+
+
+def bench_bulk(session):
+    store = IrodsChooserStore(session)
+    counter = 0
+    start = time.perf_counter()
+    count = 0
+    for batch in store.collection_path_batches():
+        counter += 1
+        count += len(batch)
+    listed = time.perf_counter() - start
+    store.load_all_iRODS_collections()
+    built = time.perf_counter() - start
+    return listed, built, counter, count
+
+
+def main(repeat):
+    irods = MyRodsConnection()
+    session = irods.connect()
+    if session is None:
+        print('Error: no configured/authenticated iRODS connection available')
+        exit(1)
+    print('zone ' + session.zone + ' on ' + irods.host())
+    for i in range(repeat):
+        seconds, trips, count = bench_recursive(session)
+        print('recursive: {:7d} collections {:8.3f} s {:7d} round trips'.format(
+            count, seconds, trips))
+        listed, built, trips, count = bench_bulk(session)
+        print('bulk     : {:7d} collections {:8.3f} s {:7d} round trips '
+              '({:.3f} s including tree store)'.format(count, listed, trips, built))
+    irods.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'r:')
+    except:
+        print('Error: Invalid program arguments specified.')
+        exit(1)
+    repeat = 1
+    for opt, arg in opts:
+        if opt == '-r':
+            repeat = int(arg)
+    main(repeat)
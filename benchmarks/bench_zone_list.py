@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Measures how Iselect obtains a zone list from a (slow) URL, using a local
+# stand-in server (see StandInZoneServer):
+#   - startup without and with a cached list (must not wait on the network)
+#   - a full download, a revalidation (304) and a download of a changed list
+#   - a refresh from a server that does not answer within the timeout
+#
+# Usage: bench_zone_list.py [-d <server delay ms>] [-t <timeout s>]
+
+import os
+import sys
+import time
+import getopt
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from StandInZoneServer import StandInZoneServer
+from Iselect import Iselect
+
+ZONES = { 'zone{}'.format(i): { 'description': 'Zone {}'.format(i),
+                                'config': { 'irods_host': 'zone{}.example.org'.format(i),
+                                            'irods_zone_name': 'zone{}'.format(i) } }
+          for i in range(20) }
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main(delay, timeout):
+    server = StandInZoneServer(ZONES, delay).start()
+    with tempfile.TemporaryDirectory() as folder:
+        cache_file = os.path.join(folder, 'irods_zones.json')
+        new_select = lambda: Iselect(server.url, cache_file, timeout)
+
+        select, ms = timed(new_select)
+        print('startup, no cache     : {:8.1f} ms, {} zones'.format(ms, len(select.zones)))
+        changed, ms = timed(select.refresh)
+        print('refresh, download     : {:8.1f} ms, changed={} ({})'.format(
+            ms, changed, server.statuses[-1]))
+
+        select, ms = timed(new_select)
+        print('startup, cached       : {:8.1f} ms, {} zones'.format(ms, len(select.zones)))
+        changed, ms = timed(select.refresh)
+        print('refresh, unchanged    : {:8.1f} ms, changed={} ({})'.format(
+            ms, changed, server.statuses[-1]))
+
+        notified = []
+        select.add_listener(lambda: notified.append(True))
+        zones = dict(ZONES)
+        zones['extra'] = { 'description': 'Extra zone', 'config': {} }
+        server.set_zones(zones)
+        changed, ms = timed(select.refresh)
+        print('refresh, changed      : {:8.1f} ms, changed={} ({}), listener called={}'.format(
+            ms, changed, server.statuses[-1], len(notified) > 0))
+
+        server.delay = timeout + 1
+        changed, ms = timed(select.refresh)
+        print('refresh, server slow  : {:8.1f} ms, changed={} (timeout {} s)'.format(
+            ms, changed, timeout))
+    server.stop()
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:t:')
+    except:
+        print('Error: Invalid program arguments specified.')
+        exit(1)
+    delay = 0.2
+    timeout = 1.0
+    for opt, arg in opts:
+        if opt == '-d':
+            delay = float(arg) / 1000
+        elif opt == '-t':
+            timeout = float(arg)
+    main(delay, timeout)
@@ -4,30 +4,57 @@
 # Myrods-sync is a wrapper around irsync to provide a graphical user interface
 # While we brand the application as YodaSync, it should work with any iRODS zone
 #
+# With option --headless (or when a source and target are specified) a single
+# sync job is run without graphical user interface, see HeadlessSync
+# Sync jobs can also be submitted to a persistent queue (--submit), which is
+# processed by the GUI or by a headless run of the queue (--run-queue)
+#
+
+import time
+# used to measure the time until the window is first painted
+START_TIME = time.monotonic()
 
 PROGRAM_NAME = 'YodaSync'
 PROGRAM_VERSION = '0.3'
 CSS_FILE = 'myrods-sync.css'
 LOGO_FILE = 'UU_logo_2021_EN_RGB_transparant.png'
 ZONELIST_FILE = 'irods_zones_prd.json'
+COLLECTION_CACHE_TTL = 24 * 3600    # seconds
+SYNC_ENGINE = 'native'              # 'native' or 'irsync'
+SYNC_WORKERS = 4                    # concurrent transfers of the native engine
+SYNC_ADAPTIVE = False               # adapt the concurrent transfers to the throughput
+SYNC_BANDWIDTH_LIMIT = None         # schedule of MB/s caps per job, e.g. '08:00-18:00=20,0'
+SYNC_MAX_JOBS = 2                   # sync jobs that may run at the same time
+SYNC_MAX_CONNECTIONS = 32           # total connections of the running sync jobs
+CONNECTION_POOL_SIZE = 4            # iRODS sessions kept ready for transfers
+LOG_MAX_LINES = 10000               # lines kept in the synchronization log window
+FIRST_PAINT_BUDGET = 1.0            # seconds from start until the window shows
 DEBUG = True
 
-import gi
 import os
 from os.path import realpath, dirname
 import sys
 import getopt
 
-# GUI related imports, first check if user interface is compatible
-if not 'DISPLAY' in os.environ:
-    print('Error: This program requires a graphical user interface')
-    exit(1)
-gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
-from Application import *
+SHORT_OPTIONS = 'hivc:d:z:r:p:nbFwqa'
+LONG_OPTIONS = ['headless', 'concurrency=', 'direction=', 'zone=', 'report=',
+        'threshold=', 'chunk-size=', 'streams=', 'submit', 'priority=', 
+        'run-queue', 'queue', 'max-jobs=', 'max-connections=', 'metrics=',
+        'prometheus=', 'adaptive', 'bwlimit=', 'verify']
+QUEUE_OPTIONS = ['--submit', '--run-queue', '--queue']
 
 
 def main(opts, args):
+    global SYNC_ENGINE
+    headless = len(args) > 0
+    queue_action = None
+    for opt, arg in opts:
+        if opt == '-i':
+            SYNC_ENGINE = 'irsync'
+        if opt == '--headless':
+            headless = True
+        if opt in QUEUE_OPTIONS:
+            queue_action = opt
     program_dir = os.path.dirname(os.path.realpath(__file__))
     data = { 
           'program_name'     : PROGRAM_NAME,
@@ -36,9 +63,41 @@ def main(opts, args):
           'css_path'         : program_dir + '/' + CSS_FILE,
           'logo_path'        : program_dir + '/' + LOGO_FILE,
           'zonelist_location': program_dir + '/' + ZONELIST_FILE,
+          'collection_cache_ttl': COLLECTION_CACHE_TTL,
+          'sync_engine'      : SYNC_ENGINE,
+          'sync_workers'     : SYNC_WORKERS,
+          'sync_adaptive'    : SYNC_ADAPTIVE,
+          'bandwidth_limit'  : SYNC_BANDWIDTH_LIMIT,
+          'max_jobs'         : SYNC_MAX_JOBS,
+          'max_connections'  : SYNC_MAX_CONNECTIONS,
+          'connection_pool_size': CONNECTION_POOL_SIZE,
+          'log_max_lines'    : LOG_MAX_LINES,
+          'start_time'       : START_TIME,
+          'first_paint_budget': FIRST_PAINT_BUDGET,
           'opts' : opts,
           'args' : args
           }
+    if queue_action is not None:
+        from HeadlessSync import HeadlessSync
+        headless_sync = HeadlessSync(data)
+        if queue_action == '--submit':
+            exit(headless_sync.submit(opts, args))
+        if queue_action == '--run-queue':
+            exit(headless_sync.run_queue(opts))
+        exit(headless_sync.list_queue())
+    if headless:
+        from HeadlessSync import HeadlessSync
+        exit(HeadlessSync(data).run(opts, args))
+
+    # GUI related imports, first check if user interface is compatible
+    if not 'DISPLAY' in os.environ:
+        print('Error: This program requires a graphical user interface, '
+              'use --headless to sync without it')
+        exit(1)
+    import gi
+    gi.require_version("Gtk", "3.0")
+    from gi.repository import Gtk
+    from Application import Application
     if DEBUG:
         # just dump any exceptions on the console
         win = Application(data)
@@ -58,11 +117,58 @@ def main(opts, args):
 
 def help():
     text = '''
-    Usage: guisync [-hv]
+    Usage: guisync [-hiv]
+           guisync --headless [options] <source> <target>
+           guisync --submit [-p <priority>] [options] <source> <target>
+           guisync --run-queue [--max-jobs=<n>] [--max-connections=<n>]
+           guisync --queue
     
     Options:
      -h  show this help
+     -i  use irsync instead of the built-in sync engine
      -v  show program version
+
+    Headless options:
+     -d, --direction=upload|download   (default upload)
+                 upload: source is a local folder, target a collection
+                 download: source is a collection, target a local folder
+                 a collection path not starting with / is relative to home
+     -z, --zone=<zone>         configure the iRODS environment for a known zone
+     -c, --concurrency=<n>     number of concurrent transfers
+     -a, --adaptive            adapt the number of concurrent transfers to the
+                               observed throughput (-c sets the maximum,
+                               default 16)
+     --bwlimit=<schedule>      cap the data rate (MB/s), optionally per time of
+                               day, e.g. 50 or 08:00-18:00=20,100 (0 = no cap)
+                               the cap applies to each job separately
+     -r, --report=<file>       write a JSON report of the run (- for stdout)
+     -n  only show the plan (with an estimated duration), do not transfer data
+     --verify  compare the source and target by checksum, do not transfer data
+               (with -F the local checksums recorded in the manifest are not used)
+     -b  upload small files in bundles
+     -F  full check, compare all files with the remote tree despite the manifest
+     -w  keep watching the local folder and upload changes (upload only)
+     -q  do not list the transferred files
+     --threshold=<MB>   transfer files of at least this size in chunks
+     --chunk-size=<MB>  size of the chunks
+     --streams=<n>      number of concurrent streams per chunked file
+     --metrics=<file>   write the timings per phase, counters and iRODS call
+                        latencies of the run as JSON (also added to the report)
+     --prometheus=<file>  write these metrics for the Prometheus textfile
+                        collector (e.g. .../textfile_collector/myrods-sync.prom)
+
+    Job queue:
+     --submit           add the sync job to the queue instead of running it
+     -p, --priority=<n> jobs with a higher priority run first (default 0)
+     --run-queue        run the queued jobs until the queue is empty
+     --max-jobs=<n>     maximum number of jobs running at the same time
+     --max-connections=<n>  maximum number of connections of all running jobs
+     --queue            list the jobs in the queue
+
+    Exit codes (headless):
+     0 success, 1 invalid arguments, 2 no iRODS connection,
+     3 some files failed to transfer, 4 other error,
+     5 verification found files that differ, are missing or could not be checked
     '''
     print(text)
 
@@ -71,7 +177,7 @@ def help():
 if __name__ == "__main__":
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hv')
+        opts, args = getopt.getopt(sys.argv[1:], SHORT_OPTIONS, LONG_OPTIONS)
     except:
         print('Error: Invalid program arguments specified. Use -h for help.')
         exit(1)
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Tests of the upload of small files in bundles (SyncBundler), the download
+# of bundled files and the compaction of the bundle indexes, against the
+# in-memory stand-in of an iRODS session (see benchmarks/StandInSession)
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from StandInSession import StandInConnection
+from SyncEngine import SyncEngine, UPLOAD, DOWNLOAD, NEW, UNCHANGED
+from SyncBundler import SyncBundler, BUNDLE_COLLECTION
+
+REMOTE = '/standin/home/tester/small'
+OLD = 1000000000
+
+
+class SyncBundlerTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = StandInConnection()
+        self.zone = self.connection.zone
+        self.temp = tempfile.mkdtemp()
+        self.local = os.path.join(self.temp, 'local')
+        self.files = {}
+        for i in range(6):
+            relpath = 'dir{}/file{}.txt'.format(i % 2, i)
+            self.files[relpath] = 'content of file {}'.format(i).encode('ascii')
+            self.write(relpath, self.files[relpath])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def write(self, relpath, data):
+        path = os.path.join(self.local, *relpath.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (OLD, OLD))
+
+    def sync(self, direction, local=None, bundler=None):
+        engine = SyncEngine(self.connection, local or self.local, REMOTE,
+                direction, bundler = bundler)
+        plan = engine.plan()
+        self.assertTrue(engine.execute(plan))
+        return plan
+
+    def upload_bundled(self):
+        # three files per bundle
+        return self.sync(UPLOAD, bundler = SyncBundler(bundle_size = 60))
+
+    def bundle_objects(self, extension):
+        prefix = REMOTE + '/' + BUNDLE_COLLECTION + '/'
+        return sorted([ path[len(prefix):] for path in self.zone.objects
+                        if path.startswith(prefix) and path.endswith(extension) ])
+
+    def downloaded(self):
+        target = os.path.join(self.temp, 'download')
+        os.mkdir(target)
+        self.sync(DOWNLOAD, target)
+        files = {}
+        for folder, dirs, names in os.walk(target):
+            for name in names:
+                path = os.path.join(folder, name)
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, target).replace(os.sep, '/')] = f.read()
+        return files
+
+    def test_upload_in_bundles(self):
+        plan = self.upload_bundled()
+        self.assertEqual(plan.count(NEW), 6)
+        self.assertEqual(len(self.bundle_objects('.tar')), 2)
+        self.assertEqual(len(self.bundle_objects('.json')), 2)
+        # no individual data objects
+        self.assertEqual(len(self.zone.objects), 4)
+        plan = SyncEngine(self.connection, self.local, REMOTE, UPLOAD).plan()
+        self.assertEqual(plan.count(UNCHANGED), 6)
+
+    def test_download_bundled_files(self):
+        self.upload_bundled()
+        self.assertEqual(self.downloaded(), self.files)
+
+    def test_indexes_are_compacted(self):
+        self.upload_bundled()
+        self.sync(UPLOAD)
+        self.assertEqual(len(self.bundle_objects('.tar')), 2)
+        self.assertEqual(len(self.bundle_objects('.json')), 1)
+        self.assertEqual(self.downloaded(), self.files)
+
+    def test_superseded_bundles_are_removed(self):
+        self.upload_bundled()
+        for relpath in self.files:
+            self.files[relpath] += b' changed'
+            self.write(relpath, self.files[relpath])
+        # the changed files are uploaded individually
+        self.sync(UPLOAD)
+        self.assertEqual(len(self.bundle_objects('.tar')), 2)
+        # the next run finds all members superseded
+        self.sync(UPLOAD)
+        self.assertEqual(self.bundle_objects('.tar'), [])
+        self.assertEqual(self.bundle_objects('.json'), [])
+        self.assertEqual(self.downloaded(), self.files)
+
+
+if __name__ == '__main__':
+    unittest.main()
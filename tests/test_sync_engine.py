@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Tests of the planning and the (chunked) transfers of SyncEngine, against
+# the in-memory stand-in of an iRODS session (see benchmarks/StandInSession)
+#
+# Run from the program directory:  python3 -m unittest discover tests
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from StandInSession import StandInConnection, StandInFile
+from SyncEngine import SyncEngine, FileInfo, UPLOAD, DOWNLOAD, NEW, CHANGED, \
+        UNCHANGED, better_replica
+from SyncManifest import SyncManifest
+from ChunkedTransfer import ChunkedTransfer, BUFFER_SIZE, PARTIAL_SUFFIX
+
+HOME = '/standin/home/tester'
+# modification time of local files that are older than any data object
+OLD = 1000000000
+
+
+class SyncEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = StandInConnection()
+        self.zone = self.connection.zone
+        self.temp = tempfile.mkdtemp()
+        self.local = os.path.join(self.temp, 'local')
+        os.mkdir(self.local)
+        self.manifest = None
+
+    def tearDown(self):
+        if self.manifest is not None:
+            self.manifest.close()
+        shutil.rmtree(self.temp)
+
+    def engine(self, remote, direction, **options):
+        return SyncEngine(self.connection, self.local, remote, direction,
+                **options)
+
+    def new_manifest(self, remote):
+        self.manifest = SyncManifest(self.local, remote,
+                os.path.join(self.temp, 'manifest.sqlite'))
+        return self.manifest
+
+    def write(self, relpath, data, mtime=OLD):
+        path = os.path.join(self.local, *relpath.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def read(self, relpath):
+        with open(os.path.join(self.local, *relpath.split('/')), 'rb') as f:
+            return f.read()
+
+    def statuses(self, plan):
+        return dict([ (item.relpath, item.status) for item in plan.items ])
+
+
+class PlanTest(SyncEngineTest):
+    def test_upload_plan(self):
+        remote = HOME + '/data'
+        self.zone.add_object(remote + '/same.txt', b'same')
+        self.zone.add_object(remote + '/other.txt', b'other')
+        self.write('same.txt', b'same')
+        self.write('other.txt', b'changed content')
+        self.write('sub/new.txt', b'new')
+        plan = self.engine(remote, UPLOAD).plan()
+        self.assertEqual(self.statuses(plan), { 'same.txt': UNCHANGED,
+                'other.txt': CHANGED, 'sub/new.txt': NEW })
+        self.assertEqual(plan.folders, ['sub'])
+
+    def test_download_plan_ignores_siblings_matched_by_wildcards(self):
+        # LIKE treats '_' as a wildcard, 'a_b/%' also matches 'aXb/...'
+        remote = HOME + '/a_b'
+        self.zone.add_object(remote + '/sub/x.txt', b'x')
+        self.zone.add_object(HOME + '/aXb/sub/y.txt', b'y')
+        self.zone.add_object(HOME + '/a_b_c/z.txt', b'z')
+        plan = self.engine(remote, DOWNLOAD).plan()
+        self.assertEqual(self.statuses(plan), { 'sub/x.txt': NEW })
+        self.assertEqual(plan.folders, ['sub'])
+
+    def test_download_plan_ignores_percent_in_root(self):
+        remote = HOME + '/100%'
+        self.zone.add_object(remote + '/x.txt', b'x')
+        self.zone.add_object(HOME + '/100%done/sub/y.txt', b'y')
+        plan = self.engine(remote, DOWNLOAD).plan()
+        self.assertEqual(list(self.statuses(plan)), ['x.txt'])
+
+    def test_good_replica_is_preferred(self):
+        good = FileInfo(4, OLD, 'sha2:good', replica_status = '1')
+        stale = FileInfo(4, OLD, 'sha2:stale', replica_status = '0')
+        unknown = FileInfo(4, OLD, None, replica_status = '1')
+        self.assertTrue(better_replica(good, stale))
+        self.assertFalse(better_replica(stale, good))
+        self.assertTrue(better_replica(good, unknown))
+        self.assertFalse(better_replica(unknown, good))
+
+
+class ChunkedTransferTest(SyncEngineTest):
+    def setUp(self):
+        super().setUp()
+        self.remote = HOME + '/big'
+        self.data = os.urandom(4 * BUFFER_SIZE)
+        self.zone.add_object(self.remote + '/big.dat', self.data)
+
+    def download_engine(self):
+        chunked = ChunkedTransfer(self.connection, BUFFER_SIZE, BUFFER_SIZE, 1)
+        return self.engine(self.remote, DOWNLOAD, chunked = chunked,
+                manifest = self.new_manifest(self.remote))
+
+    # runs a sync of which the data transfer breaks down after reads, as if
+    # the process were killed: the journal is kept, no retry succeeds
+    def interrupted_sync(self, engine, reads):
+        read = StandInFile.read
+        count = [0]
+        def failing_read(stream, size=-1):
+            count[0] += 1
+            if count[0] > reads:
+                raise IOError('connection lost')
+            return read(stream, size)
+        with mock.patch.object(StandInFile, 'read', failing_read), \
+                mock.patch.object(self.manifest, 'forget_chunks'), \
+                mock.patch('TransferScheduler.RETRY_DELAY', 0):
+            self.assertFalse(engine.execute(engine.plan()))
+
+    def test_chunked_download(self):
+        engine = self.download_engine()
+        self.assertTrue(engine.execute(engine.plan()))
+        self.assertEqual(self.read('big.dat'), self.data)
+        self.assertEqual(os.listdir(self.local), ['big.dat'])
+        self.assertEqual(self.manifest.pending_chunks(), set())
+
+    def test_interrupted_download_keeps_local_file(self):
+        self.write('big.dat', b'old content')
+        engine = self.download_engine()
+        self.interrupted_sync(engine, 2)
+        self.assertEqual(self.read('big.dat'), b'old content')
+        self.assertIn('big.dat' + PARTIAL_SUFFIX, os.listdir(self.local))
+
+    def test_interrupted_download_is_planned_and_resumed(self):
+        self.write('big.dat', bytes(len(self.data)))
+        engine = self.download_engine()
+        self.interrupted_sync(engine, 2)
+        self.assertEqual(self.manifest.pending_chunks(), set(['big.dat']))
+        # a local copy of the same size, newer than the data object
+        os.utime(os.path.join(self.local, 'big.dat'))
+        plan = engine.plan()
+        self.assertEqual(self.statuses(plan), { 'big.dat': CHANGED })
+        reads = []
+        read = StandInFile.read
+        def counting_read(stream, size=-1):
+            reads.append(size)
+            return read(stream, size)
+        with mock.patch.object(StandInFile, 'read', counting_read):
+            self.assertTrue(engine.execute(plan))
+        # only the chunks that were missing have been transferred
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(self.read('big.dat'), self.data)
+        self.assertEqual(os.listdir(self.local), ['big.dat'])
+        self.assertEqual(self.manifest.pending_chunks(), set())
+        self.assertEqual(self.statuses(engine.plan()), { 'big.dat': UNCHANGED })
+
+    def test_interrupted_upload_is_resumed(self):
+        self.write('up.dat', self.data)
+        remote = HOME + '/up'
+        chunked = ChunkedTransfer(self.connection, BUFFER_SIZE, BUFFER_SIZE, 1)
+        engine = self.engine(remote, UPLOAD, chunked = chunked,
+                manifest = self.new_manifest(remote))
+        write = StandInFile.write
+        count = [0]
+        def failing_write(stream, data):
+            count[0] += 1
+            if count[0] > 2:
+                raise IOError('connection lost')
+            return write(stream, data)
+        with mock.patch.object(StandInFile, 'write', failing_write), \
+                mock.patch.object(self.manifest, 'forget_chunks'), \
+                mock.patch('TransferScheduler.RETRY_DELAY', 0):
+            self.assertFalse(engine.execute(engine.plan()))
+        self.assertEqual(self.manifest.pending_chunks(), set(['up.dat']))
+        plan = engine.plan()
+        self.assertEqual(self.statuses(plan), { 'up.dat': CHANGED })
+        self.assertTrue(engine.execute(plan))
+        self.assertEqual(bytes(self.zone.objects[remote + '/up.dat'][0]),
+                self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# (c) 2022 Ton Smeele - Utrecht University
+#
+# Tests of the verification of a sync pair by checksum (SyncVerifier), against
+# the in-memory stand-in of an iRODS session (see benchmarks/StandInSession)
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from StandInSession import StandInConnection
+from SyncEngine import SyncEngine, UPLOAD
+from SyncManifest import SyncManifest
+from SyncVerifier import SyncVerifier, VERIFIED, MISMATCH, MISSING, summary
+
+HOME = '/standin/home/tester'
+REMOTE = HOME + '/data'
+
+
+class SyncVerifierTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = StandInConnection()
+        self.zone = self.connection.zone
+        self.temp = tempfile.mkdtemp()
+        self.local = os.path.join(self.temp, 'local')
+        os.mkdir(self.local)
+        self.manifest = SyncManifest(self.local, REMOTE,
+                os.path.join(self.temp, 'manifest.sqlite'))
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.temp)
+
+    def write(self, relpath, data):
+        path = os.path.join(self.local, *relpath.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def verify(self, remote=REMOTE, full_check=False):
+        engine = SyncEngine(self.connection, self.local, remote, UPLOAD,
+                manifest = self.manifest)
+        items = SyncVerifier(engine, 2, full_check).verify()
+        return dict([ (item.relpath, item.status) for item in items ])
+
+    def test_verify(self):
+        self.write('same.txt', b'same')
+        self.write('sub/same.txt', b'also the same')
+        self.write('differs.txt', b'local')
+        self.write('size.txt', b'short')
+        self.write('missing.txt', b'missing')
+        self.zone.add_object(REMOTE + '/same.txt', b'same')
+        self.zone.add_object(REMOTE + '/sub/same.txt', b'also the same')
+        self.zone.add_object(REMOTE + '/differs.txt', b'other')
+        self.zone.add_object(REMOTE + '/size.txt', b'much longer')
+        self.assertEqual(self.verify(), {
+                'same.txt': VERIFIED, 'sub/same.txt': VERIFIED,
+                'differs.txt': MISMATCH, 'size.txt': MISMATCH,
+                'missing.txt': MISSING })
+        # the server has registered the checksums that were missing
+        self.assertIn(REMOTE + '/same.txt', self.zone.checksums)
+
+    def test_checksums_are_reused(self):
+        self.write('a.txt', b'a')
+        self.zone.add_object(REMOTE + '/a.txt', b'a')
+        self.assertEqual(self.verify(), { 'a.txt': VERIFIED })
+        # a changed remote copy is found, the local checksum comes from the
+        # manifest as the local file has not changed
+        self.zone.add_object(REMOTE + '/a.txt', b'b')
+        self.assertEqual(self.verify(), { 'a.txt': MISMATCH })
+        self.assertEqual(self.verify(full_check = True), { 'a.txt': MISMATCH })
+
+    def test_siblings_matched_by_wildcards_are_ignored(self):
+        remote = HOME + '/a_b'
+        self.write('sub/x.txt', b'x')
+        # (the sibling is listed first)
+        self.zone.add_object(HOME + '/aXb/sub/x.txt', b'not x')
+        self.zone.add_object(remote + '/sub/x.txt', b'x')
+        self.assertEqual(self.verify(remote), { 'sub/x.txt': VERIFIED })
+
+    def test_summary(self):
+        self.write('a.txt', b'abc')
+        self.zone.add_object(REMOTE + '/a.txt', b'abc')
+        engine = SyncEngine(self.connection, self.local, REMOTE, UPLOAD)
+        result = summary(SyncVerifier(engine, 1).verify())
+        self.assertEqual(result['verified'], 1)
+        self.assertEqual(result['bytes'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()